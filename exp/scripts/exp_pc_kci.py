@@ -1,3 +1,5 @@
+import numpy as np
+
 from exp_assistant import (
     # Precreated datasets/true DAGs
     MID_VAR_TRUE_DAG,
@@ -45,6 +47,41 @@ def independence_test_comparison(processes: int = 50):
     bstrcomp.run_comparison()
     bstrcomp.pickle()
 
+def approximate_kci_comparison(processes: int = 50, ranks: tuple[int] = (25, 100, 400)):
+    """
+    Compare the EPMs of PC with approximate KCI tests of increasing rank 
+        against the exact KCI test.
+    """
+    bstrcomp = BootstrapComparison("PC-ApproxKCIComparison")
+    indep_tests = [("KCI", "kci", None)]
+    indep_tests += [(f"RFF-KCI (rank {rank})", "rff_kci", rank) for rank in ranks]
+    indep_tests += [(f"Nystroem-KCI (rank {rank})", "nystroem_kci", rank) for rank in ranks]
+    for name, indep_test, rank in indep_tests:
+        bstrcomp.add_bootstrap(
+            Bootstrap(
+                    name=name,
+                    true_dag=MID_VAR_TRUE_DAG,
+                    algorithm=PC(alpha=ALPHA, indep_test=indep_test, kernel_rank=rank or 100),
+                    data_to_bootstrap_from=MID_VAR_UNIFORM_REFERENCE,
+                    sample_sizes=DEFAULT_DATA_SIZE,
+                    nr_bootstraps=NR_BOOTSTRAPS,
+                    PROCESSES=processes 
+            )
+        )
+    bstrcomp.run_comparison()
+    bstrcomp.pickle()
+
+    # Summary: Distance of each EPM to the exact one and average runtime
+    exact, *approximations = bstrcomp.get_bootstraps()
+    exact_epm = exact.get_avg_avg_cons_extension().values
+    print(f"{exact.get_bootstrap_name()}: runtime {exact.get_avg_runtime():.2f}s")
+    for bstrp in approximations:
+        difference = np.abs(bstrp.get_avg_avg_cons_extension().values - exact_epm)
+        print(f"{bstrp.get_bootstrap_name()}: runtime {bstrp.get_avg_runtime():.2f}s, "
+              f"mean/max absolute EPM difference {difference.mean():.3f}/{difference.max():.3f}")
+
+
 if __name__ == "__main__":
     # Necessary trick: Run as many processes as bootstraps!
-    independence_test_comparison(processes=NR_BOOTSTRAPS)
\ No newline at end of file
+    independence_test_comparison(processes=NR_BOOTSTRAPS)
+    approximate_kci_comparison(processes=NR_BOOTSTRAPS)
@@ -8,16 +8,24 @@ from typing import Iterable
 import numpy as np
 import pandas as pd
 from functools import wraps
+import inspect
 
 # Own 
 from ..util import pool_dfs, measure_time, same_columns
 from . import ut_igsp
+from .suffstats import SuffStats
+from .pc_stable import pc_stable, parallel_pc_stable
+from .kernel_tests import WeightedKCI, ApproxKCI, DEFAULT_KERNEL_CACHE_BYTES
 
 # Third party
 from sempler.utils import dag_to_cpdag
 from causallearn.search.ConstraintBased.PC import pc
+from causallearn.utils.cit import CIT, FisherZ
+from causallearn.utils.PCUtils import SkeletonDiscovery, UCSepset, Meek
 import ges
+from ges.scores.gauss_obs_l0_pen import GaussObsL0Pen
 import gies
+from gies.scores.gauss_int_l0_pen import GaussIntL0Pen
 import gnies
 from notears.linear import notears_linear
 from golempckg import fit_golem, postprocess
@@ -25,6 +33,10 @@ from CausalDisco.baselines import var_sort_regress, r2_sort_regress
 import causalicp
 
 
+# Options of PC's indep_test backed by ApproxKCI, mapped to its approximation
+_APPROX_KCI_TESTS = {"rff_kci": "rff", "nystroem_kci": "nystroem"}
+
+
 #------------------------------------------------------
 #------------------------------------------------------
 # Helper
@@ -62,6 +74,54 @@ def return_cpdag_if_wanted(flag_name):
     return decorator
 
 
+class _SuffStatGaussObsL0Pen(GaussObsL0Pen):
+    """BIC score of ges.fit_bic, built from pooled sufficient statistics instead of data."""
+    def __init__(self, suffstats: SuffStats):
+        super(GaussObsL0Pen, self).__init__(data=None) # Skips copying the data
+        pooled = suffstats.pool()
+        self.n = int(pooled.get_n_obs()[0])
+        self.p = len(suffstats.get_variables())
+        self.lmbda = 0.5 * np.log(self.n)
+        self.method = 'scatter'
+        self._scatter = pooled.get_covariances()[0]
+
+
+class _SuffStatGaussIntL0Pen(GaussIntL0Pen):
+    """BIC score of gies.fit_bic, built from per-environment sufficient statistics instead of data."""
+    def __init__(self, suffstats: SuffStats, interv: list[list[int]]):
+        super(GaussIntL0Pen, self).__init__(data=None, interv=interv) # Skips copying the data
+        self.p = len(suffstats.get_variables())
+        self.n_obs = suffstats.get_n_obs()
+        self.sample_cov = suffstats.get_covariances()
+        self.N = sum(self.n_obs)
+        self.lmbda = 0.5 * np.log(self.N)
+        for j in range(self.p):
+            if sum(i.count(j) for i in self.interv) == len(self.n_obs):
+                raise ValueError("The family of targets is not conservative")
+        # Number of non-interventions and partial covariance matrix per variable, as in GaussIntL0Pen
+        self.num_not_interv = np.zeros(self.p)
+        self.part_sample_cov = np.zeros((self.p, self.p, self.p))
+        for k in range(self.p):
+            for (i, n) in enumerate(self.n_obs):
+                if k not in set(self.interv[i]):
+                    self.num_not_interv[k] += n
+                    self.part_sample_cov[k] += self.sample_cov[i] * n
+            self.part_sample_cov[k] = self.part_sample_cov[k] / self.num_not_interv[k]
+
+
+class _SuffStatFisherZ(FisherZ):
+    """Fisher-z test of causal-learn, built from pooled sufficient statistics instead of data."""
+    def __init__(self, suffstats: SuffStats):
+        # Attributes otherwise set by CIT_Base from the data
+        self.data = None
+        self.cache_path = None
+        self.pvalue_cache = {}
+        self.method = 'fisherz'
+        self.sample_size = int(suffstats.get_n_obs().sum())
+        self.num_features = len(suffstats.get_variables())
+        self.correlation_matrix = suffstats.pooled_correlation()
+
+
 #------------------------------------------------------
 #------------------------------------------------------
 # Abstract base class
@@ -97,6 +157,36 @@ class Algorithm(ABC):
         """
         pass
 
+    def supports_suffstats(self) -> bool:
+        """
+        Whether the algorithm, with its hyperparameters, depends on the data 
+            only through its SuffStats and can thus be fitted by fit_suffstats.
+        """
+        return False
+
+    def fit_suffstats(self, suffstats: SuffStats) -> list[pd.DataFrame, float]:
+        """
+        Fits the algorithm to the data summarized by the passed sufficient 
+            statistics, giving the same result as fit. Only available if 
+            supports_suffstats returns True.
+
+        Args:
+            suffstats (SuffStats): Sufficient statistics of the data, one
+                environment per DataFrame that would be passed to fit.
+
+        Returns:
+            tuple[float, pd.DataFrame]: See fit.
+        """
+        raise NotImplementedError(f"{self._alg_name} cannot be fitted to sufficient statistics.")
+
+    def get_hyperparameters(self) -> dict:
+        """
+        Hyperparameters of the algorithm by name, i.e. the arguments of the
+            subclass' __init__, which stores each of them as attribute '_<name>'.
+        """
+        return {name: getattr(self, f"_{name}") 
+                for name in inspect.signature(type(self).__init__).parameters if name != "self"}
+
 
 #------------------------------------------------------
 #------------------------------------------------------
@@ -109,7 +199,9 @@ class Algorithm(ABC):
 class PC(Algorithm):
     """Encapsulates PC implementation from causal-learn package."""
 
-    def __init__(self, alpha: float, indep_test= "fisherz"):
+    def __init__(self, alpha: float, indep_test= "fisherz", compress_duplicates: bool = True,
+                 kernel_rank: int = 100, kernel_cache_bytes: int = DEFAULT_KERNEL_CACHE_BYTES,
+                 native: bool = False, n_jobs: int = 1):
         """
         Initialize with wanted hyperparameters.
 
@@ -121,16 +213,60 @@ class PC(Algorithm):
                 - "chisq": Chi-squared conditional independence test
                 - "gsq": G-squared conditional independence test
                 - "kci": Kernel-based conditional independence test
+                - "rff_kci": KCI approximated by random Fourier features
+                - "nystroem_kci": KCI approximated by Nystroem features
                 Defaults to "fisherz".
+            compress_duplicates (bool, optional): Whether the "kci" test 
+                is evaluated on the unique rows weighted by their multiplicities,
+                see kernel_tests.WeightedKCI. Gives the same result faster on
+                bootstrap samples. Defaults to True.
+            kernel_rank (int, optional): Number of features of the approximate
+                KCI tests, see kernel_tests.ApproxKCI. Their cost is linear in 
+                the sample size and quadratic in the rank. Defaults to 100.
+            kernel_cache_bytes (int, optional): Memory budget of the kernel
+                matrices the "kci" tests of one fit share when compress_duplicates
+                is set, see kernel_tests.KernelCache. Defaults to 256 MiB.
+            native (bool, optional): Whether the "fisherz" test runs on the 
+                vectorized PC-stable of pc_stable instead of causal-learn's pc.
+                Gives the same result faster. Defaults to False.
+            n_jobs (int, optional): Number of threads the tests of each depth
+                of the skeleton search are spread over, see 
+                pc_stable.parallel_pc_stable. The search is order-independent,
+                so the result does not change. Does not apply to the native 
+                "fisherz" test, which is batched instead. Only set it beyond the
+                threads a worker process is granted (see thread_limits), else the
+                threads oversubscribe the cores. Defaults to 1, i.e. causal-learn's
+                sequential skeleton search.
         """
+        if n_jobs < 1:
+            raise ValueError("n_jobs must be at least 1.")
         super().__init__(alg_name=self.__class__.__name__)
         self._alpha = alpha
         self._indep_test = indep_test
+        self._compress_duplicates = compress_duplicates
+        self._kernel_rank = kernel_rank
+        self._kernel_cache_bytes = kernel_cache_bytes
+        self._native = native
+        self._n_jobs = n_jobs
 
     @measure_time
     def fit(self, data: Iterable[pd.DataFrame]) -> list[pd.DataFrame, float]:
         """See superclass fit fct. for documentation."""
         pooled_data = pool_dfs(data)
+        if self._indep_test == "fisherz" and self._native:
+            pc_graph = pc_stable(np.corrcoef(pooled_data.values.T), len(pooled_data), self._alpha)
+            return self._transform_to_adj_mat(pc_graph, data[0].columns)
+        if self._indep_test == "kci" and self._compress_duplicates:
+            indep_test = WeightedKCI(pooled_data.values, cache_bytes=self._kernel_cache_bytes)
+            return self._run_pc(pooled_data.values, indep_test, data[0].columns)
+        if self._indep_test in _APPROX_KCI_TESTS:
+            indep_test = ApproxKCI(pooled_data.values, 
+                                   approximation=_APPROX_KCI_TESTS[self._indep_test],
+                                   rank=self._kernel_rank)
+            return self._run_pc(pooled_data.values, indep_test, data[0].columns)
+        if self._n_jobs > 1:
+            indep_test = CIT(pooled_data.values, self._indep_test)
+            return self._run_pc(pooled_data.values, indep_test, data[0].columns)
         pc_model = pc(
             data=pooled_data.values,
             alpha=self._alpha,
@@ -141,6 +277,37 @@ class PC(Algorithm):
         var = data[0].columns
         return self._transform_to_adj_mat(pc_graph, var)
 
+    def supports_suffstats(self) -> bool:
+        """Only the Fisher-z test depends on the data through its covariance alone."""
+        return self._indep_test == "fisherz"
+
+    @measure_time
+    def fit_suffstats(self, suffstats: SuffStats) -> list[pd.DataFrame, float]:
+        """See superclass fit_suffstats fct. for documentation."""
+        if not self.supports_suffstats():
+            raise NotImplementedError(f"PC with indep_test='{self._indep_test}' requires the data.")
+        if self._native:
+            pc_graph = pc_stable(suffstats.pooled_correlation(), suffstats.get_n_obs().sum(), self._alpha)
+            return self._transform_to_adj_mat(pc_graph, suffstats.get_variables())
+        # The data is only used for its shape
+        nr_var = len(suffstats.get_variables())
+        return self._run_pc(np.empty((0, nr_var)), _SuffStatFisherZ(suffstats), suffstats.get_variables())
+
+    def _run_pc(self, data: np.ndarray, indep_test, var: list[str]) -> pd.DataFrame:
+        """Steps of causal-learn's pc with its default options, using the passed test object."""
+        if self._n_jobs > 1:
+            pc_graph = parallel_pc_stable(indep_test, data.shape[1], self._alpha, self._n_jobs)
+            return self._transform_to_adj_mat(pc_graph, var)
+        skeleton = SkeletonDiscovery.skeleton_discovery(
+            data, 
+            self._alpha, 
+            indep_test,
+            stable=True,
+            show_progress=False
+        )
+        pc_model = Meek.meek(UCSepset.uc_sepset(skeleton, 2))
+        return self._transform_to_adj_mat(pc_model.G.graph, var)
+
     def _transform_to_adj_mat(self, pc_graph: np.ndarray, var: list[str]):
         """Turns causal-learn adj. matrix into format required by 'Algorithm' API."""
         adj_matrix = np.zeros_like(pc_graph)
@@ -177,7 +344,10 @@ class UT_IGSP(Algorithm):
                  debug=0, 
                  completion="gnies", 
                  test="hsic", 
-                 obs_idx=0):
+                 obs_idx=0,
+                 compress_duplicates=True,
+                 kernel_rank=100,
+                 kernel_cache_bytes=DEFAULT_KERNEL_CACHE_BYTES):
         """
         Initialize UT_IGSP object with desired hyperparameters.
 
@@ -186,10 +356,21 @@ class UT_IGSP(Algorithm):
             alpha_inv (float): Level of test that two Gaussians are equal.
             completion (str, optional): What equivalence class to compute
                 based on UT-IGSP's output. Defaults to "gnies".
-            test (str, optional): What test to use. Options: "hsic", "gauss".
-                Defaults to "hsic".
+            test (str, optional): What test to use. Options: "hsic", "gauss" and
+                "hsic_rff", HSIC approximated by random Fourier features, see
+                kernel_tests.approx_hsic_test. Defaults to "hsic".
             obs_idx (int, optional): The index of the observational data in the
                 passed list of dataframes. Defaults to 0.
+            compress_duplicates (bool, optional): Whether the "hsic" tests are
+                evaluated on the unique rows weighted by their multiplicities,
+                see kernel_tests.weighted_hsic_test. Gives the same result 
+                faster on bootstrap samples. Defaults to True.
+            kernel_rank (int, optional): Number of random Fourier features of
+                the "hsic_rff" tests. Defaults to 100.
+            kernel_cache_bytes (int, optional): Memory budget of the kernel 
+                matrices and residuals the "hsic" tests of one fit share when
+                compress_duplicates is set, see kernel_tests.KernelCache. 
+                Defaults to 256 MiB.
         """
         super().__init__(self.__class__.__name__)
         self._alpha_ci = alpha_ci
@@ -198,6 +379,9 @@ class UT_IGSP(Algorithm):
         self._completion = completion
         self._test = test
         self._obs_idx = obs_idx
+        self._compress_duplicates = compress_duplicates
+        self._kernel_rank = kernel_rank
+        self._kernel_cache_bytes = kernel_cache_bytes
 
     @measure_time
     def fit(self, data: Iterable[pd.DataFrame]) -> list[pd.DataFrame, float]:
@@ -211,7 +395,10 @@ class UT_IGSP(Algorithm):
             debug=self._debug, 
             completion=self._completion,
             test=self._test,
-            obs_idx=self._obs_idx
+            obs_idx=self._obs_idx,
+            compress_duplicates=self._compress_duplicates,
+            kernel_rank=self._kernel_rank,
+            kernel_cache_bytes=self._kernel_cache_bytes
         )
         fitted_icpdag = ut_fit[0] # Get ICPDAG
         var = data[0].columns
@@ -250,6 +437,24 @@ class GES(Algorithm):
         var = pooled_data.columns
         return pd.DataFrame(est_adj_mat, index=var, columns=var)
 
+    def supports_suffstats(self) -> bool:
+        return True
+
+    @measure_time
+    def fit_suffstats(self, suffstats: SuffStats) -> list[pd.DataFrame, float]:
+        """See superclass fit_suffstats fct. for documentation."""
+        score = _SuffStatGaussObsL0Pen(suffstats)
+        est_adj_mat, _ = ges.fit(
+            score,
+            completion_algorithm=None,
+            A0=np.zeros((score.p, score.p)),
+            phases=self._phases,
+            iterate=self._iterate,
+            debug=self._debug
+        )
+        var = suffstats.get_variables()
+        return pd.DataFrame(est_adj_mat, index=var, columns=var)
+
 
 class GIES(Algorithm):
     """Encapsulates GIES implementation from gies package."""
@@ -296,6 +501,29 @@ class GIES(Algorithm):
         )
         return pd.DataFrame(estimate, index=variables, columns=variables)
 
+    def supports_suffstats(self) -> bool:
+        return True
+
+    @measure_time
+    def fit_suffstats(self, suffstats: SuffStats) -> list[pd.DataFrame, float]:
+        """See superclass fit_suffstats fct. for documentation."""
+        if len(self._interventions) != suffstats.get_nr_environments():
+            raise ValueError("Data size differs from intervention size.")
+        variables = suffstats.get_variables()
+        if not all(var in variables for inner_list in self._interventions for var in inner_list):
+            raise ValueError("Unknown intervention targets")
+        # Transform strings to indices 
+        interventions = [[variables.index(var) for var in inner_list] for inner_list in self._interventions]
+        score = _SuffStatGaussIntL0Pen(suffstats, interventions)
+        estimate, _ = gies.fit(
+            score,
+            A0=np.zeros((score.p, score.p)) if self._A0 is None else self._A0,
+            phases=self._phases,
+            iterate=self._iterate,
+            debug=self._debug
+        )
+        return pd.DataFrame(estimate, index=variables, columns=variables)
+
 
 class GNIES(Algorithm):
     """Encapsulates GNIES implementation from gnies package."""
@@ -5,20 +5,31 @@ Class 'BootstrapComparison' to compare Bootstrap instances.
 """
 
 # Standard 
-from typing import Iterable
+from typing import Iterable, Iterator
 import numpy as np
 import pandas as pd
-import multiprocessing
 import copy
 import logging
+import hashlib
+import contextlib
+import itertools
+from fractions import Fraction
 
 # Third party
 
 # Own
 from .savable import Pickable
 from .algorithms import Algorithm
-from ..util import same_columns, bootstrap_sample, same_order, variables_increase, standardize_dfs
-from .causal_inference_task import CausalInferenceTask
+from ..util import (same_columns, bootstrap_indices, bootstrap_weights, bootstrap_counts, same_order, 
+                    variables_increase, standardize_dfs, absolute_sample_size)
+from .causal_inference_task import CausalInferenceTask, TaskResult, _EXTENSION_OPTIONS
+from .shared_data import SharedDatasets
+from .dispatch import TaskContext, TaskSpec, init_worker, run_task_spec, WEIGHTED_RESAMPLING
+from .checkpoint import TaskCheckpoint
+from .executor import TaskExecutor, TASK_DONE, TASK_TIMED_OUT, TASK_MEMORY_EXCEEDED
+from .scheduling import CostModel, lpt_order
+from .thread_limits import ThreadPolicy
+from .suffstats import SuffStats
 
 
 logging.basicConfig(
@@ -26,13 +37,127 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# How bootstrap samples can be represented in the CausalInferenceTasks
+_RESAMPLING_OPTIONS = ("dataframe", "index", *WEIGHTED_RESAMPLING)
+# How CausalInferenceTasks are sent to the worker processes
+_DISPATCH_OPTIONS = ("task", "shared_memory", "seed")
+# Number of bootstrap samples whose sufficient statistics are computed at once
+_SUFFSTATS_BATCH_SIZE = 64
 
-def parallel_fit(task: CausalInferenceTask):
-    """Used for multiprocessing."""
+
+def parallel_fit(spec_and_task: tuple[TaskSpec, CausalInferenceTask]) -> TaskResult:
+    """Used for multiprocessing, only the compact TaskResult is sent back."""
+    spec, task = spec_and_task
     logging.info("Started fitting a causal_inference_task in parallel_fit.")
     fitted_task = task.run_task()
     logging.info("Fitted a causal_inference_task in parallel_fit.")
-    return fitted_task
+    return fitted_task.to_result(replicate=spec.replicate, seed=spec.seed)
+
+
+class _ExactSum:
+    """
+    Sum of floats or float arrays that is exact, and thereby independent of
+        the order in which they are added. Every finite float is an integer
+        multiple of 2**-1074, so they are summed as integers; non-finite
+        values are summed separately as floats.
+    """
+    _SCALE = 1074
+
+    def __init__(self):
+        self._total = 0 # Python int or object array of Python ints
+        self._nonfinite = 0.0
+
+    def add(self, value):
+        value = np.asarray(value, dtype=float)
+        finite = np.isfinite(value)
+        self._total = self._total + np.vectorize(self._scaled, otypes=[object])(np.where(finite, value, 0.0))
+        self._nonfinite = self._nonfinite + np.where(finite, 0.0, value)
+
+    def get_mean(self, count: int):
+        """Sum divided by count, correctly rounded."""
+        mean = np.vectorize(lambda total: float(Fraction(total, count << self._SCALE)), otypes=[float])(self._total)
+        mean = mean + self._nonfinite / count
+        return mean if mean.ndim > 0 else float(mean)
+
+    @classmethod
+    def _scaled(cls, value: float) -> int:
+        numerator, denominator = float(value).as_integer_ratio()
+        return numerator << (cls._SCALE - denominator.bit_length() + 1)
+
+
+class _RunningAverages:
+    """
+    Folds the TaskResults of fitted CausalInferenceTasks into running sums.
+    Results are folded in the order they arrive, nothing is buffered. The 
+        sums are exact, so the averages do not depend on the order in which
+        the worker processes finish or on which results were checkpointed.
+    """
+    def __init__(self):
+        self._count = 0
+        self._cons_extension_sum = _ExactSum()
+        self._cons_extension_count = 0
+        self._runtime_sum = _ExactSum()
+        self._no_cons_extensions_sum = 0
+        self._alg_crashed_sum = 0
+        self._timed_out_sum = 0
+        self._memory_exceeded_sum = 0
+        self._sort_count = 0 # Stopped tasks have no sortabilities
+        self._var_sort_sum = _ExactSum()
+        self._r2_sort_sum = _ExactSum()
+
+    def add(self, result: TaskResult):
+        """Add the statistics of the passed TaskResult to the running sums."""
+        if result.average_cons_extension is not None:
+            self._cons_extension_sum.add(result.average_cons_extension)
+            self._cons_extension_count += 1
+        self._runtime_sum.add(result.runtime)
+        self._no_cons_extensions_sum += bool(result.no_cons_extensions)
+        self._alg_crashed_sum += bool(result.algorithm_crashed)
+        self._timed_out_sum += bool(result.timed_out)
+        self._memory_exceeded_sum += bool(result.memory_exceeded)
+        if result.var_sort is not None and result.r2_sort is not None:
+            self._var_sort_sum.add(result.var_sort)
+            self._r2_sort_sum.add(result.r2_sort)
+            self._sort_count += 1
+        self._count += 1
+
+    def get_count(self) -> int:
+        """Number of folded results."""
+        return self._count
+
+    def get_avg_cons_extension(self) -> np.ndarray:
+        """Average of the average consistent extensions, None if no task had one."""
+        if self._cons_extension_count == 0:
+            return None
+        return self._cons_extension_sum.get_mean(self._cons_extension_count)
+
+    def get_avg_runtime(self) -> float:
+        """Average runtime of the algorithm."""
+        return self._runtime_sum.get_mean(self._count)
+
+    def get_avg_no_cons_extensions(self) -> float:
+        """Fraction of results without a consistent extension."""
+        return self._no_cons_extensions_sum / self._count
+
+    def get_avg_alg_crashed(self) -> float:
+        """Fraction of results whose algorithm crashed."""
+        return self._alg_crashed_sum / self._count
+
+    def get_avg_timed_out(self) -> float:
+        """Fraction of results that exceeded the timeout."""
+        return self._timed_out_sum / self._count
+
+    def get_avg_memory_exceeded(self) -> float:
+        """Fraction of results that exceeded the memory limit."""
+        return self._memory_exceeded_sum / self._count
+
+    def get_avg_var_sort(self) -> float:
+        """Average Var-Sortability of the results that have one."""
+        return self._var_sort_sum.get_mean(self._sort_count)
+
+    def get_avg_r2_sort(self) -> float:
+        """Average R2-Sortability of the results that have one."""
+        return self._r2_sort_sum.get_mean(self._sort_count)
 
 
 class Bootstrap(Pickable):
@@ -49,7 +174,20 @@ class Bootstrap(Pickable):
                  sample_sizes: tuple, 
                  standardize_data: bool = False,
                  nr_bootstraps: int = 100,
-                 PROCESSES = False):
+                 PROCESSES = False,
+                 resampling: str = "dataframe",
+                 dispatch: str = "task",
+                 checkpoint_dir: str = None,
+                 timeout: float = None,
+                 thread_policy: ThreadPolicy = None,
+                 max_retries: int = 1,
+                 memory_limit: int = None,
+                 max_tasks_per_child: int = None,
+                 extensions: str = "auto",
+                 nr_extension_samples: int = 1000,
+                 extension_cache_dir: str = None,
+                 keep_cons_extensions: bool = False,
+                 sufficient_statistics: bool = False):
         """
         Initialize Bootstrap, passed variables cannot be changed later on.
 
@@ -73,6 +211,91 @@ class Bootstrap(Pickable):
             PROCESSES (int): If an integer is passed, this represents the number
                 of different processes to run the causal_inference_tasks on in parallel. 
                 If 'False', all causal_inference_tasks will be run sequentially.
+            resampling (str): How each bootstrap sample is stored. Options are:
+                - "dataframe": Each CausalInferenceTask holds a resampled copy 
+                    of the data.
+                - "index": Each CausalInferenceTask only holds compact row-index
+                    arrays into data_to_bootstrap_from, the rows are gathered
+                    when the task is run.
+                - "weights": Each CausalInferenceTask only holds the multiplicity
+                    of each row of data_to_bootstrap_from, i.e. the same samples
+                    as "index". Algorithms supporting sufficient statistics (see 
+                    Algorithm.supports_suffstats) are fitted to the weighted rows
+                    directly, for all others the rows are repeated when the task
+                    is run.
+                - "poisson": As "weights", but each row's multiplicity is drawn
+                    independently from a Poisson distribution, so the sample sizes
+                    are only met in expectation (see bootstrap_weights).
+                Defaults to "dataframe".
+            dispatch (str): How tasks are sent to the worker processes if 
+                PROCESSES is set. Options are:
+                - "task": Each CausalInferenceTask is pickled including its data.
+                - "shared_memory": data_to_bootstrap_from is published once in 
+                    shared memory, workers attach to it without copying and only
+                    receive the row indices (or weights). Requires resampling other
+                    than "dataframe".
+                - "seed": data_to_bootstrap_from is sent once per worker, each
+                    task only consists of its seed and the worker regenerates
+                    the identical bootstrap sample.
+                Defaults to "task".
+            checkpoint_dir (str, optional): If passed, the result of each finished
+                CausalInferenceTask is appended to a checkpoint file named after
+                the Bootstrap in this directory. Rerunning the Bootstrap skips 
+                all replicates found in the checkpoint and gives the same results
+                as an uninterrupted run. Defaults to None, i.e. no checkpointing.
+            timeout (float, optional): Wall-clock seconds after which a single
+                CausalInferenceTask is stopped by terminating its worker process,
+                which is then replaced. The replicate is recorded as timed out
+                (empty estimated graph, no sortabilities). Requires worker 
+                processes, if PROCESSES is False one worker process is used.
+                Defaults to None, i.e. no timeout.
+            thread_policy (ThreadPolicy, optional): Decides how many worker processes
+                are started and limits the BLAS/OpenMP and TensorFlow threads of each
+                worker accordingly, to avoid oversubscribing the cores. PC spreads 
+                its tests over these threads (see PC's n_jobs), so few large fits
+                still use all cores. Only applies to worker processes. Defaults to
+                None, i.e. PROCESSES workers with unlimited threads.
+            max_retries (int): How often a CausalInferenceTask is retried on a fresh
+                worker process if its worker died (e.g. segfault or OOM kill). If
+                all attempts fail, the replicate is recorded as crashed. Defaults to 1.
+            memory_limit (int, optional): Maximum resident memory in bytes of a worker
+                process. A worker exceeding it while running a CausalInferenceTask is 
+                terminated and replaced, the replicate is recorded as memory exceeded
+                (empty estimated graph, no sortabilities) and not retried. A worker
+                exceeding it after a task is replaced before the next one. Requires
+                worker processes, if PROCESSES is False one worker process is used.
+                Defaults to None, i.e. no limit.
+            max_tasks_per_child (int, optional): Number of CausalInferenceTasks after
+                which a worker process is replaced by a fresh one, e.g. to release
+                memory leaked by an algorithm. Requires worker processes, if PROCESSES
+                is False one worker process is used. Defaults to None, i.e. workers
+                are not replaced.
+            extensions (str): How the average consistent extension of each estimated
+                graph is computed, "exact", "sampled" or "auto" (exact unless too 
+                expensive), see CausalInferenceTask. Sampling is seeded per replicate.
+                Defaults to "auto".
+            nr_extension_samples (int): Number of consistent extensions drawn per 
+                replicate if they are sampled. Defaults to 1000.
+            extension_cache_dir (str, optional): Exact average consistent extensions
+                are memoized per estimated graph in a cache shared by all tasks run
+                in the same process, also of other Bootstrap instances. If passed,
+                the cache is additionally stored in this directory and thereby 
+                shared between processes and runs. Defaults to None, i.e. memory only.
+            keep_cons_extensions (bool): Whether each TaskResult keeps all consistent
+                extensions of its estimated graph, bit-packed (see 
+                TaskResult.get_all_cons_extensions). Requires enumerating them, which
+                is exponential in the number of undirected edges. Defaults to False,
+                i.e. only their average and count are kept.
+            sufficient_statistics (bool): Whether algorithms that depend on the data
+                only through per-environment sample sizes and covariance matrices 
+                (GES, GIES, PC with Fisher-z, see Algorithm.supports_suffstats) are
+                fitted to these sufficient statistics. They are computed from the
+                resampling counts of the bootstrap samples, so their rows are never
+                gathered, for batches of samples in one pass over the data (per
+                sample in the worker processes for dispatch "shared_memory" and
+                "seed"). Other algorithms are fitted to the data as usual. Requires
+                resampling="index", weighted resampling always behaves like this.
+                Defaults to False.
         """
         # --- Check validity of input
         assert len(data_to_bootstrap_from)>=1, "No data passed"
@@ -83,6 +306,26 @@ class Bootstrap(Pickable):
         assert nr_bootstraps >= 1, "nr_bootstraps must be an integer value larger than 1"
         assert all((isinstance(size, float) and 0<size<=1) or (isinstance(size, int) and size >1) 
                    for size in sample_sizes), "Sample sizes must be a float between 0 and 1 or an integer"
+        if timeout is not None and timeout <= 0:
+            raise ValueError("timeout must be positive.")
+        if max_retries < 0:
+            raise ValueError("max_retries must not be negative.")
+        if memory_limit is not None and memory_limit <= 0:
+            raise ValueError("memory_limit must be positive.")
+        if max_tasks_per_child is not None and max_tasks_per_child < 1:
+            raise ValueError("max_tasks_per_child must be at least 1.")
+        if resampling not in _RESAMPLING_OPTIONS:
+            raise ValueError(f"resampling must be one of {_RESAMPLING_OPTIONS}.")
+        if dispatch not in _DISPATCH_OPTIONS:
+            raise ValueError(f"dispatch must be one of {_DISPATCH_OPTIONS}.")
+        if dispatch == "shared_memory" and resampling == "dataframe":
+            raise ValueError("dispatch='shared_memory' requires resampling other than 'dataframe'.")
+        if extensions not in _EXTENSION_OPTIONS:
+            raise ValueError(f"extensions must be one of {_EXTENSION_OPTIONS}.")
+        if nr_extension_samples < 1:
+            raise ValueError("nr_extension_samples must be at least 1.")
+        if sufficient_statistics and resampling not in ("index", *WEIGHTED_RESAMPLING):
+            raise ValueError("sufficient_statistics=True requires resampling='index' or weighted resampling.")
         
         # --- Provided
         super().__init__(name)
@@ -95,14 +338,29 @@ class Bootstrap(Pickable):
         self._sample_sizes = sample_sizes
         self._nr_bootstraps = nr_bootstraps
         self._PROCESSES = PROCESSES
+        self._resampling = resampling
+        self._dispatch = dispatch
+        self._checkpoint_dir = checkpoint_dir
+        self._timeout = timeout
+        self._thread_policy = thread_policy
+        self._max_retries = max_retries
+        self._memory_limit = memory_limit
+        self._max_tasks_per_child = max_tasks_per_child
+        self._extensions = extensions
+        self._nr_extension_samples = nr_extension_samples
+        self._extension_cache_dir = extension_cache_dir
+        self._keep_cons_extensions = keep_cons_extensions
+        self._sufficient_statistics = sufficient_statistics
         # --- Provided implicitly
         self._bootstrap_variables = true_dag.columns.to_list()
         # --- Computed later
-        self._causal_inference_tasks = []
+        self._task_results = []
         self._avg_avg_cons_extension = None
         self._avg_runtime = None
         self._avg_no_cons_extensions = None
         self._avg_alg_crashed = None
+        self._avg_timed_out = None
+        self._avg_memory_exceeded = None
         self._avg_var_sort = None
         self._avg_r2_sort = None
 
@@ -110,10 +368,19 @@ class Bootstrap(Pickable):
         """
         Creates, runs and processes CausalInferceTask instances
             according to arguments passed in the constructor.
+        Tasks are created lazily and the TaskResult of each fitted task is
+            folded into running averages as soon as it arrives, so fitted 
+            tasks and their samples are not kept in memory. The compact 
+            TaskResults are retained (see get_task_results), so memory still
+            grows with nr_bootstraps by one record of O(d^2) per replicate.
         """
-        self._create_causal_inference_tasks()
-        self._run_causal_inference_tasks()
-        self._compute_averages()
+        run = self._start_run()
+        try:
+            for result in self._run_causal_inference_tasks(run.get_completed_seeds()):
+                run.add(result)
+        finally:
+            run.close()
+        self._finish_run(run)
 
     def get_bootstrap_name(self) -> str:
         """Get the name as passed in constructor."""
@@ -127,6 +394,10 @@ class Bootstrap(Pickable):
         """Get the true DAG as passed in constructor."""
         return self._true_dag
     
+    def get_task_results(self) -> list[TaskResult]:
+        """Get the TaskResult of each bootstrapped CI-Task, ordered by replicate."""
+        return getattr(self, "_task_results", []) # Bootstraps pickled before TaskResults existed
+
     def get_avg_avg_cons_extension(self) -> pd.DataFrame:
         """
         Gets graph that is:
@@ -147,6 +418,24 @@ class Bootstrap(Pickable):
         """Whether the algorithm crashed, averaged over all bootstrapped CI-Tasks."""
         return self._avg_alg_crashed
 
+    def get_avg_timed_out(self) -> float:
+        """Whether the CI-Task exceeded the timeout, averaged over all bootstrapped CI-Tasks."""
+        return getattr(self, "_avg_timed_out", 0.0) # Bootstraps pickled before timeouts existed
+
+    def get_avg_memory_exceeded(self) -> float:
+        """Whether the CI-Task exceeded the memory limit, averaged over all bootstrapped CI-Tasks."""
+        return getattr(self, "_avg_memory_exceeded", 0.0) # Bootstraps pickled before memory limits existed
+
+    def get_extension_cache_hit_rate(self) -> float:
+        """
+        Fraction of bootstrapped CI-Tasks whose average consistent extension
+            was taken from the extension cache. 0 if no results were collected.
+        """
+        task_results = self.get_task_results()
+        if not task_results:
+            return 0.0
+        return sum(result.extension_cache_hit for result in task_results) / len(task_results)
+
     def get_avg_var_sort(self) -> float:
         """
         Average Var-Sortability of the bootstrapped dataset across 
@@ -161,107 +450,312 @@ class Bootstrap(Pickable):
         """
         return self._avg_r2_sort
     
-    def _create_causal_inference_tasks(self):
+    def _create_causal_inference_tasks(self, completed_seeds: frozenset = frozenset()
+                                       ) -> Iterator[tuple[TaskSpec, CausalInferenceTask]]:
         """
-        Creates nr_bootstraps datasets and uses them
-            to create CausalInferenceTask instances.
+        Lazily creates nr_bootstraps datasets and uses them to 
+            create CausalInferenceTask instances, skipping the passed seeds.
+
+        If the algorithm is fitted to sufficient statistics, these are computed
+            for batches of bootstrap samples in one pass over the data.
+
+        Yields:
+            tuple[TaskSpec, CausalInferenceTask]: Spec and the task it describes.
+        """
+        context = self._task_context(datasets=self._data_to_bootstrap_from)
+        uses_suffstats = self._sufficient_statistics or self._resampling in WEIGHTED_RESAMPLING
+        if not (uses_suffstats and self._algorithm.supports_suffstats()):
+            for spec in self._task_specs(completed_seeds):
+                yield spec, context.create_task(spec)
+            return
+        specs = self._task_specs(completed_seeds)
+        while batch := list(itertools.islice(specs, _SUFFSTATS_BATCH_SIZE)):
+            counts = bootstrap_counts(self._data_to_bootstrap_from, self._sample_sizes,
+                                      seeds=[spec.seed for spec in batch], 
+                                      method=WEIGHTED_RESAMPLING.get(self._resampling, "multinomial"))
+            for spec, suffstats in zip(batch, SuffStats.batch_from_counts(self._data_to_bootstrap_from, counts)):
+                yield spec, context.create_task(spec, suffstats=suffstats)
+
+    def _task_context(self, datasets) -> TaskContext:
+        """Create the TaskContext shared by all tasks of this Bootstrap."""
+        return TaskContext(
+            algorithm=self._algorithm,
+            true_dag=self._true_dag,
+            datasets=datasets,
+            sample_sizes=self._sample_sizes,
+            resampling=self._resampling,
+            extensions=self._extensions,
+            nr_extension_samples=self._nr_extension_samples,
+            extension_cache_dir=self._extension_cache_dir,
+            keep_cons_extensions=self._keep_cons_extensions,
+            sufficient_statistics=self._sufficient_statistics
+        )
+
+    def _task_specs(self, completed_seeds: frozenset = frozenset(), key = 0) -> Iterator[TaskSpec]:
+        """
+        Lazily create one TaskSpec per bootstrap sample whose seed is not in 
+            completed_seeds. The row indices (or weights) are only drawn here
+            for dispatch='shared_memory', otherwise the sample is regenerated
+            from the seed where the task is created.
         """
         for counter in range(self._nr_bootstraps):
-            bstr_sample = bootstrap_sample(
-                datasets=self._data_to_bootstrap_from,
-                sample_sizes=self._sample_sizes,
-                seed=counter*len(self._sample_sizes)
-            )
-            self._causal_inference_tasks.append(
-                CausalInferenceTask(
-                    algorithm=copy.deepcopy(self._algorithm),
-                    data=bstr_sample, 
-                    true_dag=self._true_dag.copy()
+            seed = counter*len(self._sample_sizes)
+            if seed in completed_seeds:
+                continue
+            sample_indices = None
+            sample_weights = None
+            if self._dispatch == "shared_memory" and self._resampling in WEIGHTED_RESAMPLING:
+                sample_weights = bootstrap_weights(
+                    datasets=self._data_to_bootstrap_from,
+                    sample_sizes=self._sample_sizes,
+                    seed=seed,
+                    method=WEIGHTED_RESAMPLING[self._resampling]
+                )
+            elif self._dispatch == "shared_memory":
+                sample_indices = bootstrap_indices(
+                    datasets=self._data_to_bootstrap_from,
+                    sample_sizes=self._sample_sizes,
+                    seed=seed
                 )
-            )
+            yield TaskSpec(key=key, replicate=counter, seed=seed, sample_indices=sample_indices,
+                           sample_weights=sample_weights)
 
-        if len(self._causal_inference_tasks) != self._nr_bootstraps:
-            raise ValueError(f"Desired bootstraps: {self._nr_bootstraps}, Created bootstraps: {len(self._causal_inference_tasks)}")
+    def _run_causal_inference_tasks(self, completed_seeds: frozenset = frozenset()) -> Iterator[TaskResult]:
+        """
+        Run each CausalInferenceTask whose seed is not in completed_seeds, 
+            either sequentially or streamed through a pool of worker processes.
 
-    def _run_causal_inference_tasks(self):
-        """Iterate over each CausalInferenceTasks instance and apply run function."""
-        if self._PROCESSES is False:
-            for task in self._causal_inference_tasks:
+        Yields:
+            TaskResult: Result of each fitted task, in order of completion.
+        """
+        if self._PROCESSES is False and not self._needs_worker_process():
+            for spec, task in self._create_causal_inference_tasks(completed_seeds):
                 task.run_task()
                 logging.info("Fitted a causal_inference_task in sequential fit.")
+                yield task.to_result(replicate=spec.replicate, seed=spec.seed)
+            return
+
+        if self._PROCESSES is False:
+            num_processes = 1 # Limits are only enforceable on a worker process that can be terminated
+        elif not isinstance(self._PROCESSES, int):
+            raise TypeError("PROCESSES must be an integer.")
         else:
-            if not isinstance(self._PROCESSES, int):
-                raise TypeError("PROCESSES must be an integer.")
             num_processes = max(1, self._PROCESSES)
-            with multiprocessing.Pool(processes=num_processes) as pool:
-                fitted_tasks = pool.map(parallel_fit, self._causal_inference_tasks)
-                self._causal_inference_tasks = fitted_tasks
+        nr_tasks = self._nr_bootstraps - len(completed_seeds)
+        threads = None
+        if self._thread_policy is not None:
+            num_processes, threads = self._thread_policy.plan(num_processes, nr_tasks)
+        yield from self._execute(num_processes, threads, completed_seeds)
+
+    def _execute(self, num_processes: int, threads: int, completed_seeds: frozenset) -> Iterator[TaskResult]:
+        """
+        Stream the tasks through a TaskExecutor, which replaces dead workers
+            (retrying their task) and the workers of tasks exceeding the timeout
+            or memory limit.
+        """
+        if self._dispatch == "task":
+            executor = TaskExecutor(processes=num_processes, fn=parallel_fit, initializer=init_worker,
+                                    initargs=({}, threads), timeout=self._timeout, 
+                                    max_retries=self._max_retries, memory_limit=self._memory_limit,
+                                    max_tasks_per_child=self._max_tasks_per_child)
+            for (spec, _), outcome, value in executor.imap_unordered(
+                    self._create_causal_inference_tasks(completed_seeds)):
+                yield self._executed_result(spec, outcome, value)
+        else:
+            with contextlib.ExitStack() as stack:
+                executor = TaskExecutor(processes=num_processes, fn=run_task_spec, initializer=init_worker,
+                                        initargs=({0: self._worker_context(stack)}, threads), 
+                                        timeout=self._timeout, max_retries=self._max_retries,
+                                        memory_limit=self._memory_limit,
+                                        max_tasks_per_child=self._max_tasks_per_child)
+                for spec, outcome, value in executor.imap_unordered(self._task_specs(completed_seeds)):
+                    yield self._executed_result(spec, outcome, value)
+
+    def _worker_context(self, stack: contextlib.ExitStack) -> TaskContext:
+        """
+        TaskContext sent once to each worker process. For dispatch='shared_memory'
+            it only holds a handle to the data published in shared memory, which
+            is released when the passed stack is closed.
+        """
+        if self._dispatch == "shared_memory":
+            shared = stack.enter_context(SharedDatasets(self._data_to_bootstrap_from))
+            return self._task_context(datasets=shared.get_handle())
+        return self._task_context(datasets=self._data_to_bootstrap_from)
 
-        if len(self._causal_inference_tasks) != self._nr_bootstraps:
-            raise ValueError(f"Desired bootstraps: {self._nr_bootstraps}, Computed bootstraps: {len(self._causal_inference_tasks)}")
+    def _needs_worker_process(self) -> bool:
+        """Whether a limit is set that can only be enforced on a worker process."""
+        return (self._timeout is not None or self._memory_limit is not None 
+                or self._max_tasks_per_child is not None)
 
+    def _executed_result(self, spec: TaskSpec, outcome: str, value) -> TaskResult:
+        """Turn an outcome yielded by a TaskExecutor into a TaskResult."""
+        if outcome == TASK_DONE:
+            return value
+        return self._failed_result(spec, outcome)
 
-    def _compute_averages(self):
+    def _failed_result(self, spec: TaskSpec, outcome: str) -> TaskResult:
+        """
+        TaskResult of a task whose worker process was terminated or died.
+        As for a crashing algorithm, the estimated graph is empty.
         """
-        After each CausalInferenceTask instance is fitted, compute
+        d = len(self._bootstrap_variables)
+        return TaskResult(
+            replicate=spec.replicate,
+            seed=spec.seed,
+            estimated_graph=np.zeros((d, d), dtype=np.uint8),
+            average_cons_extension=np.zeros((d, d)),
+            runtime=0,
+            algorithm_crashed=outcome not in (TASK_TIMED_OUT, TASK_MEMORY_EXCEEDED),
+            timed_out=outcome == TASK_TIMED_OUT,
+            memory_exceeded=outcome == TASK_MEMORY_EXCEEDED,
+            var_sort=None,
+            r2_sort=None
+        )
+
+    def _start_run(self) -> "_BootstrapRun":
+        """Start a run, resuming from the checkpoint if checkpointing is enabled."""
+        checkpoint = None
+        if self._checkpoint_dir is not None:
+            checkpoint = TaskCheckpoint(self._checkpoint_dir, self._name, self._checkpoint_config())
+        return _BootstrapRun(self._nr_bootstraps, checkpoint)
+
+    def _finish_run(self, run: "_BootstrapRun"):
+        """Store the TaskResults and averages of the passed, completed run."""
+        if run.get_count() != self._nr_bootstraps:
+            raise ValueError(f"Desired bootstraps: {self._nr_bootstraps}, Computed bootstraps: {run.get_count()}")
+        self._task_results = run.get_task_results()
+        self._compute_averages(run.get_averages())
+
+    def _nr_samples(self) -> int:
+        """Number of rows of each bootstrap sample, summed over all dfs."""
+        return sum(absolute_sample_size(size, len(df)) 
+                   for size, df in zip(self._sample_sizes, self._data_to_bootstrap_from))
+
+    def _checkpoint_config(self) -> dict:
+        """
+        Everything that determines the TaskResults apart from the seed,
+            stored in the checkpoint to refuse resuming a changed Bootstrap.
+        """
+        data_digest = hashlib.sha1()
+        for df in self._data_to_bootstrap_from:
+            data_digest.update(np.ascontiguousarray(df.values).tobytes())
+        return {
+            "algorithm": self._algorithm.__class__.__name__,
+            "hyperparameters": {name: repr(value) for name, value in self._algorithm.get_hyperparameters().items()},
+            "variables": self._bootstrap_variables,
+            "true_dag": self._true_dag.values.tolist(),
+            "sample_sizes": list(self._sample_sizes),
+            "resampling": self._resampling,
+            "extensions": (self._extensions, self._nr_extension_samples),
+            "keep_cons_extensions": self._keep_cons_extensions,
+            "sufficient_statistics": self._sufficient_statistics,
+            "data": data_digest.hexdigest()
+        }
+
+    def _compute_averages(self, averages: _RunningAverages):
+        """
+        After each CausalInferenceTask instance is fitted and folded into
+            the passed running averages, store
             - average runtime of 'Algorithm' across all tasks,
             - average sortability of the boostrapped datasets across all tasks,
             - average average consistent extension of fitted structure across all tasks.
         """
-        est_avg_cons_extensions = []
-        runtimes = []
-        no_cons_extensions = []
-        alg_crashed = []
-        var_sorts = []
-        r2_sorts = []
-        # Fill lists by iterating over all causal inference tasks
-        for task in self._causal_inference_tasks:
-            est_avg_cons_extensions.append(task.get_average_cons_extension())
-            runtimes.append(task.get_runtime())
-            no_cons_extensions.append(task.get_no_consistent_extensions_flag())
-            alg_crashed.append(task.get_algorithm_crashed_flag())
-            var_sorts.append(task.get_var_sort())
-            r2_sorts.append(task.get_r2_sort())
-        # Process lists
-        est_avg_cons_extensions = list(filter(lambda x: x is not None, est_avg_cons_extensions)) # Filter out None values
-        if len(est_avg_cons_extensions) == 0: # Handle case of zero valid consistent extensions across all inference tasks
-            var = list(self._true_dag.columns)
-            d = len(var)
-            est_avg_cons_extensions.append(pd.DataFrame(np.zeros((d,d)), columns=var, index=var))
-        est_avg_cons_extensions = list(map(lambda x: x.values, est_avg_cons_extensions)) # Turn df into np.array
-        _avg_avg_cons_extension_np = np.average(est_avg_cons_extensions, axis=0)
+        _avg_avg_cons_extension_np = averages.get_avg_cons_extension()
+        if _avg_avg_cons_extension_np is None: # Handle case of zero valid consistent extensions across all inference tasks
+            d = len(self._bootstrap_variables)
+            _avg_avg_cons_extension_np = np.zeros((d,d))
         self._avg_avg_cons_extension = pd.DataFrame(
             data=_avg_avg_cons_extension_np,
             index=self._bootstrap_variables,
             columns=self._bootstrap_variables
         )
         try:
-            self._avg_runtime = float(np.average(runtimes, axis=0))
+            self._avg_runtime = float(averages.get_avg_runtime())
         except Exception as e:
             print(f"Exception when computing average runtime: {e}")
             self._avg_runtime = -1
         try:
-            self._avg_no_cons_extensions = float(np.average(no_cons_extensions))
+            self._avg_no_cons_extensions = float(averages.get_avg_no_cons_extensions())
         except Exception as e:
             print(f"Exception when computing average no consistent extensions: {e}")
             self._avg_no_cons_extensions = -1
         try:
-            self._avg_alg_crashed = float(np.average(alg_crashed))
+            self._avg_alg_crashed = float(averages.get_avg_alg_crashed())
         except Exception as e:
             print(f"Exception when computing average alg crashed: {e}")
             self._avg_alg_crashed = -1
         try:
-            self._avg_var_sort = float(np.average(var_sorts, axis=0))
+            self._avg_timed_out = float(averages.get_avg_timed_out())
+        except Exception as e:
+            print(f"Exception when computing average timed out: {e}")
+            self._avg_timed_out = -1
+        try:
+            self._avg_memory_exceeded = float(averages.get_avg_memory_exceeded())
+        except Exception as e:
+            print(f"Exception when computing average memory exceeded: {e}")
+            self._avg_memory_exceeded = -1
+        try:
+            self._avg_var_sort = float(averages.get_avg_var_sort())
         except Exception as e:
             print(f"Exception when computing avg var sort: {e}")
             self._avg_var_sort = -1
         try:
-            self._avg_r2_sort = float(np.average(r2_sorts, axis=0))
+            self._avg_r2_sort = float(averages.get_avg_r2_sort())
         except Exception as e:
             print(f"Exception when computing avg r2 sort: {e}")
             self._avg_r2_sort = -1
             
     
+class _BootstrapRun:
+    """
+    State of a single run of a Bootstrap: The running averages, the
+        collected TaskResults and the checkpoint, if enabled. TaskResults
+        found in the checkpoint are collected when the run is created.
+    """
+    def __init__(self, nr_bootstraps: int, checkpoint: TaskCheckpoint = None):
+        self._checkpoint = checkpoint
+        self._averages = _RunningAverages()
+        self._task_results = []
+        self._completed_seeds = frozenset()
+        if checkpoint is not None:
+            completed = [result for result in checkpoint.get_results().values()
+                         if result.replicate < nr_bootstraps]
+            if completed:
+                logging.info(f"Resuming from {len(completed)} checkpointed causal_inference_tasks.")
+            for result in completed:
+                self._collect(result)
+            self._completed_seeds = frozenset(result.seed for result in completed)
+
+    def get_completed_seeds(self) -> frozenset:
+        """Seeds of the TaskResults found in the checkpoint."""
+        return self._completed_seeds
+
+    def add(self, result: TaskResult):
+        """Checkpoint and collect a newly computed TaskResult."""
+        if self._checkpoint is not None:
+            self._checkpoint.append(result)
+        self._collect(result)
+
+    def close(self):
+        """Close the checkpoint, if any."""
+        if self._checkpoint is not None:
+            self._checkpoint.close()
+
+    def get_count(self) -> int:
+        return self._averages.get_count()
+
+    def get_averages(self) -> _RunningAverages:
+        return self._averages
+
+    def get_task_results(self) -> list[TaskResult]:
+        """Collected TaskResults, ordered by replicate."""
+        return sorted(self._task_results, key=lambda result: result.replicate)
+
+    def _collect(self, result: TaskResult):
+        self._averages.add(result)
+        self._task_results.append(result)
+
+
 class BootstrapComparison(Pickable):
     """
     Class comparing several Bootstrap instances. 
@@ -294,10 +788,81 @@ class BootstrapComparison(Pickable):
         self._bootstraps.append(bstrp)
         self._update_variables()
         
-    def run_comparison(self):
-        """Run each passed Bootstrap instance."""
-        for bootstrap in self._bootstraps:
-            bootstrap.run_bootstrap()
+    def run_comparison(self, PROCESSES: int = None, thread_policy: ThreadPolicy = None):
+        """
+        Run each passed Bootstrap instance.
+
+        Args:
+            PROCESSES (int, optional): If passed, the tasks of all Bootstrap 
+                instances are run through one shared pool of this many worker
+                processes and a global queue, overriding the PROCESSES of the
+                single instances. The queue dispatches the tasks with the longest
+                expected runtime first, estimated from sample size, number of 
+                variables and algorithm and refined by the runtimes observed so 
+                far. Results are routed back to their instance and equal those of
+                running the instances on their own, up to floating point rounding
+                for instances fitted to sufficient statistics: These are computed
+                per task in the workers rather than in batches (see 
+                SuffStats.batch_from_counts), which rounds differently. Defaults
+                to None, i.e. one instance is run after another.
+            thread_policy (ThreadPolicy, optional): Only used if PROCESSES is 
+                passed, see Bootstrap. Defaults to None.
+        If PROCESSES is passed, timeout, max_retries and memory_limit still apply
+            per instance, while the shared workers are replaced after the smallest
+            max_tasks_per_child of all instances.
+        """
+        if PROCESSES is None:
+            for bootstrap in self._bootstraps:
+                bootstrap.run_bootstrap()
+            return
+        if not isinstance(PROCESSES, int):
+            raise TypeError("PROCESSES must be an integer.")
+
+        runs = []
+        try:
+            with contextlib.ExitStack() as stack:
+                contexts = {}
+                specs = {}
+                cost_model = CostModel()
+                for key, bootstrap in enumerate(self._bootstraps):
+                    runs.append(bootstrap._start_run())
+                    contexts[key] = bootstrap._worker_context(stack)
+                    specs[key] = bootstrap._task_specs(runs[key].get_completed_seeds(), key=key)
+                    cost_model.add_group(key, bootstrap._algorithm, bootstrap._nr_samples(), 
+                                         len(bootstrap.get_bootstrap_variables()))
+                num_processes, threads = max(1, PROCESSES), None
+                if thread_policy is not None:
+                    nr_tasks = sum(bootstrap._nr_bootstraps - len(run.get_completed_seeds())
+                                   for bootstrap, run in zip(self._bootstraps, runs))
+                    num_processes, threads = thread_policy.plan(num_processes, nr_tasks)
+                executor = TaskExecutor(
+                    processes=num_processes, 
+                    fn=run_task_spec, 
+                    initializer=init_worker,
+                    initargs=(contexts, threads),
+                    timeout=lambda spec: self._bootstraps[spec.key]._timeout,
+                    max_retries=lambda spec: self._bootstraps[spec.key]._max_retries,
+                    memory_limit=lambda spec: self._bootstraps[spec.key]._memory_limit,
+                    max_tasks_per_child=self._max_tasks_per_child()
+                )
+                for spec, outcome, value in executor.imap_unordered(lpt_order(specs, cost_model)):
+                    result = self._bootstraps[spec.key]._executed_result(spec, outcome, value)
+                    runs[spec.key].add(result)
+                    if outcome == TASK_TIMED_OUT: # Took at least the timeout
+                        cost_model.observe(spec.key, self._bootstraps[spec.key]._timeout)
+                    elif outcome == TASK_DONE and not result.algorithm_crashed:
+                        cost_model.observe(spec.key, result.runtime)
+        finally:
+            for run in runs:
+                run.close()
+        for bootstrap, run in zip(self._bootstraps, runs):
+            bootstrap._finish_run(run)
+
+    def _max_tasks_per_child(self) -> int:
+        """Smallest max_tasks_per_child of the Bootstrap instances, None if none sets one."""
+        limits = [bootstrap._max_tasks_per_child for bootstrap in self._bootstraps
+                  if bootstrap._max_tasks_per_child is not None]
+        return min(limits) if limits else None
 
     def get_bootstraps(self) -> list[Bootstrap]:
         """Get the list containing all passed Bootstrap instances."""
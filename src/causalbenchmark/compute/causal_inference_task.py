@@ -1,21 +1,86 @@
 """
 Functionality to:
-    - Compute all and the average consistent extensions from the 'Algorithm' output.
-    - Compute sortability of passed data.
+    - Compute the average consistent extension from the 'Algorithm' output.
+    - Compute sortability of passed data (or of its sufficient statistics).
+    - Condense a fitted task into a compact TaskResult.
 """
 
 # Standard 
 from typing import Iterable
+import logging
 import numpy as np
 import pandas as pd
 
 # Third party
-from CausalDisco.analytics import var_sortability, r2_sortability
+from CausalDisco.analytics import var_sortability, r2_sortability, order_alignment
 from sempler.utils import all_dags
 
 # Own
 from .algorithms import Algorithm
-from ..util import same_columns, pool_dfs
+from .consistent_extensions import (average_consistent_extension, sample_consistent_extensions, exact_cost,
+                                    pack_extensions, unpack_extensions)
+from .extension_cache import process_cache
+from .suffstats import SuffStats
+from ..util import same_columns, pool_dfs, gather_sample, gather_weighted_sample
+
+
+_EXTENSION_OPTIONS = ("exact", "sampled", "auto")
+
+class TaskResult:
+    """
+    Compact record of a fitted CausalInferenceTask. Holds only what is 
+        needed to aggregate and store the results of a bootstrap replicate,
+        i.e. no data, true DAG or algorithm. Consistent extensions are only
+        included if requested, bit-packed.
+    """
+    __slots__ = ("replicate", "seed", "estimated_graph", "average_cons_extension", "runtime",
+                 "no_cons_extensions", "algorithm_crashed", "timed_out", "memory_exceeded", "var_sort", "r2_sort",
+                 "cons_extension_mc_error", "extension_cache_hit", "packed_cons_extensions")
+
+    # Values for slots missing in the pickled state, e.g. if slots are added later on
+    _DEFAULTS = {"replicate": None, "seed": None, "estimated_graph": None, 
+                 "average_cons_extension": None, "runtime": 0, "no_cons_extensions": False, 
+                 "algorithm_crashed": False, "timed_out": False, "memory_exceeded": False, 
+                 "var_sort": 0, "r2_sort": 0, "cons_extension_mc_error": 0.0,
+                 "extension_cache_hit": False, "packed_cons_extensions": None}
+
+    def __init__(self, **fields):
+        """
+        Args:
+            **fields: Value per slot, missing slots are set to their default.
+                - replicate (int): Position of the replicate within its Bootstrap.
+                - seed (int): Seed the bootstrap sample was drawn with.
+                - estimated_graph (np.ndarray): Output of the algorithm, uint8
+                    if it is a binary adjacency matrix.
+                - average_cons_extension (np.ndarray): Average of all consistent
+                    extensions, None if there are none.
+                - runtime (float), no_cons_extensions (bool), algorithm_crashed 
+                    (bool), var_sort (float), r2_sort (float): See the respective
+                    CausalInferenceTask getters.
+                - timed_out (bool): Whether the task was stopped for exceeding
+                    the timeout. Its sortabilities are then None.
+                - memory_exceeded (bool): Whether the task was stopped for 
+                    exceeding the memory limit. Its sortabilities are then None.
+                - cons_extension_mc_error (float), extension_cache_hit (bool): 
+                    See the respective CausalInferenceTask getters.
+                - packed_cons_extensions (np.ndarray): All consistent extensions,
+                    bit-packed by pack_extensions. None if they were not kept.
+        """
+        self.__setstate__(fields)
+
+    def get_all_cons_extensions(self) -> np.ndarray:
+        """Unpack the kept consistent extensions (m x d x d), None if they were not kept."""
+        if self.packed_cons_extensions is None:
+            return None
+        return unpack_extensions(self.packed_cons_extensions, self.estimated_graph)
+
+    def __getstate__(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __setstate__(self, state: dict):
+        for slot in self.__slots__:
+            setattr(self, slot, state.get(slot, self._DEFAULTS[slot]))
+
 
 class CausalInferenceTask:
     """
@@ -25,7 +90,17 @@ class CausalInferenceTask:
     def __init__(self, 
                  algorithm: Algorithm,
                  data: Iterable[pd.DataFrame], 
-                 true_dag: pd.DataFrame
+                 true_dag: pd.DataFrame,
+                 sample_indices: Iterable[np.ndarray] = None,
+                 extensions: str = "auto",
+                 nr_extension_samples: int = 1000,
+                 max_exact_cost: float = 1e7,
+                 seed: int = None,
+                 extension_cache_dir: str = None,
+                 keep_cons_extensions: bool = False,
+                 sufficient_statistics: bool = False,
+                 suffstats: SuffStats = None,
+                 sample_weights: Iterable[np.ndarray] = None
                  ):
         """
         Passed arguments cannot be changed later on.
@@ -35,22 +110,85 @@ class CausalInferenceTask:
             data (Iterable[pd.DataFrame]): The data to pass to the algorithm.
             true_dag (pd.DataFrame): The DAG according to which the passed 
                 data was generated.
+            sample_indices (Iterable[np.ndarray], optional): Positional row 
+                indices, one array per df in data. If passed, data is the data
+                that was bootstrapped from and the rows are only gathered when
+                the task is run. Defaults to None, i.e. data is passed as is.
+            extensions (str): How the average consistent extension of the 
+                estimated graph is computed. Options are:
+                - "exact": Counted exactly, see average_consistent_extension.
+                - "sampled": Estimated from nr_extension_samples uniformly drawn
+                    consistent extensions, see sample_consistent_extensions.
+                - "auto": "exact" if its estimated cost (see exact_cost) is at
+                    most max_exact_cost, "sampled" otherwise.
+                Defaults to "auto".
+            nr_extension_samples (int): Number of consistent extensions drawn
+                if they are sampled. Defaults to 1000.
+            max_exact_cost (float): Largest estimated cost for which "auto"
+                computes the exact average. Defaults to 1e7.
+            seed (int, optional): Seed for drawing consistent extensions. 
+                Defaults to None.
+            extension_cache_dir (str, optional): Exact averages are memoized
+                per PDAG in a cache shared by all tasks of the process, see
+                ExtensionCache. If passed, the cache is also stored in this
+                directory. Defaults to None, i.e. memory only.
+            keep_cons_extensions (bool): Whether to enumerate and keep all 
+                consistent extensions, bit-packed (also in the TaskResult). 
+                Enumeration is exponential in the number of undirected edges.
+                Defaults to False, i.e. only their average and count are kept.
+            sufficient_statistics (bool): Whether to fit the algorithm to the
+                SuffStats of the bootstrap sample, computed from sample_indices
+                without gathering the rows, if the algorithm supports it (see
+                Algorithm.supports_suffstats). Sortabilities are then computed
+                from the SuffStats as well. Defaults to False.
+            suffstats (SuffStats, optional): Precomputed SuffStats of the bootstrap
+                sample, e.g. by SuffStats.batch_from_counts, used instead of 
+                computing them from sample_indices. Defaults to None.
+            sample_weights (Iterable[np.ndarray], optional): Multiplicity of each
+                row, one vector per df in data, as drawn by bootstrap_weights. 
+                Alternative to sample_indices: data is the data that was 
+                bootstrapped from, algorithms supporting SuffStats are always
+                fitted to them, for all others each row is repeated according to
+                its multiplicity when the task is run. Defaults to None.
         """
         # --- Check validity of input
         if not same_columns((*data, true_dag, true_dag.transpose())):
             raise ValueError("Different variables are used in the data and/or TrueDag.")
+        if sample_indices is not None and len(sample_indices) != len(data):
+            raise ValueError("One index array per passed df is required.")
+        if sample_weights is not None and len(sample_weights) != len(data):
+            raise ValueError("One weight vector per passed df is required.")
+        if sample_indices is not None and sample_weights is not None:
+            raise ValueError("Pass either sample_indices or sample_weights.")
+        if extensions not in _EXTENSION_OPTIONS:
+            raise ValueError(f"extensions must be one of {_EXTENSION_OPTIONS}.")
+        if nr_extension_samples < 1:
+            raise ValueError("nr_extension_samples must be at least 1.")
         
         # --- Provided
         self._algorithm = algorithm
         self._data = data
         self._true_dag = true_dag
+        self._sample_indices = sample_indices
+        self._extensions = extensions
+        self._nr_extension_samples = nr_extension_samples
+        self._max_exact_cost = max_exact_cost
+        self._seed = seed
+        self._extension_cache_dir = extension_cache_dir
+        self._keep_cons_extensions = keep_cons_extensions
+        self._sufficient_statistics = sufficient_statistics
+        self._suffstats = suffstats
+        self._sample_weights = sample_weights
         # --- Computed later
         # Algorithm output
         self._estimated_graph = None
         self._runtime = None
         # Consistent extensions
-        self._all_cons_extensions = None
+        self._nr_cons_extensions = None
+        self._packed_cons_extensions = None
         self._average_cons_extension = None 
+        self._cons_extension_mc_error = None
+        self._extension_cache_hit = False
         # Failure counter
         self._no_cons_extensions = False
         self._algorithm_crashed = False
@@ -64,11 +202,20 @@ class CausalInferenceTask:
             to the passed data and computes the average consistent
             extension of the fitted PDAG.
         """
-        self._compute_sortability()
+        if self._uses_suffstats():
+            suffstats = self._suffstats
+            if suffstats is None and self._sample_weights is not None:
+                suffstats = SuffStats.from_counts(self._data, self._sample_weights)
+            elif suffstats is None:
+                suffstats = SuffStats.from_indices(self._data, self._sample_indices)
+            self._compute_sortability_from_suffstats(suffstats)
+            fit = lambda: self._algorithm.fit_suffstats(suffstats)
+        else:
+            data = self._get_sample()
+            self._compute_sortability(data)
+            fit = lambda: self._algorithm.fit(data=data)
         try:
-            self._estimated_graph, self._runtime = self._algorithm.fit(
-                data=self._data
-            )
+            self._estimated_graph, self._runtime = fit()
         except Exception as e:
             print(f"Exception thrown while fitting the algorithm: {e}")
             self._algorithm_crashed = True
@@ -90,12 +237,39 @@ class CausalInferenceTask:
         """ Gets the runtime needed to fit the algorithm. """
         return self._runtime
     
-    def get_all_cons_extensions(self) -> list[np.ndarray]:
-        """ Gets all consistent extensions of the estimated graph. """
-        return self._all_cons_extensions
+    def get_all_cons_extensions(self) -> np.ndarray:
+        """ 
+        Gets all consistent extensions of the estimated graph. Enumerated on
+            each call, i.e. exponential in the number of undirected edges.
+        """
+        if self._packed_cons_extensions is not None:
+            return unpack_extensions(self._packed_cons_extensions, self._estimated_graph.values)
+        return all_dags(self._estimated_graph.values)
+
+    def get_nr_cons_extensions(self) -> int:
+        """ 
+        Gets the number of consistent extensions of the estimated graph, None
+            if they were sampled by rejection.
+        """
+        return self._nr_cons_extensions
+
+    def get_extension_cache_hit_flag(self) -> bool:
+        """ Gets whether the average consistent extension was taken from the cache. """
+        return self._extension_cache_hit
+
+    def get_cons_extension_mc_error(self) -> float:
+        """ 
+        Gets the Monte Carlo error of the average consistent extension, i.e. the
+            largest standard error of one of its entries. 0 if it was computed exactly,
+            NaN if sampling did not give an estimate.
+        """
+        return self._cons_extension_mc_error
 
     def get_average_cons_extension(self) -> pd.DataFrame:
-        """ Gets the average of all consistent extensions. """
+        """ 
+        Gets the average of all consistent extensions. None if there are none or
+            if sampling them failed, see get_cons_extension_mc_error.
+        """
         return self._average_cons_extension
     
     def get_no_consistent_extensions_flag(self) -> bool:
@@ -113,12 +287,66 @@ class CausalInferenceTask:
     def get_r2_sort(self) -> float:
         """ Gets the R2 Sortability of the passed dataset. """
         return self._r2_sort
+
+    def get_sample_indices(self) -> list[np.ndarray]:
+        """ Gets the row indices of the bootstrap sample, None if data was passed as is. """
+        return self._sample_indices
+
+    def get_sample_weights(self) -> list[np.ndarray]:
+        """ Gets the row multiplicities of the bootstrap sample, None if it is not weighted. """
+        return self._sample_weights
+
+    def to_result(self, replicate: int = None, seed: int = None) -> TaskResult:
+        """
+        Condense the fitted task into a TaskResult.
+
+        Args:
+            replicate (int, optional): Position of the task within its Bootstrap.
+            seed (int, optional): Seed the bootstrap sample was drawn with.
+        """
+        estimated_graph = self._estimated_graph.values
+        if np.isin(estimated_graph, (0, 1)).all():
+            estimated_graph = estimated_graph.astype(np.uint8)
+        average_cons_extension = None
+        if self._average_cons_extension is not None:
+            average_cons_extension = self._average_cons_extension.values
+        return TaskResult(
+            replicate=replicate,
+            seed=seed,
+            estimated_graph=estimated_graph,
+            average_cons_extension=average_cons_extension,
+            runtime=self._runtime,
+            no_cons_extensions=self._no_cons_extensions,
+            algorithm_crashed=self._algorithm_crashed,
+            var_sort=self._var_sort,
+            r2_sort=self._r2_sort,
+            cons_extension_mc_error=self._cons_extension_mc_error,
+            extension_cache_hit=self._extension_cache_hit,
+            packed_cons_extensions=self._packed_cons_extensions
+        )
+
+    def _get_sample(self) -> list[pd.DataFrame]:
+        """ Returns the data to fit, gathering it from the sample indices or weights if needed. """
+        if self._sample_weights is not None:
+            return gather_weighted_sample(self._data, self._sample_weights)
+        if self._sample_indices is None:
+            return self._data
+        return gather_sample(self._data, self._sample_indices)
     
-    def _compute_sortability(self):
+    def _uses_suffstats(self) -> bool:
+        """ Whether the algorithm is fitted to the SuffStats of the bootstrap sample. """
+        if not self._algorithm.supports_suffstats():
+            return False
+        if self._sample_weights is not None: # Weighted samples are never materialized if not needed
+            return True
+        return self._sufficient_statistics and self._sample_indices is not None
+
+    def _compute_sortability(self, data: Iterable[pd.DataFrame]):
         """ Computes and saves Variance and R2 Sortability of the passed dataset. """
+        pooled_data = pool_dfs(data).values
         try:
             self._var_sort = var_sortability(
-                X=pool_dfs(self._data).values, 
+                X=pooled_data, 
                 W=self._true_dag.values
             )
         except ValueError as e: # Can happen if data contains too many columns with 0 variance 
@@ -128,7 +356,7 @@ class CausalInferenceTask:
             print(f"Exception thrown while computing var sortability: {e}")
         try:
             self._r2_sort = r2_sortability(
-                X=pool_dfs(self._data).values, 
+                X=pooled_data, 
                 W=self._true_dag.values
             )
         except ValueError as e: # Can happen if data contains too many columns with 0 variance
@@ -137,21 +365,61 @@ class CausalInferenceTask:
             self._r2_sort = 0
             print(f"Exception thrown while camputing r2 sortability: {e}")
     
+    def _compute_sortability_from_suffstats(self, suffstats: SuffStats):
+        """ 
+        Computes and saves Variance and R2 Sortability from the pooled covariance
+            matrix, equal to those of the gathered bootstrap sample.
+        """
+        try:
+            self._var_sort = order_alignment(
+                W=self._true_dag.values,
+                scores=np.diag(suffstats.pooled_covariance())
+            )
+        except Exception as e:
+            self._var_sort = 0
+            print(f"Exception thrown while computing var sortability: {e}")
+        try:
+            self._r2_sort = order_alignment(
+                W=self._true_dag.values,
+                scores=suffstats.pooled_r2()
+            )
+        except Exception as e:
+            self._r2_sort = 0
+            print(f"Exception thrown while camputing r2 sortability: {e}")
+
     def _consistent_extensions(self):
         """ 
-        Computes and saves all consistent extensions of the fitted graph
-            and computes and saves the average of these extensions.
+        Computes and saves the number and the average of all consistent 
+            extensions of the fitted graph, without enumerating them unless
+            they are kept. The average is estimated by sampling if requested 
+            or too expensive, exact averages are taken from the process' cache
+            if possible.
         """
-        self._all_cons_extensions = all_dags(self._estimated_graph.values).tolist()
+        pdag = self._estimated_graph.values
+        sampled = self._extensions == "sampled" or (
+            self._extensions == "auto" and exact_cost(pdag) > self._max_exact_cost)
+        if sampled:
+            avg_dag, self._nr_cons_extensions, self._cons_extension_mc_error = sample_consistent_extensions(
+                pdag, nr_samples=self._nr_extension_samples, rng=np.random.default_rng(self._seed))
+        else:
+            cache = process_cache(self._extension_cache_dir)
+            (avg_dag, self._nr_cons_extensions), self._extension_cache_hit = cache.get_or_compute(
+                pdag, average_consistent_extension)
+            self._cons_extension_mc_error = 0.0
         # Handle the case of zero valid consistent extensions
-        if len(self._all_cons_extensions) == 0: 
+        if avg_dag is None and self._nr_cons_extensions == 0: 
             self._no_cons_extensions = True
             self._average_cons_extension = None
+        elif avg_dag is None: # Sampling failed, the average is unknown
+            logging.warning(f"No consistent extension was accepted in {100*self._nr_extension_samples} draws, "
+                            "the average consistent extension is left out.")
+            self._average_cons_extension = None
         else: 
-            avg_dag = np.average(self._all_cons_extensions, axis=0)
             self._average_cons_extension = pd.DataFrame(
                 data=avg_dag,
                 index=self._estimated_graph.index,
                 columns=self._estimated_graph.columns
             )
+        if self._keep_cons_extensions:
+            self._packed_cons_extensions = pack_extensions(all_dags(pdag))
 
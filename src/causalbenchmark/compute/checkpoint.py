@@ -0,0 +1,99 @@
+"""
+Class 'TaskCheckpoint' to durably store the TaskResults of a Bootstrap
+    while it runs, such that an interrupted Bootstrap can be resumed.
+"""
+
+# Standard
+import os
+import pickle
+
+# Own
+from .causal_inference_task import TaskResult
+
+
+class TaskCheckpoint:
+    """
+    Append-only checkpoint file of one Bootstrap, keyed by bootstrap name.
+    The file is a sequence of pickled records: a header describing the
+        Bootstrap configuration followed by one TaskResult per finished
+        replicate. Every record is flushed and fsynced when written, a
+        trailing record that was only partially written (e.g. if the
+        process was killed while writing) is discarded when loading.
+    """
+    def __init__(self, checkpoint_dir: str, name: str, config: dict):
+        """
+        Open or create the checkpoint of the Bootstrap with the passed name.
+
+        Args:
+            checkpoint_dir (str): Directory to store the checkpoint file in.
+            name (str): Name of the Bootstrap, used as file name.
+            config (dict): Everything that determines the TaskResults apart
+                from the seed. Resuming with a different config is refused.
+
+        Raises:
+            ValueError: If the existing checkpoint has a different config.
+        """
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self._path = os.path.abspath(os.path.join(checkpoint_dir, f"{name}.ckpt"))
+        self._results = {}
+        valid_size = 0
+        if os.path.exists(self._path):
+            valid_size = self._load(config)
+        self._file = open(self._path, "ab")
+        self._file.truncate(valid_size) # Drop a partially written trailing record
+        if valid_size == 0:
+            self._write(config)
+
+    def get_path(self) -> str:
+        """Get the path of the checkpoint file."""
+        return self._path
+
+    def get_results(self) -> dict[int, TaskResult]:
+        """Get the stored TaskResults keyed by their seed."""
+        return self._results
+
+    def append(self, result: TaskResult):
+        """Durably store the passed TaskResult."""
+        self._write(result)
+        self._results[result.seed] = result
+
+    def close(self):
+        """Close the checkpoint file."""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write(self, record):
+        """Append a single record and make sure it reached the disk."""
+        pickle.dump(record, self._file)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _load(self, config: dict) -> int:
+        """
+        Load the records of the existing checkpoint file.
+
+        Returns:
+            int: Size in bytes of the complete records in the file.
+        """
+        with open(self._path, "rb") as file:
+            try:
+                stored_config = pickle.load(file)
+            except Exception: # Header was only partially written
+                return 0
+            if stored_config != config:
+                raise ValueError(f"Checkpoint '{self._path}' belongs to a Bootstrap with a different "
+                                 "configuration, remove it or use another name.")
+            valid_size = file.tell()
+            while True:
+                try:
+                    result = pickle.load(file)
+                except Exception: # End of file or partially written record
+                    break
+                self._results[result.seed] = result
+                valid_size = file.tell()
+        return valid_size
@@ -0,0 +1,541 @@
+"""
+Functionality to compute the average of all consistent extensions of a
+    PDAG without materializing a single DAG:
+    - average_consistent_extension splits the PDAG into its chain components
+        and counts the acyclic moral orientations (AMOs) of each chordal
+        component, which gives the exact probability of each edge orientation.
+    - sample_consistent_extensions estimates this average from uniformly
+        drawn consistent extensions, with a Monte Carlo error.
+    - exact_cost estimates the cost of the exact computation.
+    - pack_extensions and unpack_extensions store enumerated consistent
+        extensions compactly as bits.
+    Fully directed PDAGs are returned as they are, PDAGs whose extensions
+        do not factorize over the chain components are enumerated or sampled
+        by rejection.
+"""
+
+# Standard
+from typing import Iterator
+from math import factorial
+import numpy as np
+
+# Third party
+from sempler.utils import all_dags, pdag_to_dag, is_dag, is_consistent_extension
+
+
+def average_consistent_extension(pdag: np.ndarray) -> tuple[np.ndarray, int]:
+    """
+    Average of all consistent extensions of the passed PDAG, equal to
+        averaging the DAGs returned by sempler.utils.all_dags.
+    If the directed edges form a chain graph whose chain components are
+        only entered by arrows from parents adjacent to the whole
+        neighbourhood (as in any CPDAG), the extensions are the products
+        of the AMOs of the chain components and are counted per component.
+        Otherwise the extensions are enumerated.
+
+    Args:
+        pdag (np.ndarray): Adjacency matrix, pdag[i, j] != 0 and pdag[j, i] != 0
+            denotes an undirected edge, pdag[i, j] != 0 only i -> j. Weights
+            are kept, i.e. entry (i, j) of the average is pdag[i, j] times
+            the fraction of extensions containing i -> j.
+
+    Returns:
+        tuple[np.ndarray, int]: The average consistent extension, None if
+            there is no consistent extension, and the number of extensions.
+    """
+    pdag = np.asarray(pdag)
+    directed, undirected = _split_edges(pdag)
+    if not undirected.any(): # Fast path: The only extension is the PDAG itself, if it is acyclic
+        return (pdag.astype(float), 1) if _is_acyclic(directed) else (None, 0)
+    labels = _connected_components(undirected)
+    if not _factorizes(directed, undirected, labels):
+        return _enumerate(pdag)
+
+    probabilities = directed.astype(float)
+    nr_extensions = 1
+    for nodes in _chain_components(labels):
+        adjacency = undirected[np.ix_(nodes, nodes)]
+        if not _is_chordal(adjacency):
+            return None, 0 # A non-chordal graph has no AMO
+        counter = _AMOCounter(adjacency)
+        count = counter.count()
+        nr_extensions *= count
+        probabilities[np.ix_(nodes, nodes)] = [[n / count for n in row] for row in counter.count_oriented()]
+    return pdag * probabilities, nr_extensions
+
+
+def sample_consistent_extensions(pdag: np.ndarray, nr_samples: int, 
+                                 rng: np.random.Generator) -> tuple[np.ndarray, int, float]:
+    """
+    Estimate the average of all consistent extensions of the passed PDAG
+        from nr_samples uniformly drawn consistent extensions.
+    If the extensions factorize over the chain components (see
+        average_consistent_extension), each chordal component is sampled
+        exactly uniformly with Clique-Picking. Otherwise, uniformly random
+        orientations of the undirected edges are drawn until they form a
+        consistent extension, in total at most 100 * nr_samples times. If
+        all of them are rejected, there is no estimate: The extensions are
+        not enumerated, as sampling is used where enumerating is too costly.
+
+    Args:
+        pdag (np.ndarray): Adjacency matrix, see average_consistent_extension.
+        nr_samples (int): Number of consistent extensions to draw.
+        rng (np.random.Generator): Source of randomness.
+
+    Returns:
+        tuple[np.ndarray, int, float]: The estimated average consistent
+            extension, None if there is no consistent extension, the number
+            of extensions, None if it is unknown, and the Monte Carlo error,
+            i.e. the largest standard error of an entry of the estimate
+            (0 if it was computed exactly, NaN if only a single extension 
+            could be drawn). If all drawn orientations were rejected, the
+            estimate and the number are None and the error is NaN.
+    """
+    pdag = np.asarray(pdag)
+    directed, undirected = _split_edges(pdag)
+    if not undirected.any(): # Fast path: The only extension is the PDAG itself, if it is acyclic
+        return (pdag.astype(float), 1, 0.0) if _is_acyclic(directed) else (None, 0, 0.0)
+    labels = _connected_components(undirected)
+    if _factorizes(directed, undirected, labels):
+        counters = []
+        nr_extensions = 1
+        for nodes in _chain_components(labels):
+            adjacency = undirected[np.ix_(nodes, nodes)]
+            if not _is_chordal(adjacency):
+                return None, 0, 0.0 # A non-chordal graph has no AMO
+            counters.append((nodes, _AMOCounter(adjacency)))
+            nr_extensions *= counters[-1][1].count()
+        samples = (_draw_from_components(directed, counters, rng) for _ in range(nr_samples))
+    else:
+        try:
+            pdag_to_dag(pdag)
+        except ValueError: # No consistent extension exists
+            return None, 0, 0.0
+        nr_extensions = None
+        samples = _draw_by_rejection(pdag, directed, undirected, nr_samples, rng)
+
+    frequencies = np.zeros(pdag.shape)
+    drawn = 0
+    for sample in samples:
+        frequencies += sample
+        drawn += 1
+    if drawn == 0: # All drawn orientations were rejected, consistent extensions exist but are unknown
+        return None, None, np.nan
+    probabilities = frequencies / drawn
+    mc_error = np.nan
+    if drawn > 1:
+        mc_error = float(np.max(np.abs(pdag) * np.sqrt(probabilities*(1 - probabilities) / (drawn - 1))))
+    return pdag * probabilities, nr_extensions, mc_error
+
+
+def exact_cost(pdag: np.ndarray) -> float:
+    """
+    Rough number of elementary operations of average_consistent_extension
+        for the passed PDAG: d^2 * 2^m to enumerate the extensions of a PDAG
+        with d nodes and m undirected edges, k^4 to count the AMOs of a
+        chain component with k nodes.
+    """
+    pdag = np.asarray(pdag)
+    directed, undirected = _split_edges(pdag)
+    if not undirected.any():
+        return 0.0
+    labels = _connected_components(undirected)
+    if not _factorizes(directed, undirected, labels):
+        return float(len(pdag))**2 * 2.0**(undirected.sum() // 2)
+    return float(sum(len(nodes)**4 for nodes in _chain_components(labels)))
+
+
+def pack_extensions(dags: np.ndarray) -> np.ndarray:
+    """
+    Bit-pack the passed consistent extensions (m x d x d) into an uint8 array
+        of shape (m, ceil(d*d / 8)), keeping only which edges are present.
+    """
+    dags = np.asarray(dags)
+    if len(dags) == 0:
+        return np.zeros((0, 0), dtype=np.uint8)
+    return np.packbits((dags != 0).reshape(len(dags), -1), axis=1)
+
+
+def unpack_extensions(packed: np.ndarray, pdag: np.ndarray) -> np.ndarray:
+    """
+    Unpack consistent extensions packed by pack_extensions, taking the edge
+        weights from the PDAG they extend.
+
+    Returns:
+        np.ndarray: The consistent extensions, shape (m, d, d).
+    """
+    pdag = np.asarray(pdag)
+    present = np.unpackbits(packed, axis=1, count=pdag.size).reshape(len(packed), *pdag.shape)
+    return pdag * present
+
+
+def _split_edges(pdag: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Boolean adjacency matrices of the directed and undirected edges."""
+    present = pdag != 0
+    np.fill_diagonal(present, False)
+    return present & ~present.T, present & present.T
+
+
+def _chain_components(labels: np.ndarray) -> list[np.ndarray]:
+    """Nodes of each chain component with more than one node."""
+    components = [np.flatnonzero(labels == label) for label in np.unique(labels)]
+    return [nodes for nodes in components if len(nodes) > 1]
+
+
+def _draw_from_components(directed: np.ndarray, counters: list, rng: np.random.Generator) -> np.ndarray:
+    """Uniformly drawn consistent extension (boolean) of a factorizing PDAG."""
+    sample = directed.copy()
+    for nodes, counter in counters:
+        sample[np.ix_(nodes, nodes)] = counter.sample(rng)
+    return sample
+
+
+def _draw_by_rejection(pdag: np.ndarray, directed: np.ndarray, undirected: np.ndarray, 
+                       nr_samples: int, rng: np.random.Generator) -> Iterator[np.ndarray]:
+    """
+    Uniformly drawn consistent extensions (boolean), obtained by orienting
+        the undirected edges uniformly at random and rejecting orientations
+        that are no consistent extension.
+    """
+    tails, heads = np.nonzero(np.triu(undirected))
+    accepted = 0
+    for _ in range(100*nr_samples):
+        flip = rng.random(len(tails)) < 0.5
+        sample = directed.copy()
+        sample[np.where(flip, heads, tails), np.where(flip, tails, heads)] = True
+        if is_dag(sample) and is_consistent_extension(sample.astype(int), pdag):
+            yield sample
+            accepted += 1
+            if accepted == nr_samples:
+                return
+
+
+def _enumerate(pdag: np.ndarray) -> tuple[np.ndarray, int]:
+    """Average and number of the consistent extensions enumerated by all_dags."""
+    dags = all_dags(pdag)
+    if len(dags) == 0:
+        return None, 0
+    return np.average(dags, axis=0), len(dags)
+
+
+def _factorizes(directed: np.ndarray, undirected: np.ndarray, labels: np.ndarray) -> bool:
+    """
+    Whether the consistent extensions are the products of the AMOs of the
+        chain components, i.e. the PDAG is a chain graph and contains no
+        induced a -> b - c.
+    """
+    # No arrow within a chain component
+    if (directed & (labels[:, None] == labels[None, :])).any():
+        return False
+    # No induced a -> b - c, as orienting c -> b would add a v-structure
+    nonadjacent = ~(directed | directed.T | undirected)
+    np.fill_diagonal(nonadjacent, False)
+    if ((directed.T.astype(int) @ nonadjacent.astype(int) > 0) & undirected).any():
+        return False
+    # No directed cycle between the chain components
+    nr_components = labels.max() + 1
+    between = np.zeros((nr_components, nr_components), dtype=bool)
+    parents, children = np.nonzero(directed)
+    between[labels[parents], labels[children]] = True
+    return _is_acyclic(between)
+
+
+def _connected_components(adjacency: np.ndarray) -> np.ndarray:
+    """Label of the connected component of each node of an undirected graph."""
+    labels = np.full(len(adjacency), -1)
+    label = 0
+    for start in range(len(adjacency)):
+        if labels[start] != -1:
+            continue
+        labels[start] = label
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for neighbour in np.flatnonzero(adjacency[node] & (labels == -1)):
+                labels[neighbour] = label
+                stack.append(neighbour)
+        label += 1
+    return labels
+
+
+def _is_acyclic(adjacency: np.ndarray) -> bool:
+    """Whether the directed graph contains no cycle (Kahn's algorithm)."""
+    in_degree = adjacency.sum(axis=0)
+    sources = list(np.flatnonzero(in_degree == 0))
+    visited = 0
+    while sources:
+        node = sources.pop()
+        visited += 1
+        for child in np.flatnonzero(adjacency[node]):
+            in_degree[child] -= 1
+            if in_degree[child] == 0:
+                sources.append(child)
+    return visited == len(adjacency)
+
+
+def _is_chordal(adjacency: np.ndarray) -> bool:
+    """
+    Whether the undirected graph is chordal, i.e. the reverse of a maximum
+        cardinality search ordering is a perfect elimination ordering.
+    """
+    k = len(adjacency)
+    weights = np.zeros(k, dtype=int)
+    numbered = np.zeros(k, dtype=bool)
+    order = []
+    for _ in range(k):
+        node = int(np.argmax(np.where(numbered, -1, weights)))
+        order.append(node)
+        numbered[node] = True
+        weights[adjacency[node]] += 1
+    position = np.empty(k, dtype=int)
+    position[order] = np.arange(k)
+    for node in order:
+        # Earlier neighbours must form a clique
+        earlier = np.flatnonzero(adjacency[node] & (position < position[node]))
+        if len(earlier) > 1:
+            latest = earlier[np.argmax(position[earlier])]
+            others = earlier[earlier != latest]
+            if not adjacency[latest, others].all():
+                return False
+    return True
+
+
+class _AMOCounter:
+    """
+    Counts and uniformly samples the acyclic moral orientations (AMOs) of a
+        connected chordal graph with the Clique-Picking algorithm of Wienöbst,
+        Bannach and Liskiewicz (2021).
+    Every AMO has a topological order starting with a maximal clique K.
+        Fixing K first orients all edges leaving K and further edges by the
+        Meek rules, the AMOs starting with K are the products of the AMOs
+        of the remaining undirected components, which are again connected
+        and chordal. An AMO can start with several cliques, it is only
+        counted for the one closest to the root of a clique tree, i.e. if
+        the order of K does not start with a separator on the path from
+        the root to K. All results per component are memoized.
+    """
+    def __init__(self, adjacency: np.ndarray):
+        """
+        Args:
+            adjacency (np.ndarray): Symmetric boolean adjacency matrix of a
+                connected chordal graph.
+        """
+        self._adjacency = adjacency
+        self._nodes = tuple(range(len(adjacency)))
+        self._cases = {}
+        self._counts = {}
+        self._oriented = {}
+
+    def count(self) -> int:
+        """Number of AMOs."""
+        return self._count(self._nodes)
+
+    def count_oriented(self) -> np.ndarray:
+        """Integer matrix whose entry (i, j) is the number of AMOs containing i -> j."""
+        return self._count_oriented(self._nodes)
+
+    def sample(self, rng: np.random.Generator) -> np.ndarray:
+        """Uniformly drawn AMO as boolean adjacency matrix."""
+        sample = np.zeros(self._adjacency.shape, dtype=bool)
+        self._sample(self._nodes, rng, sample)
+        return sample
+
+    def _cases_of(self, nodes: tuple) -> list[tuple]:
+        """
+        Per maximal clique K of the subgraph induced by nodes: K, the separators
+            its order must not start with, the number of these orders, the edges
+            oriented by fixing K first (flat indices, without the edges within K)
+            and the remaining undirected components.
+        """
+        if nodes in self._cases:
+            return self._cases[nodes]
+        k = len(self._adjacency)
+        index = np.array(nodes)
+        adjacency = np.zeros((k, k), dtype=bool)
+        adjacency[np.ix_(index, index)] = self._adjacency[np.ix_(index, index)]
+        cases = []
+        for clique, prefixes in _clique_tree_prefixes(adjacency, index):
+            # Orient the clique (in any order) and all edges leaving it
+            members = np.zeros(k, dtype=bool)
+            members[clique] = True
+            directed = adjacency & members[:, None]
+            directed[np.ix_(clique, clique)] = np.triu(np.ones((len(clique),)*2, dtype=bool), 1)
+            undirected = adjacency & ~members[:, None] & ~members[None, :]
+            _apply_meek_rules(directed, undirected)
+            directed[np.ix_(clique, clique)] = False
+
+            components = []
+            labels = _connected_components(undirected)
+            for label in np.unique(labels[index]):
+                component = tuple(int(node) for node in index[labels[index] == label])
+                if len(component) > 1:
+                    components.append(component)
+            cases.append((clique, prefixes, _prefix_free_orders(len(clique), prefixes), 
+                          np.flatnonzero(directed), components))
+        self._cases[nodes] = cases
+        return cases
+
+    def _count_case(self, case: tuple) -> int:
+        """Number of AMOs starting with the clique of the passed case."""
+        _, _, orders, _, components = case
+        count = orders
+        for component in components:
+            count *= self._count(component)
+        return count
+
+    def _count(self, nodes: tuple) -> int:
+        """Count the AMOs of the connected chordal subgraph induced by nodes."""
+        if nodes not in self._counts:
+            self._counts[nodes] = sum(self._count_case(case) for case in self._cases_of(nodes))
+        return self._counts[nodes]
+
+    def _count_oriented(self, nodes: tuple) -> np.ndarray:
+        """Per edge of the subgraph induced by nodes, the number of its AMOs containing it."""
+        if nodes in self._oriented:
+            return self._oriented[nodes]
+        k = len(self._adjacency)
+        oriented = np.zeros((k, k), dtype=object)
+        for case in self._cases_of(nodes):
+            clique, prefixes, orders, directed, components = case
+            count = self._count_case(case)
+            # Edges within the clique depend on its order
+            for a, u in enumerate(clique):
+                for v in clique[a+1:]:
+                    before = _prefix_free_orders_before(clique, prefixes, u, v)
+                    oriented[u, v] += before * (count // orders)
+                    oriented[v, u] += (orders - before) * (count // orders)
+            oriented.flat[directed] += count
+            for component in components:
+                oriented += self._count_oriented(component) * (count // self._count(component))
+        self._oriented[nodes] = oriented
+        return oriented
+
+    def _sample(self, nodes: tuple, rng: np.random.Generator, sample: np.ndarray):
+        """Add a uniformly drawn AMO of the subgraph induced by nodes to sample."""
+        cases = self._cases_of(nodes)
+        # Pick the first clique with probability proportional to its number of AMOs
+        position = _random_below(self._count(nodes), rng)
+        for case in cases:
+            position -= self._count_case(case)
+            if position < 0:
+                break
+        clique, prefixes, _, directed, components = case
+        # Uniform order of the clique not starting with a separator, by rejection
+        while True:
+            order = rng.permutation(clique)
+            if not any(set(order[:len(prefix)]) == prefix for prefix in prefixes):
+                break
+        for a, u in enumerate(order):
+            sample[u, order[a+1:]] = True
+        sample.flat[directed] = True
+        for component in components:
+            self._sample(component, rng, sample)
+
+
+def _random_below(bound: int, rng: np.random.Generator) -> int:
+    """Uniform random integer in [0, bound) for arbitrarily large bounds."""
+    nr_bytes = bound.bit_length() // 8 + 8 # Surplus bytes make the modulo bias negligible
+    return int.from_bytes(rng.bytes(nr_bytes), "little") % bound
+
+
+def _clique_tree_prefixes(adjacency: np.ndarray, nodes: np.ndarray) -> list[tuple[list, list]]:
+    """
+    Maximal cliques of a connected chordal graph, each together with the
+        distinct separators on the path from the root of a clique tree to
+        it that are subsets of the clique, ordered from small to large.
+    """
+    # Maximal cliques: Each node with its earlier neighbours in a maximum cardinality search
+    weights = dict.fromkeys((int(node) for node in nodes), 0)
+    visited = []
+    candidates = []
+    while weights:
+        node = max(weights, key=weights.get)
+        del weights[node]
+        candidates.append(frozenset([node, *(n for n in visited if adjacency[node, n])]))
+        visited.append(node)
+        for neighbour in np.flatnonzero(adjacency[node]):
+            if int(neighbour) in weights:
+                weights[int(neighbour)] += 1
+    cliques = [c for c in candidates if not any(c < other for other in candidates)]
+    cliques = list(dict.fromkeys(cliques))
+    # Clique tree: Maximum weight spanning tree with weights |K1 & K2| (Prim)
+    separators = {0: []}
+    best = {i: (len(cliques[0] & cliques[i]), 0) for i in range(1, len(cliques))}
+    while best:
+        i = max(best, key=lambda j: best[j][0])
+        parent = best.pop(i)[1]
+        separators[i] = separators[parent] + [cliques[parent] & cliques[i]]
+        for j in best:
+            if len(cliques[i] & cliques[j]) > best[j][0]:
+                best[j] = (len(cliques[i] & cliques[j]), i)
+    result = []
+    for i, clique in enumerate(cliques):
+        prefixes = sorted({s for s in separators[i] if s <= clique}, key=len)
+        result.append((sorted(clique), prefixes))
+    return result
+
+
+def _prefix_free_orders(size: int, prefixes: list[frozenset]) -> int:
+    """
+    Number of orders of a clique with the passed size that do not start with
+        any of the passed nested prefixes (as a set).
+    """
+    counts = [] # Per prefix, its orders not starting with a smaller prefix
+    for prefix in prefixes + [None]:
+        n = size if prefix is None else len(prefix)
+        counts.append(factorial(n) - sum(count*factorial(n - len(smaller)) 
+                                         for count, smaller in zip(counts, prefixes)))
+    return counts[-1]
+
+
+def _prefix_free_orders_before(clique: list, prefixes: list[frozenset], u: int, v: int) -> int:
+    """
+    Number of orders of the clique that do not start with any of the passed
+        nested prefixes and place u before v.
+    """
+    counts = [] # Per prefix, its orders not starting with a smaller prefix
+    before = [] # The same, only those placing u before v (if both in the prefix)
+    for prefix in prefixes + [frozenset(clique)]:
+        n = len(prefix)
+        counts.append(factorial(n) - sum(count*factorial(n - len(smaller)) 
+                                         for count, smaller in zip(counts, prefixes)))
+        if u not in prefix or v not in prefix:
+            before.append(None)
+            continue
+        excluded = 0
+        for count, count_before, smaller in zip(counts, before, prefixes):
+            rest = factorial(n - len(smaller))
+            if u in smaller and v in smaller:
+                excluded += count_before*rest
+            elif u in smaller:
+                excluded += count*rest
+            elif v not in smaller:
+                excluded += count*rest // 2
+        before.append(factorial(n) // 2 - excluded)
+    return before[-1]
+
+
+def _apply_meek_rules(directed: np.ndarray, undirected: np.ndarray):
+    """
+    Orient undirected edges in place by the Meek rules 1-3 until no rule
+        applies anymore.
+    """
+    while True:
+        adjacent = directed | directed.T | undirected
+        nonadjacent = ~adjacent
+        np.fill_diagonal(nonadjacent, False)
+        d = directed.astype(int)
+        # Rule 1: a -> b - c and a, c nonadjacent => b -> c
+        orient = (d.T @ nonadjacent.astype(int) > 0) & undirected
+        # Rule 2: a -> b -> c and a - c => a -> c
+        orient |= (d @ d > 0) & undirected
+        # Rule 3: a - c -> b, a - d -> b, a - b and c, d nonadjacent => a -> b
+        for a, b in zip(*np.nonzero(undirected & ~orient)):
+            middle = np.flatnonzero(undirected[a] & directed[:, b])
+            if len(middle) > 1 and nonadjacent[np.ix_(middle, middle)].any():
+                orient[a, b] = True
+        orient &= ~orient.T # Keep only unambiguous orientations
+        if not orient.any():
+            return
+        directed |= orient
+        undirected &= ~(orient | orient.T)
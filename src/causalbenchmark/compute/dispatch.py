@@ -0,0 +1,182 @@
+"""
+Functionality to run CausalInferenceTasks in worker processes from small
+    task messages instead of fully pickled tasks:
+    - TaskContext holds everything the tasks of one Bootstrap share and is
+        sent to each worker process only once (as pool initializer argument).
+    - TaskSpec is the per-task message sent to the worker processes.
+"""
+
+# Standard
+from typing import Iterable, Union
+import copy
+import logging
+import numpy as np
+import pandas as pd
+
+# Own
+from .algorithms import Algorithm
+from .causal_inference_task import CausalInferenceTask, TaskResult
+from .shared_data import SharedDatasetsHandle
+from .suffstats import SuffStats
+from .thread_limits import limit_threads
+from ..util import bootstrap_sample, bootstrap_indices, bootstrap_weights
+
+
+# TaskContext instances available in a worker process, keyed by TaskSpec.key
+_WORKER_CONTEXTS = {}
+
+# Resampling options representing a bootstrap sample by row multiplicities, 
+# mapped to the method of bootstrap_weights they are drawn with
+WEIGHTED_RESAMPLING = {"weights": "multinomial", "poisson": "poisson"}
+
+
+class TaskContext:
+    """Everything the CausalInferenceTasks of one Bootstrap have in common."""
+    def __init__(self,
+                 algorithm: Algorithm,
+                 true_dag: pd.DataFrame,
+                 datasets: Union[Iterable[pd.DataFrame], SharedDatasetsHandle],
+                 sample_sizes: tuple,
+                 resampling: str = "dataframe",
+                 extensions: str = "auto",
+                 nr_extension_samples: int = 1000,
+                 extension_cache_dir: str = None,
+                 keep_cons_extensions: bool = False,
+                 sufficient_statistics: bool = False):
+        """
+        Args:
+            algorithm (Algorithm): Algorithm, copied for each task.
+            true_dag (pd.DataFrame): The true DAG, copied for each task.
+            datasets (Iterable[pd.DataFrame] | SharedDatasetsHandle): The data
+                to bootstrap from or a handle to it in shared memory.
+            sample_sizes (tuple): One sample size per df.
+            resampling (str): "dataframe", "index", "weights" or "poisson", see
+                Bootstrap. Defaults to "dataframe".
+            extensions (str): See CausalInferenceTask. Defaults to "auto".
+            nr_extension_samples (int): See CausalInferenceTask. Defaults to 1000.
+            extension_cache_dir (str, optional): See CausalInferenceTask. Defaults to None.
+            keep_cons_extensions (bool): See CausalInferenceTask. Defaults to False.
+            sufficient_statistics (bool): See CausalInferenceTask, only applies to
+                index resampling (weighted samples always use them). Defaults to False.
+        """
+        self._algorithm = algorithm
+        self._true_dag = true_dag
+        self._datasets = datasets
+        self._sample_sizes = sample_sizes
+        self._resampling = resampling
+        self._extensions = extensions
+        self._nr_extension_samples = nr_extension_samples
+        self._extension_cache_dir = extension_cache_dir
+        self._keep_cons_extensions = keep_cons_extensions
+        self._sufficient_statistics = sufficient_statistics
+
+    def get_datasets(self) -> list[pd.DataFrame]:
+        """Get the data to bootstrap from, attaching to shared memory if needed."""
+        if isinstance(self._datasets, SharedDatasetsHandle):
+            self._datasets = self._datasets.attach()
+        return self._datasets
+
+    def create_task(self, spec: "TaskSpec", suffstats: SuffStats = None) -> CausalInferenceTask:
+        """
+        Create the CausalInferenceTask described by the passed TaskSpec.
+        If the spec carries no sample indices (or weights), the bootstrap
+            sample is regenerated from the spec's seed, giving the identical
+            sample in every process. Precomputed SuffStats of the sample can
+            be passed for index and weighted resampling.
+        """
+        datasets = self.get_datasets()
+        if self._resampling in WEIGHTED_RESAMPLING:
+            sample_weights = spec.sample_weights
+            if sample_weights is None:
+                sample_weights = bootstrap_weights(datasets=datasets, sample_sizes=self._sample_sizes,
+                                                   seed=spec.seed, method=WEIGHTED_RESAMPLING[self._resampling])
+            return CausalInferenceTask(
+                algorithm=copy.deepcopy(self._algorithm),
+                data=datasets,
+                true_dag=self._true_dag.copy(),
+                extensions=self._extensions,
+                nr_extension_samples=self._nr_extension_samples,
+                seed=spec.seed,
+                extension_cache_dir=self._extension_cache_dir,
+                keep_cons_extensions=self._keep_cons_extensions,
+                suffstats=suffstats,
+                sample_weights=sample_weights
+            )
+        if spec.sample_indices is None and self._resampling == "dataframe":
+            return CausalInferenceTask(
+                algorithm=copy.deepcopy(self._algorithm),
+                data=bootstrap_sample(datasets=datasets, sample_sizes=self._sample_sizes, 
+                                      seed=spec.seed),
+                true_dag=self._true_dag.copy(),
+                extensions=self._extensions,
+                nr_extension_samples=self._nr_extension_samples,
+                seed=spec.seed,
+                extension_cache_dir=self._extension_cache_dir,
+                keep_cons_extensions=self._keep_cons_extensions
+            )
+        sample_indices = spec.sample_indices
+        if sample_indices is None:
+            sample_indices = bootstrap_indices(datasets=datasets, sample_sizes=self._sample_sizes,
+                                               seed=spec.seed)
+        return CausalInferenceTask(
+            algorithm=copy.deepcopy(self._algorithm),
+            data=datasets,
+            true_dag=self._true_dag.copy(),
+            sample_indices=sample_indices,
+            extensions=self._extensions,
+            nr_extension_samples=self._nr_extension_samples,
+            seed=spec.seed,
+            extension_cache_dir=self._extension_cache_dir,
+            keep_cons_extensions=self._keep_cons_extensions,
+            sufficient_statistics=self._sufficient_statistics,
+            suffstats=suffstats
+        )
+
+
+class TaskSpec:
+    """Small message describing a single bootstrap replicate."""
+    __slots__ = ("key", "replicate", "seed", "sample_indices", "sample_weights")
+
+    def __init__(self, key, replicate: int, seed: int,
+                 sample_indices: Iterable[np.ndarray] = None,
+                 sample_weights: Iterable[np.ndarray] = None):
+        """
+        Args:
+            key: Key of the TaskContext the task belongs to.
+            replicate (int): Position of the replicate within its Bootstrap.
+            seed (int): Seed the bootstrap sample is drawn with.
+            sample_indices (Iterable[np.ndarray], optional): Row indices
+                of the bootstrap sample, one array per df. Defaults to None,
+                i.e. the sample is regenerated from the seed.
+            sample_weights (Iterable[np.ndarray], optional): Row multiplicities
+                of a weighted bootstrap sample, one vector per df. Defaults to
+                None, i.e. the sample is regenerated from the seed.
+        """
+        self.key = key
+        self.replicate = replicate
+        self.seed = seed
+        self.sample_indices = sample_indices
+        self.sample_weights = sample_weights
+
+
+def init_worker(contexts: dict, threads: int = None):
+    """
+    Pool initializer, stores the passed TaskContexts in the worker process
+        and limits its threads if threads is passed.
+    """
+    if threads is not None:
+        limit_threads(threads)
+    _WORKER_CONTEXTS.clear()
+    _WORKER_CONTEXTS.update(contexts)
+
+
+def run_task_spec(spec: TaskSpec) -> TaskResult:
+    """
+    Used for multiprocessing, creates and runs the task described by spec.
+    Only the compact TaskResult is sent back.
+    """
+    logging.info("Started fitting a causal_inference_task in run_task_spec.")
+    task = _WORKER_CONTEXTS[spec.key].create_task(spec)
+    task.run_task()
+    logging.info("Fitted a causal_inference_task in run_task_spec.")
+    return task.to_result(replicate=spec.replicate, seed=spec.seed)
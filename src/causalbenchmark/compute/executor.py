@@ -0,0 +1,292 @@
+"""
+Class 'TaskExecutor' to run tasks in worker processes. Unlike
+    multiprocessing.Pool, each worker is connected via its own pipe and
+    runs one task at a time, such that a single stuck or dead worker (e.g.
+    segfault or OOM kill in a C extension) can be detected, terminated and
+    replaced without stalling or losing the other tasks. Workers can be
+    recycled after a number of tasks or when their memory grows too large.
+"""
+
+# Standard
+from typing import Any, Callable, Iterable, Iterator, Union
+from collections import deque
+import multiprocessing
+from multiprocessing.connection import wait
+import time
+import logging
+
+# Third party
+import psutil
+
+
+# Outcomes of a task as yielded by TaskExecutor.imap_unordered
+TASK_DONE = "done"
+TASK_TIMED_OUT = "timed_out"
+TASK_CRASHED = "crashed" # Worker process died while running the task, on every attempt
+TASK_MEMORY_EXCEEDED = "memory_exceeded"
+
+# Seconds between two checks of the memory of busy workers
+_MEMORY_POLL_INTERVAL = 0.5
+
+
+def _worker_loop(conn, fn: Callable, initializer: Callable, initargs: tuple):
+    """Main function of a worker process: receive items, send back fn(item)."""
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            item = conn.recv()
+        except EOFError:
+            break
+        if item is None: # Sentinel to shut down
+            break
+        try:
+            conn.send((True, fn(item)))
+        except Exception as e:
+            conn.send((False, e))
+
+
+class _Worker:
+    """A worker process together with the parent's end of its pipe."""
+    def __init__(self, ctx, fn: Callable, initializer: Callable, initargs: tuple):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_loop, args=(child_conn, fn, initializer, initargs),
+                                   daemon=True)
+        self.process.start()
+        child_conn.close() # Only the worker holds this end, so its death is noticed
+        self.item = None
+        self.attempt = 0
+        self.started = None
+        self.tasks_done = 0
+
+    def rss(self) -> int:
+        """Resident memory in bytes of the worker and its child processes."""
+        try:
+            process = psutil.Process(self.process.pid)
+            return sum(p.memory_info().rss for p in [process, *process.children(recursive=True)])
+        except psutil.Error: # Worker (or a child) exited in the meantime
+            return 0
+
+    def stop(self, kill: bool = False):
+        """Stop the worker, gracefully unless kill is True."""
+        if kill:
+            self.process.terminate()
+        else:
+            try:
+                self.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        self.process.join(timeout=None if kill else 5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class TaskExecutor:
+    """
+    Runs fn on each passed item in a fixed number of worker processes.
+    A task that runs longer than timeout seconds is stopped by terminating
+        its worker, which is then replaced by a fresh one.
+    If a worker dies while running a task, it is replaced and the task is
+        retried up to max_retries times on a fresh worker.
+    A worker whose resident memory exceeds memory_limit while running a task
+        is terminated as well. After finishing a task, a worker is replaced
+        if it exceeds memory_limit or has run max_tasks_per_child tasks.
+    """
+    def __init__(self, processes: int, fn: Callable, initializer: Callable = None,
+                 initargs: tuple = (), timeout: Union[float, Callable[[Any], float]] = None,
+                 max_retries: Union[int, Callable[[Any], int]] = 0,
+                 memory_limit: Union[int, Callable[[Any], int]] = None,
+                 max_tasks_per_child: int = None):
+        """
+        Args:
+            processes (int): Number of worker processes.
+            fn (Callable): Picklable function applied to each item.
+            initializer (Callable, optional): Called with initargs in each
+                (also each replacing) worker process before any item.
+            initargs (tuple, optional): Arguments passed to initializer.
+            timeout (float | Callable, optional): Wall-clock seconds after which
+                a task is stopped, or a function returning these seconds (or None)
+                for the passed item. Defaults to None, i.e. no timeout.
+            max_retries (int | Callable, optional): How often a task whose worker
+                died is retried, or a function returning this number for the
+                passed item. Timed out tasks are not retried. Defaults to 0.
+            memory_limit (int | Callable, optional): Maximum resident memory in
+                bytes of a worker (including its child processes), or a function
+                returning it (or None) for the passed item. Checked every
+                0.5 seconds. Defaults to None, i.e. no limit.
+            max_tasks_per_child (int, optional): Number of tasks after which a
+                worker is replaced. Defaults to None, i.e. workers live as long
+                as the executor.
+        """
+        if processes < 1:
+            raise ValueError("At least one worker process is required.")
+        if not callable(max_retries) and max_retries < 0:
+            raise ValueError("max_retries must not be negative.")
+        if timeout is not None and not callable(timeout) and timeout <= 0:
+            raise ValueError("timeout must be positive.")
+        if memory_limit is not None and not callable(memory_limit) and memory_limit <= 0:
+            raise ValueError("memory_limit must be positive.")
+        if max_tasks_per_child is not None and max_tasks_per_child < 1:
+            raise ValueError("max_tasks_per_child must be at least 1.")
+        self._processes = processes
+        self._fn = fn
+        self._initializer = initializer
+        self._initargs = initargs
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._memory_limit = memory_limit
+        self._max_tasks_per_child = max_tasks_per_child
+        self._ctx = multiprocessing.get_context()
+
+    def imap_unordered(self, items: Iterable) -> Iterator[tuple[Any, str, Any]]:
+        """
+        Lazily send the items to the workers and yield in order of completion.
+
+        Yields:
+            tuple[Any, str, Any]: The item, its outcome (TASK_DONE, TASK_TIMED_OUT,
+                TASK_CRASHED or TASK_MEMORY_EXCEEDED) and fn(item) if done, else None.
+
+        Raises:
+            Exception: Any exception raised by fn is re-raised.
+        """
+        items = iter(items)
+        retries = deque() # (item, attempt) of tasks whose worker died
+        workers = [self._new_worker() for _ in range(self._processes)]
+        items_left = True
+        try:
+            while True:
+                # Keep every idle worker busy, retries first
+                for index, worker in enumerate(workers):
+                    if worker.item is not None:
+                        continue
+                    if retries:
+                        item, attempt = retries.popleft()
+                    elif items_left:
+                        try:
+                            item, attempt = next(items), 0
+                        except StopIteration:
+                            items_left = False
+                            continue
+                    else:
+                        continue
+                    workers[index] = self._submit(worker, item, attempt)
+                busy = [worker for worker in workers if worker.item is not None]
+                if not busy:
+                    return
+
+                ready = wait([worker.conn for worker in busy] + [worker.process.sentinel for worker in busy],
+                             timeout=self._wait_timeout(busy))
+                for index, worker in enumerate(workers):
+                    if worker.item is None:
+                        continue
+                    item = worker.item
+                    if worker.conn in ready or worker.process.sentinel in ready:
+                        try:
+                            success, value = worker.conn.recv()
+                        except (EOFError, OSError):
+                            worker.process.join(timeout=1)
+                            max_retries = self._max_retries_of(item)
+                            logging.info(f"Worker process died with exit code {worker.process.exitcode} "
+                                         f"(attempt {worker.attempt+1} of {max_retries+1}).")
+                            workers[index] = self._replace(worker)
+                            if worker.attempt < max_retries:
+                                retries.append((item, worker.attempt+1))
+                            else:
+                                yield item, TASK_CRASHED, None
+                            continue
+                        worker.item = None
+                        worker.tasks_done += 1
+                        if not success:
+                            raise value
+                        if self._needs_recycling(worker, item):
+                            workers[index] = self._recycle(worker)
+                        yield item, TASK_DONE, value
+                    elif self._timed_out(worker):
+                        logging.info(f"Task exceeded the timeout of {self._timeout_of(item)}s, terminating its worker.")
+                        workers[index] = self._replace(worker)
+                        yield item, TASK_TIMED_OUT, None
+                    elif self._memory_exceeded(worker):
+                        logging.info(f"Worker exceeded the memory limit of {self._memory_limit_of(item)} bytes, "
+                                     "terminating it.")
+                        workers[index] = self._replace(worker)
+                        yield item, TASK_MEMORY_EXCEEDED, None
+        finally:
+            for worker in workers:
+                worker.stop(kill=worker.item is not None)
+
+    def _new_worker(self) -> _Worker:
+        return _Worker(self._ctx, self._fn, self._initializer, self._initargs)
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        """Kill the passed worker and return a fresh one."""
+        worker.stop(kill=True)
+        return self._new_worker()
+
+    def _recycle(self, worker: _Worker) -> _Worker:
+        """Stop the passed idle worker gracefully and return a fresh one."""
+        worker.stop()
+        return self._new_worker()
+
+    def _needs_recycling(self, worker: _Worker, item) -> bool:
+        """Whether the idle worker reached max_tasks_per_child or the memory limit of item."""
+        if self._max_tasks_per_child is not None and worker.tasks_done >= self._max_tasks_per_child:
+            return True
+        memory_limit = self._memory_limit_of(item)
+        return memory_limit is not None and worker.rss() > memory_limit
+
+    def _submit(self, worker: _Worker, item, attempt: int) -> _Worker:
+        """
+        Send the item to the worker. If the idle worker has died in the 
+            meantime, it is replaced first. Returns the worker running the item.
+        """
+        try:
+            worker.conn.send(item)
+        except (BrokenPipeError, ConnectionResetError):
+            logging.info("Idle worker process died, replacing it.")
+            worker = self._replace(worker)
+            worker.conn.send(item)
+        worker.item = item
+        worker.attempt = attempt
+        worker.started = time.monotonic()
+        return worker
+
+    def _max_retries_of(self, item) -> int:
+        """Number of retries for the passed item."""
+        if callable(self._max_retries):
+            return self._max_retries(item)
+        return self._max_retries
+
+    def _memory_limit_of(self, item) -> int:
+        """Memory limit in bytes for the passed item, None if there is none."""
+        if callable(self._memory_limit):
+            return self._memory_limit(item)
+        return self._memory_limit
+
+    def _memory_exceeded(self, worker: _Worker) -> bool:
+        memory_limit = self._memory_limit_of(worker.item)
+        return memory_limit is not None and worker.rss() > memory_limit
+
+    def _timeout_of(self, item) -> float:
+        """Timeout in seconds for the passed item, None if there is none."""
+        if callable(self._timeout):
+            return self._timeout(item)
+        return self._timeout
+
+    def _timed_out(self, worker: _Worker) -> bool:
+        timeout = self._timeout_of(worker.item)
+        return timeout is not None and time.monotonic() - worker.started >= timeout
+
+    def _wait_timeout(self, busy: list[_Worker]) -> float:
+        """
+        Time until the first busy worker exceeds its timeout or its memory
+            has to be checked again, None if neither is limited.
+        """
+        deadlines = [worker.started + self._timeout_of(worker.item) for worker in busy
+                     if self._timeout_of(worker.item) is not None]
+        if any(self._memory_limit_of(worker.item) is not None for worker in busy):
+            deadlines.append(time.monotonic() + _MEMORY_POLL_INTERVAL)
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
@@ -0,0 +1,142 @@
+"""
+Class 'ExtensionCache' to memoize the exact average consistent extension
+    of PDAGs. Bootstrap replicates often return the same PDAG, whose
+    consistent extensions are then only computed once per process (or once
+    at all, if the cache is also stored on disk).
+"""
+
+# Standard
+from typing import Callable
+from collections import OrderedDict
+import os
+import pickle
+import hashlib
+import tempfile
+import numpy as np
+
+
+# ExtensionCache of each process, keyed by cache directory
+_PROCESS_CACHES = {}
+
+
+def process_cache(cache_dir: str = None) -> "ExtensionCache":
+    """
+    Get the ExtensionCache of the calling process for the passed cache
+        directory, created on first use. It is shared by all tasks that
+        run in the process, also of different Bootstrap instances.
+    """
+    if cache_dir not in _PROCESS_CACHES:
+        _PROCESS_CACHES[cache_dir] = ExtensionCache(cache_dir=cache_dir)
+    return _PROCESS_CACHES[cache_dir]
+
+
+class ExtensionCache:
+    """
+    LRU cache mapping a PDAG to its average consistent extension (None if
+        there is none) and number of consistent extensions. PDAGs are keyed
+        by their shape and float64 values, i.e. by the adjacency matrix only.
+    If a cache directory is passed, entries are also written to one file
+        per PDAG in it, such that they survive the process and are shared
+        between processes. Only the in-memory entries are bounded.
+    """
+    def __init__(self, max_entries: int = 1024, cache_dir: str = None):
+        """
+        Args:
+            max_entries (int): Maximum number of entries held in memory, the
+                least recently used entry is evicted first. Defaults to 1024.
+            cache_dir (str, optional): Directory to additionally store the
+                entries in. Defaults to None, i.e. memory only.
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1.")
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._max_entries = max_entries
+        self._cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+    def get_or_compute(self, pdag: np.ndarray, compute: Callable[[np.ndarray], tuple]) -> tuple[tuple, bool]:
+        """
+        Get the cached result for the passed PDAG or compute and cache it.
+
+        Args:
+            pdag (np.ndarray): Adjacency matrix of the PDAG.
+            compute (Callable): Called with pdag on a miss, must return the
+                average consistent extension and the number of extensions.
+
+        Returns:
+            tuple[tuple, bool]: The (cached or computed) result and whether
+                it was cached.
+        """
+        key = self._key(pdag)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return self._entries[key], True
+        result = self._load(key)
+        if result is not None:
+            self._disk_hits += 1
+            self._insert(key, result)
+            return result, True
+        self._misses += 1
+        result = compute(pdag)
+        self._insert(key, result)
+        self._store(key, result)
+        return result, False
+
+    def get_stats(self) -> dict:
+        """
+        Get the number of hits (in memory and on disk), misses and entries
+            in memory, and the hit rate of this process.
+        """
+        lookups = self._hits + self._disk_hits + self._misses
+        return {
+            "hits": self._hits,
+            "disk_hits": self._disk_hits,
+            "misses": self._misses,
+            "hit_rate": (self._hits + self._disk_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries)
+        }
+
+    def clear(self):
+        """Remove all in-memory entries and reset the statistics."""
+        self._entries.clear()
+        self._hits = self._disk_hits = self._misses = 0
+
+    def _key(self, pdag: np.ndarray) -> bytes:
+        """Canonical byte key of the passed adjacency matrix."""
+        pdag = np.ascontiguousarray(pdag, dtype=np.float64)
+        return np.array(pdag.shape, dtype=np.int64).tobytes() + pdag.tobytes()
+
+    def _insert(self, key: bytes, result: tuple):
+        if result[0] is not None:
+            result[0].flags.writeable = False # Shared by all tasks hitting this entry
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key: bytes) -> str:
+        return os.path.join(self._cache_dir, f"{hashlib.sha1(key).hexdigest()}.pkl")
+
+    def _load(self, key: bytes) -> tuple:
+        """Entry stored on disk, None if there is none."""
+        if self._cache_dir is None:
+            return None
+        try:
+            with open(self._path(key), "rb") as file:
+                stored_key, result = pickle.load(file)
+        except Exception: # Missing, or partially written by a killed process
+            return None
+        return result if stored_key == key else None
+
+    def _store(self, key: bytes, result: tuple):
+        """Atomically write the entry to disk, such that readers never see a partial file."""
+        if self._cache_dir is None:
+            return
+        with tempfile.NamedTemporaryFile("wb", dir=self._cache_dir, delete=False) as file:
+            pickle.dump((key, result), file)
+        os.replace(file.name, self._path(key))
@@ -0,0 +1,621 @@
+"""
+Kernel-based independence tests evaluated on the unique rows of a sample
+    weighted by their multiplicities. Bootstrap samples contain many exact
+    duplicate rows (about a third of the rows of a sample as large as
+    the data), the kernel matrix of a sample is the one of its unique rows
+    with rows and columns repeated, so all statistics are weighted sums
+    over the smaller kernel matrix. The results equal those of the
+    original implementations up to rounding:
+    - unique_rows collapses duplicate rows into unique rows and counts.
+    - KernelCache holds the kernel matrices and derived arrays of one
+        fit, so tests of the same variables reuse them.
+    - weighted_hsic_test and weighted_hsic_invariance_test replace the
+        HSIC tests of causaldag used by UT-IGSP.
+    - WeightedKCI replaces the KCI test of causal-learn used by PC.
+Further approximations of the tests by random Fourier features or
+    Nystroem features of low rank, with cost linear in the sample size:
+    - ApproxKCI approximates the KCI test of causal-learn.
+    - approx_hsic_test and approx_hsic_invariance_test approximate the
+        HSIC tests of causaldag.
+"""
+
+# Standard
+from typing import Union, Callable
+from collections import OrderedDict
+import threading
+import hashlib
+import json
+import numpy as np
+
+# Third party
+from scipy import stats
+from causaldag.utils.ci_tests import kernels
+from causaldag.utils.ci_tests._utils import residuals
+from causaldag.utils.core_utils import to_list
+from causaldag.utils.invariance_tests.hsic import combined_mat
+from causallearn.utils.cit import KCI, CIT_Base
+from causallearn.utils.KCI.GaussianKernel import GaussianKernel
+import pygam
+
+
+# Default memory budget of a KernelCache
+DEFAULT_KERNEL_CACHE_BYTES = 2**28
+
+
+def unique_rows(data: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Collapse the duplicate rows of data.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The unique rows and how often each
+            of them is contained in data.
+    """
+    return np.unique(data, axis=0, return_counts=True)
+
+
+class KernelCache:
+    """
+    Least recently used cache of the kernel matrices and derived arrays
+        (residuals, regression matrices, eigenvectors) computed during one
+        fit, keyed by variable subsets. Tests of the same variables with 
+        different partners or conditioning sets reuse them. A cache must 
+        only be shared by tests on the same data. It is thread-safe, tests
+        running in parallel threads may compute the same entry twice.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_KERNEL_CACHE_BYTES):
+        """
+        Args:
+            max_bytes (int, optional): Memory budget of the cached arrays, the 
+                least recently used ones are evicted beyond it. Defaults to
+                DEFAULT_KERNEL_CACHE_BYTES.
+        """
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, compute: Callable):
+        """Cached value of key, computed by compute() if it is missing."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key][0]
+            self._misses += 1
+        # Computed outside of the lock, so other threads are not blocked
+        value = compute()
+        nbytes = sum(item.nbytes for item in (value if isinstance(value, tuple) else (value,))
+                     if isinstance(item, np.ndarray))
+        with self._lock:
+            if nbytes <= self._max_bytes and key not in self._entries:
+                self._entries[key] = (value, nbytes)
+                self._nbytes += nbytes
+                while self._nbytes > self._max_bytes:
+                    _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                    self._nbytes -= evicted_nbytes
+        return value
+
+    def __getstate__(self):
+        """The lock is not copied, e.g. when causal-learn deep copies the graph holding the test."""
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get_nbytes(self) -> int:
+        """Memory of the currently cached arrays."""
+        return self._nbytes
+
+    def get_hit_rate(self) -> float:
+        """Fraction of lookups answered from the cache, NaN before the first one."""
+        lookups = self._hits + self._misses
+        return self._hits / lookups if lookups > 0 else float("nan")
+
+
+def _cached(cache: KernelCache, key, compute: Callable):
+    """Look key up in cache, or compute it if there is no cache."""
+    return compute() if cache is None else cache.get(key, compute)
+
+
+def _weighted_center(K: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Unique entries of the centered kernel matrix HKH of the full sample,
+        where K is the kernel matrix of its unique rows.
+    """
+    n = weights.sum()
+    means = K @ weights / n
+    return K - means[:, None] - means[None, :] + weights @ means / n
+
+
+def _weighted_sum(A: np.ndarray, weights: np.ndarray) -> float:
+    """Sum of all entries of the full sample's matrix with unique entries A."""
+    return weights @ A @ weights
+
+
+def _weighted_zscore(data: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """scipy.stats.zscore(ddof=1) of the full sample, constant columns are set to 0."""
+    n = weights.sum()
+    centered = data - weights @ data / n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zscores = centered / np.sqrt(weights @ centered**2 / (n - 1))
+    zscores[np.isnan(zscores)] = 0.
+    return zscores
+
+
+#------------------------------------------------------
+# HSIC tests of causaldag
+
+def _weighted_hsic_kernel(x: np.ndarray, weights: np.ndarray, sig: float) -> tuple:
+    """
+    Parts of causaldag's hsic_test_vector depending on one variable: centered
+        kernel matrix, mean off-diagonal kernel entry and sum of the squared 
+        centered kernel matrix of the full sample.
+    """
+    n = weights.sum()
+    k = kernels.rbf_kernel(x.reshape((len(x), -1)), 1/(sig**2))
+    k_centered = _weighted_center(k, weights)
+    # Off-diagonal sums include the pairs of duplicate rows
+    mu = 1/(n*(n-1)) * (_weighted_sum(k, weights) - weights @ np.diag(k))
+    return k_centered, mu, _weighted_sum(k_centered**2, weights)
+
+
+def _weighted_hsic_result(kernel_x: tuple, kernel_y: tuple, weights: np.ndarray, alpha: float) -> dict:
+    """causaldag's hsic_test_vector from the parts computed by _weighted_hsic_kernel."""
+    kx_centered, mu_x, sq_sum_x = kernel_x
+    ky_centered, mu_y, sq_sum_y = kernel_y
+    n = weights.sum()
+
+    statistic = 1/n**2 * _weighted_sum(kx_centered * ky_centered, weights)
+    mean_approx = 1/n * (1 + mu_x*mu_y - mu_x - mu_y)
+    var_approx = 2*(n-4)*(n-5)/(n*(n-1)*(n-2)*(n-3)) * sq_sum_x * sq_sum_y / n**4
+
+    k_approx = mean_approx ** 2 / var_approx
+    prec_approx = var_approx / mean_approx
+
+    critval = stats.gamma.ppf(1-alpha, k_approx, scale=prec_approx)
+    p_value = 1 - stats.gamma.cdf(statistic, k_approx, scale=prec_approx)
+
+    return dict(
+        statistic=statistic,
+        critval=critval,
+        p_value=p_value,
+        reject=statistic > critval,
+        mean_approx=mean_approx,
+        var_approx=var_approx
+    )
+
+
+def weighted_hsic_test_vector(x: np.ndarray, y: np.ndarray, weights: np.ndarray,
+                              sig: float = 1/np.sqrt(2), alpha: float = 0.05) -> dict:
+    """
+    causaldag's hsic_test_vector of the sample containing row k of x and
+        y weights[k] times.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    return _weighted_hsic_result(_weighted_hsic_kernel(x, weights, sig),
+                                 _weighted_hsic_kernel(y, weights, sig), weights, alpha)
+
+
+def _weighted_residuals(samples: np.ndarray, weights: np.ndarray, i: int, cond_set: list[int]) -> np.ndarray:
+    """
+    Residuals of the unique rows as causaldag's residuals of the full sample,
+        i.e. of a GAM fitted to variable i given the conditioning set.
+    """
+    g = pygam.GAM()
+    g.fit(samples[:, cond_set], samples[:, i], weights=weights)
+    return samples[:, i] - g.predict(samples[:, cond_set])
+
+
+def weighted_hsic_test(suffstat: np.ndarray, i: int, j: int, cond_set: Union[list[int], int] = None, 
+                       alpha: float = 0.05, cache: KernelCache = None, sample_key="obs") -> dict:
+    """
+    Drop-in replacement of causaldag's hsic_test, evaluated on the unique
+        rows of the sample. The unique rows and the residuals and kernel parts
+        of each variable given a conditioning set are reused from cache.
+
+    Args:
+        suffstat (np.ndarray): The samples (n x p).
+        i (int): Index of the first variable.
+        j (int): Index of the second variable.
+        cond_set (list[int] | int, optional): Indices of the conditioning set.
+        alpha (float, optional): Level of the test. Defaults to 0.05.
+        cache (KernelCache, optional): Cache of the fit. Defaults to None.
+        sample_key (optional): Identifies suffstat within cache. Defaults to "obs".
+    """
+    cond_set = sorted(to_list(cond_set))
+    rows, counts = _cached(cache, ("rows", sample_key), lambda: unique_rows(suffstat))
+    weights = counts.astype(np.float64)
+
+    def kernel(k: int) -> tuple:
+        def compute():
+            x = rows[:, k] if len(cond_set) == 0 else _weighted_residuals(rows, weights, k, cond_set)
+            return _weighted_hsic_kernel(x, weights, 1/np.sqrt(2))
+        return _cached(cache, ("hsic", sample_key, k, tuple(cond_set)), compute)
+
+    return _weighted_hsic_result(kernel(i), kernel(j), weights, alpha)
+
+
+def weighted_hsic_invariance_test(suffstat: dict, context: int, i: int, cond_set: Union[list[int], int] = None,
+                                  alpha: float = 0.05, cache: KernelCache = None) -> dict:
+    """
+    Drop-in replacement of causaldag's hsic_invariance_test, see weighted_hsic_test.
+        Tests whether variable i given cond_set is independent of the indicator 
+        of the context in the pooled observational and context samples.
+    """
+    obs_samples, iv_samples = suffstat['obs_samples'], suffstat[context]
+    def combine() -> np.ndarray:
+        indicator = np.r_[np.zeros(len(obs_samples)), np.ones(len(iv_samples))]
+        return np.column_stack((np.vstack((obs_samples, iv_samples)), indicator))
+    mat = _cached(cache, ("combined", context), combine)
+    return weighted_hsic_test(mat, i, mat.shape[1]-1, cond_set, alpha=alpha, cache=cache,
+                              sample_key=("context", context))
+
+
+#------------------------------------------------------
+# KCI test of causal-learn
+
+def _empirical_gaussian_kernel(n: int, nr_var: int, conditional: bool) -> GaussianKernel:
+    """Gaussian kernel with causal-learn's empirical width for a sample of size n."""
+    kernel = GaussianKernel()
+    shape_only = np.empty((n, nr_var))
+    if conditional:
+        kernel.set_width_empirical_kci(shape_only)
+    else:
+        kernel.set_width_empirical_hsic(shape_only)
+    return kernel
+
+
+class WeightedKCI(KCI):
+    """
+    causal-learn's KCI test evaluated on the unique rows of the sample. The 
+        kernel matrices of each variable, the regression on each conditioning
+        set and the eigenvectors of the residual kernels are reused from a
+        KernelCache across the tests of one fit. The weighted computation 
+        covers the options causal-learn's pc uses by default (Gaussian kernels
+        with empirical widths and the gamma approximation of the null 
+        distribution), otherwise the test falls back to KCI.
+    """
+    def __init__(self, data: np.ndarray, cache_bytes: int = DEFAULT_KERNEL_CACHE_BYTES, **kwargs):
+        """
+        Args:
+            data (np.ndarray): The samples (n x p).
+            cache_bytes (int, optional): Memory budget of the KernelCache.
+                Defaults to DEFAULT_KERNEL_CACHE_BYTES.
+        """
+        super().__init__(data, **kwargs)
+        self._kernel_cache = KernelCache(cache_bytes)
+        self._rows, self._weights = None, None
+
+    def __call__(self, X, Y, condition_set=None):
+        Xs, Ys, condition_set, cache_key = self.get_formatted_XYZ_and_cachekey(X, Y, condition_set)
+        if cache_key in self.pvalue_cache:
+            return self.pvalue_cache[cache_key]
+        if not self._supports_weights(conditional=len(condition_set) > 0):
+            return super().__call__(X, Y, condition_set)
+        if self._rows is None:
+            self._rows, counts = unique_rows(self.data)
+            self._weights = counts.astype(np.float64)
+        if len(condition_set) == 0:
+            p = self._unconditional_pvalue(tuple(Xs), tuple(Ys))
+        else:
+            p = self._conditional_pvalue(tuple(Xs), tuple(Ys), tuple(condition_set))
+        self.pvalue_cache[cache_key] = p
+        return p
+
+    def get_kernel_cache(self) -> KernelCache:
+        return self._kernel_cache
+
+    def _supports_weights(self, conditional: bool) -> bool:
+        if conditional:
+            test = self.kci_ci
+            kernels = (test.kernelX, test.kernelY, test.kernelZ)
+            return kernels == ('Gaussian',)*3 and test.est_width == 'empirical' and test.approx and not test.use_gp
+        test = self.kci_ui
+        return (test.kernelX, test.kernelY) == ('Gaussian',)*2 and test.est_width == 'empirical' and test.approx
+
+    def _unconditional_kernel(self, variables: tuple) -> tuple:
+        """Centered kernel matrix of KCI_UInd, its trace and the sum of its squares."""
+        def compute():
+            weights = self._weights
+            kernel = _empirical_gaussian_kernel(int(weights.sum()), len(variables), conditional=False)
+            Kc = _weighted_center(kernel.kernel(_weighted_zscore(self._rows[:, variables], weights)), weights)
+            return Kc, weights @ np.diag(Kc), _weighted_sum(Kc**2, weights)
+        return self._kernel_cache.get(("unconditional", variables), compute)
+
+    def _unconditional_pvalue(self, Xs: tuple, Ys: tuple) -> float:
+        """KCI_UInd.compute_pvalue of the sample."""
+        n = self._weights.sum()
+        Kxc, trace_x, sq_sum_x = self._unconditional_kernel(Xs)
+        Kyc, trace_y, sq_sum_y = self._unconditional_kernel(Ys)
+        test_stat = _weighted_sum(Kxc * Kyc, self._weights)
+        mean_appr = trace_x * trace_y / n
+        var_appr = 2 * sq_sum_x * sq_sum_y / n / n
+        k_appr, theta_appr = mean_appr**2 / var_appr, var_appr / mean_appr
+        return 1 - stats.gamma.cdf(test_stat, k_appr, 0, theta_appr)
+
+    def _regression(self, condition_set: tuple) -> tuple:
+        """
+        Regression on the conditioning set: With P the (n x u) matrix repeating 
+            the unique rows and W = P^T P = diag(weights), the residual maker of
+            the full sample Rz = eps (Kz + eps I)^-1 satisfies Rz P = P G with
+            G = eps (Cz W + eps I)^-1.
+
+        Returns:
+            tuple: G, the zscored conditioning set and the kernel of KCI_CInd.
+        """
+        def compute():
+            weights = self._weights
+            data_z = _weighted_zscore(self._rows[:, condition_set], weights)
+            # Empirical widths are determined by data_z's shape, as in KCI_CInd
+            kernel = _empirical_gaussian_kernel(int(weights.sum()), data_z.shape[1], conditional=True)
+            Cz = _weighted_center(kernel.kernel(data_z), weights)
+            eps = self.kci_ci.epsilon_x
+            G = eps * np.linalg.inv(Cz * weights[None, :] + eps * np.eye(len(weights)))
+            return G, data_z, kernel
+        return self._kernel_cache.get(("regression", condition_set), compute)
+
+    def _residual_kernel(self, variables: tuple, condition_set: tuple, role: str) -> tuple:
+        """
+        Unique entries D = G C G^T of the residual kernel matrix Rz K Rz of
+            KCI_CInd for the variables as data_x (role "x", with half the 
+            conditioning set appended) or data_y (role "y"), and the scaled
+            eigenvectors of W^1/2 D W^1/2, which carries the nonzero eigenpairs
+            of Rz K Rz.
+        """
+        def compute():
+            weights = self._weights
+            G, data_z, kernel = self._regression(condition_set)
+            data = _weighted_zscore(self._rows[:, variables], weights)
+            if role == "x":
+                data = np.concatenate((data, 0.5 * data_z), axis=1)
+            D = G @ _weighted_center(kernel.kernel(data), weights) @ G.T
+            sqrt_weights = np.sqrt(weights)
+            v = self._scaled_eigenvectors(sqrt_weights[:, None] * D * sqrt_weights[None, :], self.kci_ci.thresh)
+            return D, v
+        return self._kernel_cache.get(("residual", role, variables, condition_set), compute)
+
+    def _conditional_pvalue(self, Xs: tuple, Ys: tuple, condition_set: tuple) -> float:
+        """KCI_CInd.compute_pvalue of the sample, see _regression and _residual_kernel."""
+        weights = self._weights
+        Dx, vx = self._residual_kernel(Xs, condition_set, "x")
+        Dy, vy = self._residual_kernel(Ys, condition_set, "y")
+        test_stat = _weighted_sum(Dx * Dy, weights)
+        # Eigenvectors of the full KxR, KyR restricted to the unique rows, times 1/sqrt(weights)
+        u = len(weights)
+        uu = (vx[:, :, None] * vy[:, None, :]).reshape(u, -1) / np.sqrt(weights)[:, None]
+        # uu uu^T and uu^T uu share their trace and the trace of their square
+        uu_prod = uu.dot(uu.T) if uu.shape[1] > u else uu.T.dot(uu)
+        k_appr, theta_appr = self.kci_ci.get_kappa(uu_prod)
+        return 1 - stats.gamma.cdf(test_stat, k_appr, 0, theta_appr)
+
+    @staticmethod
+    def _scaled_eigenvectors(K: np.ndarray, thresh: float) -> np.ndarray:
+        """Eigenvectors of K times the square root of their eigenvalues, as KCI_CInd.get_uuprod."""
+        w, v = np.linalg.eigh(0.5 * (K + K.T))
+        idx = np.argsort(-w)
+        w, v = w[idx], v[:, idx]
+        v = v[:, w > np.max(w) * thresh]
+        w = w[w > np.max(w) * thresh]
+        return v * np.sqrt(w)[None, :]
+
+
+#------------------------------------------------------
+# Approximate KCI test
+
+APPROXIMATIONS = ("rff", "nystroem")
+
+# Number of features of the tested variables in conditional tests, as in
+# RCIT (Strobl et al., 2019). The null distribution's moments need the
+# covariance of all products of their features.
+_NR_TARGET_FEATURES = 5
+
+
+def random_fourier_features(data: np.ndarray, kernel: GaussianKernel, rank: int,
+                            rng: np.random.Generator) -> np.ndarray:
+    """
+    Random Fourier features (n x rank) of the rows of data, whose inner
+        products approximate the passed Gaussian kernel.
+    """
+    frequencies = rng.standard_normal((data.shape[1], rank)) * np.sqrt(kernel.width)
+    shifts = rng.uniform(0, 2*np.pi, rank)
+    return np.sqrt(2/rank) * np.cos(data @ frequencies + shifts)
+
+
+def nystroem_features(data: np.ndarray, kernel: GaussianKernel, rank: int,
+                      rng: np.random.Generator) -> np.ndarray:
+    """
+    Nystroem features (n x at most rank) of the rows of data, whose inner
+        products approximate the passed Gaussian kernel, using rank randomly 
+        drawn rows as landmarks.
+    """
+    landmarks = data[rng.choice(len(data), size=min(rank, len(data)), replace=False)]
+    eigvals, eigvecs = np.linalg.eigh(kernel.kernel(landmarks))
+    keep = eigvals > eigvals.max() * 1e-10
+    return kernel.kernel(data, landmarks) @ eigvecs[:, keep] / np.sqrt(eigvals[keep])
+
+
+class ApproxKCI(CIT_Base):
+    """
+    Approximation of causal-learn's KCI test (Gaussian kernels with empirical
+        widths, gamma approximation of the null distribution) by replacing 
+        each n x n kernel matrix with the inner products of low rank features.
+        Statistics and null moments are then computed from the features,
+        in O(n rank^2) instead of O(n^3).
+    """
+    def __init__(self, data: np.ndarray, approximation: str = "rff", rank: int = 100,
+                 seed: int = 0, **kwargs):
+        """
+        Args:
+            data (np.ndarray): The samples (n x p).
+            approximation (str, optional): "rff" for random Fourier features or
+                "nystroem" for Nystroem features. Defaults to "rff".
+            rank (int, optional): Number of features of the conditioning set
+                and of the tested variables in unconditional tests. Defaults to 100.
+            seed (int, optional): Seed of the features, every test draws them
+                anew from it. Defaults to 0.
+        """
+        super().__init__(data, **kwargs)
+        if approximation not in APPROXIMATIONS:
+            raise ValueError(f"Approximation must be one of {APPROXIMATIONS}, not '{approximation}'.")
+        if rank < 1:
+            raise ValueError("Rank must be positive.")
+        self._approximation = approximation
+        self._rank = rank
+        self._seed = seed
+        self.epsilon = 1e-3 # Regularization of the regression on the conditioning set, as KCI
+        parameters = dict(approximation=approximation, rank=rank, seed=seed)
+        self.check_cache_method_consistent(
+            'approx_kci', hashlib.md5(json.dumps(parameters, sort_keys=True).encode('utf-8')).hexdigest())
+        self.assert_input_data_is_valid()
+
+    def __call__(self, X, Y, condition_set=None):
+        Xs, Ys, condition_set, cache_key = self.get_formatted_XYZ_and_cachekey(X, Y, condition_set)
+        if cache_key in self.pvalue_cache:
+            return self.pvalue_cache[cache_key]
+        rng = np.random.default_rng(self._seed)
+        data_x = stats.zscore(self.data[:, Xs], ddof=1, axis=0)
+        data_y = stats.zscore(self.data[:, Ys], ddof=1, axis=0)
+        if len(condition_set) == 0:
+            p = self._unconditional_pvalue(data_x, data_y, rng)
+        else:
+            data_z = stats.zscore(self.data[:, condition_set], ddof=1, axis=0)
+            p = self._conditional_pvalue(data_x, data_y, data_z, rng)
+        self.pvalue_cache[cache_key] = p
+        return p
+
+    def _centered_features(self, data: np.ndarray, kernel: GaussianKernel, rank: int,
+                           rng: np.random.Generator) -> np.ndarray:
+        """Features F with F F^T approximating the centered kernel matrix HKH."""
+        data = np.nan_to_num(data) # Constant columns
+        if self._approximation == "rff":
+            features = random_fourier_features(data, kernel, rank, rng)
+        else:
+            features = nystroem_features(data, kernel, rank, rng)
+        return features - features.mean(axis=0)
+
+    def _unconditional_pvalue(self, data_x: np.ndarray, data_y: np.ndarray, rng: np.random.Generator) -> float:
+        """KCI_UInd.compute_pvalue with Kxc = Fx Fx^T and Kyc = Fy Fy^T."""
+        n = len(data_x)
+        Fx = self._centered_features(data_x, _empirical_gaussian_kernel(n, data_x.shape[1], False), self._rank, rng)
+        Fy = self._centered_features(data_y, _empirical_gaussian_kernel(n, data_y.shape[1], False), self._rank, rng)
+        test_stat = np.sum((Fx.T @ Fy)**2)
+        mean_appr = np.sum(Fx**2) * np.sum(Fy**2) / n
+        var_appr = 2 * np.sum((Fx.T @ Fx)**2) * np.sum((Fy.T @ Fy)**2) / n / n
+        k_appr, theta_appr = mean_appr**2 / var_appr, var_appr / mean_appr
+        return 1 - stats.gamma.cdf(test_stat, k_appr, 0, theta_appr)
+
+    def _conditional_pvalue(self, data_x: np.ndarray, data_y: np.ndarray, data_z: np.ndarray,
+                            rng: np.random.Generator) -> float:
+        """
+        KCI_CInd.compute_pvalue with KxR = Rx Rx^T and KyR = Ry Ry^T, where Rx, Ry
+            are the residuals of the features Fx, Fy after ridge regression on
+            the features Fz of the conditioning set (by Woodbury, the features of
+            eps (Fz Fz^T + eps I)^-1 applied to Fx, Fy).
+        """
+        n = len(data_x)
+        data_z = np.nan_to_num(data_z)
+        data_x = np.concatenate((data_x, 0.5 * data_z), axis=1)
+        # Empirical widths are determined by data_z's shape, as in KCI_CInd
+        kernel = _empirical_gaussian_kernel(n, data_z.shape[1], conditional=True)
+        Fx = self._centered_features(data_x, kernel, _NR_TARGET_FEATURES, rng)
+        Fy = self._centered_features(data_y, kernel, _NR_TARGET_FEATURES, rng)
+        Fz = self._centered_features(data_z, kernel, self._rank, rng)
+        gram = Fz.T @ Fz + self.epsilon * np.eye(Fz.shape[1])
+        Rx = Fx - Fz @ np.linalg.solve(gram, Fz.T @ Fx)
+        Ry = Fy - Fz @ np.linalg.solve(gram, Fz.T @ Fy)
+        test_stat = np.sum((Rx.T @ Ry)**2)
+        # Rows of uu are the products of the residual features of each sample
+        uu = (Rx[:, :, None] * Ry[:, None, :]).reshape(n, -1)
+        uu_prod = uu.T @ uu
+        mean_appr = np.trace(uu_prod)
+        var_appr = 2 * np.sum(uu_prod**2)
+        k_appr, theta_appr = mean_appr**2 / var_appr, var_appr / mean_appr
+        return 1 - stats.gamma.cdf(test_stat, k_appr, 0, theta_appr)
+
+
+#------------------------------------------------------
+# Approximate HSIC tests
+
+def approx_hsic_test_vector(x: np.ndarray, y: np.ndarray, sig: float = 1/np.sqrt(2), alpha: float = 0.05,
+                            rank: int = 100, seed: int = 0) -> dict:
+    """
+    causaldag's hsic_test_vector with the kernel matrices replaced by the
+        inner products of rank random Fourier features drawn with seed.
+    """
+    x = x.reshape((len(x), -1))
+    y = y.reshape((len(y), -1))
+    n = x.shape[0]
+    if y.shape[0] != n:
+        raise ValueError("Y should have the same number of samples as X")
+    rng = np.random.default_rng(seed)
+    kernel = GaussianKernel(sig)
+
+    fx = random_fourier_features(x, kernel, rank, rng)
+    fy = random_fourier_features(y, kernel, rank, rng)
+    fx_centered = fx - fx.mean(axis=0)
+    fy_centered = fy - fy.mean(axis=0)
+
+    statistic = 1/n**2 * np.sum((fx_centered.T @ fy_centered)**2)
+
+    # Mean diagonal and off-diagonal entries of the approximate kernel matrices.
+    # The diagonal of the Gaussian kernel is 1, the one of the features is only
+    # close to it, taking it as 1 can make mean_approx negative at low rank.
+    diag_x, diag_y = np.sum(fx**2) / n, np.sum(fy**2) / n
+    mu_x = 1/(n*(n-1)) * (np.sum(fx.sum(axis=0)**2) - n*diag_x)
+    mu_y = 1/(n*(n-1)) * (np.sum(fy.sum(axis=0)**2) - n*diag_y)
+    mean_approx = 1/n * (diag_x - mu_x) * (diag_y - mu_y)
+    var_approx = 2*(n-4)*(n-5)/(n*(n-1)*(n-2)*(n-3)) * np.sum((fx_centered.T @ fx_centered)**2) \
+        * np.sum((fy_centered.T @ fy_centered)**2) / n**4
+
+    k_approx = mean_approx ** 2 / var_approx
+    prec_approx = var_approx / mean_approx
+
+    critval = stats.gamma.ppf(1-alpha, k_approx, scale=prec_approx)
+    p_value = 1 - stats.gamma.cdf(statistic, k_approx, scale=prec_approx)
+
+    return dict(
+        statistic=statistic,
+        critval=critval,
+        p_value=p_value,
+        reject=statistic > critval,
+        mean_approx=mean_approx,
+        var_approx=var_approx
+    )
+
+
+def approx_hsic_test(suffstat: np.ndarray, i: int, j: int, cond_set: Union[list[int], int] = None,
+                     alpha: float = 0.05, rank: int = 100, seed: int = 0) -> dict:
+    """
+    Approximation of causaldag's hsic_test, see approx_hsic_test_vector.
+        Compatible with MemoizedCI_Tester, which passes rank and seed on.
+
+    Args:
+        suffstat (np.ndarray): The samples (n x p).
+        i (int): Index of the first variable.
+        j (int): Index of the second variable.
+        cond_set (list[int] | int, optional): Indices of the conditioning set.
+        alpha (float, optional): Level of the test. Defaults to 0.05.
+        rank (int, optional): Number of random Fourier features. Defaults to 100.
+        seed (int, optional): Seed of the features. Defaults to 0.
+    """
+    cond_set = to_list(cond_set)
+    if len(cond_set) == 0:
+        return approx_hsic_test_vector(suffstat[:, i], suffstat[:, j], alpha=alpha, rank=rank, seed=seed)
+    residuals_i, residuals_j = residuals(suffstat, i, j, cond_set)
+    return approx_hsic_test_vector(residuals_i, residuals_j, alpha=alpha, rank=rank, seed=seed)
+
+
+def approx_hsic_invariance_test(suffstat: dict, context: int, i: int, cond_set: Union[list[int], int] = None,
+                                alpha: float = 0.05, rank: int = 100, seed: int = 0) -> dict:
+    """
+    Approximation of causaldag's hsic_invariance_test, see approx_hsic_test.
+        Compatible with MemoizedInvarianceTester.
+    """
+    cond_set = to_list(cond_set)
+    mat = combined_mat(suffstat['obs_samples'], suffstat[context], i, cond_set)
+    return approx_hsic_test(mat, 0, 1, list(range(2, 2+len(cond_set))), alpha=alpha, rank=rank, seed=seed)
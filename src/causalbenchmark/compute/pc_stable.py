@@ -0,0 +1,202 @@
+"""
+Native implementation of the PC-stable algorithm, giving the same result
+    as causal-learn's pc with stable=True:
+    - fisherz_pvalues evaluates a batch of Fisher-z tests from one
+        correlation matrix by inverting all correlation submatrices at once.
+    - ci_test_pvalues evaluates a batch of tests with a causal-learn test
+        object, e.g. KCI, spread over a thread pool.
+    - stable_skeleton runs the order-independent skeleton search, evaluating
+        all tests of one conditioning set size in one batch.
+    - skeleton_discovery runs it with Fisher-z tests.
+    - pc_stable and parallel_pc_stable orient the skeleton with causal-learn's
+        rules.
+"""
+
+# Standard
+from itertools import combinations
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Third party
+from scipy.stats import norm
+from threadpoolctl import threadpool_limits
+from causallearn.graph.GraphClass import CausalGraph
+from causallearn.utils.PCUtils import UCSepset, Meek
+
+
+def fisherz_pvalues(correlation: np.ndarray, sample_size: int, tests: np.ndarray) -> np.ndarray:
+    """
+    P-values of Fisher-z tests of conditional independence, as causal-learn's
+        FisherZ.
+
+    Args:
+        correlation (np.ndarray): Correlation matrix of the data (p x p).
+        sample_size (int): Number of observations the correlations are computed from.
+        tests (np.ndarray): One test per row (B x (2 + l)), the two tested
+            variables followed by the l conditioning variables.
+
+    Returns:
+        np.ndarray: The p-value of each test.
+    """
+    tests = np.asarray(tests, dtype=np.int64)
+    submatrices = correlation[tests[:, :, None], tests[:, None, :]]
+    try:
+        inv = np.linalg.inv(submatrices)
+    except np.linalg.LinAlgError:
+        raise ValueError('Data correlation matrix is singular. Cannot run fisherz test. Please check your data.')
+    r = -inv[:, 0, 1] / np.sqrt(np.abs(inv[:, 0, 0] * inv[:, 1, 1]))
+    # May happen when the sample size is very small or relation is deterministic
+    r = np.where(np.abs(r) >= 1, (1. - np.finfo(float).eps) * np.sign(r), r)
+    Z = 0.5 * np.log((1 + r) / (1 - r))
+    X = np.sqrt(sample_size - (tests.shape[1] - 2) - 3) * np.abs(Z)
+    return 2 * (1 - norm.cdf(np.abs(X)))
+
+
+def ci_test_pvalues(indep_test: Callable, tests: np.ndarray, n_jobs: int = 1) -> np.ndarray:
+    """
+    P-values of a batch of tests evaluated with a causal-learn test object.
+    With several jobs, the tests are spread over a pool of threads and the
+        BLAS backends are limited to one thread meanwhile. The kernel tests
+        spend their time in numpy and LAPACK, which release the GIL, and the
+        threads share the test object's caches.
+
+    Args:
+        indep_test (Callable): Test object called as indep_test(x, y, S),
+            e.g. a causal-learn CIT. Must be thread-safe if n_jobs > 1.
+        tests (np.ndarray): One test per row (B x (2 + l)), as in fisherz_pvalues.
+        n_jobs (int, optional): Number of threads. Defaults to 1.
+
+    Returns:
+        np.ndarray: The p-value of each test.
+    """
+    def evaluate(test):
+        return indep_test(int(test[0]), int(test[1]), tuple(int(s) for s in test[2:]))
+    if n_jobs <= 1 or len(tests) <= 1:
+        return np.array([evaluate(test) for test in tests], dtype=float)
+    with threadpool_limits(limits=1), ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        return np.fromiter(executor.map(evaluate, tests), dtype=float, count=len(tests))
+
+
+def stable_skeleton(nr_var: int, alpha: float, pvalues: Callable) -> tuple[np.ndarray, dict]:
+    """
+    Stable skeleton search of causal-learn's skeleton_discovery(stable=True).
+        At depth l, every adjacent x, y is tested given each subset of size l 
+        of x's other neighbours, and the edges with a p-value above alpha are
+        removed afterwards. The result therefore does not depend on the
+        order of the tests, all distinct tests of one depth are evaluated
+        in a single batch.
+
+    Args:
+        nr_var (int): Number of variables.
+        alpha (float): Significance level of the tests.
+        pvalues (Callable): Maps a batch of tests (B x (2 + l), the two tested
+            variables in increasing order followed by the conditioning set)
+            to their p-values, e.g. fisherz_pvalues or ci_test_pvalues.
+
+    Returns:
+        tuple[np.ndarray, dict]: The boolean adjacency matrix of the skeleton and
+            the separating sets, as causal-learn's CausalGraph.sepset: a list
+            of tuples for each pair (x, y) which was separated.
+    """
+    assert 0 < alpha < 1
+    adjacency = ~np.eye(nr_var, dtype=bool)
+    sepsets = {}
+    depth = -1
+    while adjacency.sum(axis=1).max() - 1 > depth:
+        depth += 1
+        neighbors = [np.flatnonzero(adjacency[x]) for x in range(nr_var)]
+        # Tests of this depth in causal-learn's order, x and y sorted as in its
+        # test objects, so x-y and y-x given the same set are one test
+        pairs, tests = [], {}
+        for x in range(nr_var):
+            for y in neighbors[x]:
+                for S in combinations(neighbors[x][neighbors[x] != y], depth):
+                    test = (min(x, y), max(x, y), *S)
+                    tests.setdefault(test, len(tests))
+                    pairs.append((x, y, test))
+        if len(tests) == 0:
+            break
+        batch = np.array(list(tests), dtype=np.int64).reshape(len(tests), depth + 2)
+        test_pvalues = pvalues(batch)
+
+        separated = {}
+        for x, y, test in pairs:
+            if test_pvalues[tests[test]] > alpha:
+                separated.setdefault((x, y), set()).update(test[2:])
+        # Separating sets are recorded as the pairs are visited in skeleton_discovery
+        edge_removal = set()
+        for x in range(nr_var):
+            for y in neighbors[x]:
+                if (x, y) in separated:
+                    edge_removal.update({(x, y), (y, x)})
+                if (x, y) in edge_removal:
+                    sepset = tuple(separated.get((x, y), ()))
+                    sepsets.setdefault((x, y), []).append(sepset)
+                    sepsets.setdefault((y, x), []).append(sepset)
+        for (x, y) in edge_removal:
+            adjacency[x, y] = False
+    return adjacency, sepsets
+
+
+def skeleton_discovery(correlation: np.ndarray, sample_size: int, alpha: float) -> tuple[np.ndarray, dict]:
+    """
+    Stable skeleton search with Fisher-z tests, see stable_skeleton.
+
+    Args:
+        correlation (np.ndarray): Correlation matrix of the data (p x p).
+        sample_size (int): Number of observations the correlations are computed from.
+        alpha (float): Significance level of the tests.
+
+    Returns:
+        tuple[np.ndarray, dict]: See stable_skeleton.
+    """
+    return stable_skeleton(len(correlation), alpha,
+                           lambda tests: fisherz_pvalues(correlation, sample_size, tests))
+
+
+def _orient(adjacency: np.ndarray, sepsets: dict) -> np.ndarray:
+    """
+    Orient a skeleton with causal-learn's orientation of unshielded colliders
+        (uc_sepset with priority 2) and Meek's rules, as its pc with the default
+        options. Returns the CPDAG in causal-learn's format (CausalGraph.G.graph).
+    """
+    cg = CausalGraph(len(adjacency))
+    nodes = cg.G.nodes
+    for x, y in zip(*np.nonzero(np.triu(~adjacency, k=1))):
+        cg.G.remove_edge(cg.G.get_edge(nodes[x], nodes[y]))
+    for (x, y), sepset in sepsets.items():
+        cg.sepset[x, y] = sepset
+    return Meek.meek(UCSepset.uc_sepset(cg, 2)).G.graph
+
+
+def pc_stable(correlation: np.ndarray, sample_size: int, alpha: float) -> np.ndarray:
+    """
+    PC-stable with Fisher-z tests: skeleton_discovery followed by causal-learn's
+        orientation of unshielded colliders (uc_sepset with priority 2) and
+        Meek's rules, as causal-learn's pc with its default options.
+
+    Returns:
+        np.ndarray: The estimated CPDAG in causal-learn's format (CausalGraph.G.graph).
+    """
+    return _orient(*skeleton_discovery(correlation, sample_size, alpha))
+
+
+def parallel_pc_stable(indep_test: Callable, nr_var: int, alpha: float, n_jobs: int = 1) -> np.ndarray:
+    """
+    PC-stable with any causal-learn test object, the tests of each depth of the
+        skeleton search run in parallel on n_jobs threads (see ci_test_pvalues).
+        Gives the same result as causal-learn's pc with the same test.
+
+    Args:
+        indep_test (Callable): Test object called as indep_test(x, y, S).
+        nr_var (int): Number of variables.
+        alpha (float): Significance level of the tests.
+        n_jobs (int, optional): Number of threads. Defaults to 1.
+
+    Returns:
+        np.ndarray: The estimated CPDAG in causal-learn's format (CausalGraph.G.graph).
+    """
+    adjacency, sepsets = stable_skeleton(nr_var, alpha,
+                                         lambda tests: ci_test_pvalues(indep_test, tests, n_jobs))
+    return _orient(adjacency, sepsets)
@@ -0,0 +1,117 @@
+"""
+Functionality to order the tasks of several Bootstrap instances such that
+    the longest tasks are dispatched first (LPT scheduling):
+    - CostModel estimates the runtime of a task from its sample size,
+        number of variables and algorithm, refined by observed runtimes.
+    - lpt_order lazily picks the next task with the highest estimated cost.
+"""
+
+# Standard
+from typing import Iterator
+
+# Own
+from .algorithms import Algorithm
+from .dispatch import TaskSpec
+
+
+# Exponents (a, b) of the prior cost n^a * d^b of an algorithm class,
+# with n the number of samples and d the number of variables
+_COST_EXPONENTS = {
+    "PC": (1, 3),
+    "UT_IGSP": (1, 3),
+    "GES": (1, 3),
+    "GIES": (1, 3),
+    "GNIES": (1, 4),
+    "NoTears": (1, 3),
+    "Golem": (1, 3),
+    "VarSortRegress": (1, 2),
+    "R2SortRegress": (1, 2),
+    "ICP": (1, 3),
+}
+_DEFAULT_COST_EXPONENTS = (1, 3)
+# Kernel based tests dominate the cost and scale worse in n, 
+# their random feature approximations linearly
+_KERNEL_TEST_N_EXPONENTS = {"kci": 3, "hsic": 2, "rff_kci": 1, "nystroem_kci": 1, "hsic_rff": 1}
+
+
+def prior_cost(algorithm: Algorithm, nr_samples: int, nr_variables: int) -> float:
+    """
+    Prior cost of a single task in arbitrary units, only comparable
+        between tasks of the same algorithm class.
+    """
+    a, b = _COST_EXPONENTS.get(algorithm.__class__.__name__, _DEFAULT_COST_EXPONENTS)
+    test = getattr(algorithm, "_indep_test", None) or getattr(algorithm, "_test", None)
+    a = _KERNEL_TEST_N_EXPONENTS.get(test, a)
+    return float(nr_samples)**a * float(nr_variables)**b
+
+
+class CostModel:
+    """
+    Estimates the runtime of the tasks of several groups (Bootstrap instances),
+        all tasks within a group are assumed to cost the same.
+    As prior costs are only comparable within an algorithm class, each is
+        normalized by the mean prior cost of the groups of its class.
+    A group with observed runtimes is estimated by their mean. Otherwise
+        its normalized prior cost is converted to seconds with the ratio of
+        observed runtime to normalized prior cost of the groups with the same
+        algorithm class, or of all observed groups if no group of that class
+        was observed. Without any observation, the normalized prior cost is
+        returned as is.
+    """
+    def __init__(self):
+        self._priors = {}
+        self._classes = {}
+        self._runtime_sums = {}
+        self._counts = {}
+
+    def add_group(self, key, algorithm: Algorithm, nr_samples: int, nr_variables: int):
+        """Register a group of tasks."""
+        self._priors[key] = prior_cost(algorithm, nr_samples, nr_variables)
+        self._classes[key] = algorithm.__class__.__name__
+        self._runtime_sums[key] = 0.0
+        self._counts[key] = 0
+
+    def observe(self, key, runtime: float):
+        """Record the observed runtime of a task of the passed group."""
+        self._runtime_sums[key] += runtime
+        self._counts[key] += 1
+
+    def estimate(self, key) -> float:
+        """Estimated runtime of a task of the passed group."""
+        if self._counts[key] > 0:
+            return self._runtime_sums[key] / self._counts[key]
+        observed = [other for other in self._priors if self._counts[other] > 0]
+        same_class = [other for other in observed if self._classes[other] == self._classes[key]]
+        if same_class:
+            observed = same_class
+        elif not observed:
+            return self._normalized_prior(key)
+        seconds_per_cost = (sum(self._runtime_sums[other] for other in observed)
+                            / sum(self._normalized_prior(other)*self._counts[other] for other in observed))
+        return self._normalized_prior(key)*seconds_per_cost
+
+    def _normalized_prior(self, key) -> float:
+        """Prior cost of the passed group relative to the mean of its algorithm class."""
+        same_class = [self._priors[other] for other in self._priors if self._classes[other] == self._classes[key]]
+        return self._priors[key] / (sum(same_class) / len(same_class))
+
+
+def lpt_order(specs: dict, cost_model: CostModel) -> Iterator[TaskSpec]:
+    """
+    Lazily yield the TaskSpecs of all groups, always taking the next spec
+        of the group with the highest estimated cost, normalized per
+        algorithm class (see CostModel). As the estimate is reevaluated
+        whenever a spec is requested, runtimes observed in the meantime
+        are taken into account.
+
+    Args:
+        specs (dict): Iterator of TaskSpecs per group key.
+        cost_model (CostModel): Model knowing all group keys.
+    """
+    remaining = dict(specs)
+    while remaining:
+        key = max(remaining, key=cost_model.estimate)
+        try:
+            yield next(remaining[key])
+        except StopIteration:
+            del remaining[key]
@@ -0,0 +1,132 @@
+"""
+Class 'SharedDatasets' to publish the data to bootstrap from once in
+    shared memory.
+Class 'SharedDatasetsHandle' to attach to that data from worker
+    processes without copying it.
+"""
+
+# Standard
+from typing import Iterable
+from multiprocessing import shared_memory, resource_tracker
+import sys
+import numpy as np
+import pandas as pd
+
+
+# Shared memory blocks attached in this process, kept alive until the process ends
+_ATTACHED_BLOCKS = {}
+
+
+def _attach_untracked(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to an existing shared memory block without registering it with
+        the resource tracker, only the creating process owns the block.
+        Before Python 3.13 attaching always registers the block, a tracker
+        of an attaching process would then report it as leaked or unlink it
+        while the creating process still uses it.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    def register_unless_shared_memory(resource_name, rtype):
+        if rtype != "shared_memory":
+            register(resource_name, rtype)
+    resource_tracker.register = register_unless_shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedDatasetsHandle:
+    """
+    Small, picklable description of datasets stored in shared memory.
+    Sending it to a worker process costs a few bytes, independent of
+    the size of the datasets.
+    """
+    def __init__(self, block_names: list[str], shapes: list[tuple],
+                 dtypes: list[str], columns: list[list]):
+        """
+        Args:
+            block_names (list[str]): Name of the shared memory block per df.
+            shapes (list[tuple]): Shape of the values of each df.
+            dtypes (list[str]): Dtype string of the values of each df.
+            columns (list[list]): Column names of each df.
+        """
+        self._block_names = block_names
+        self._shapes = shapes
+        self._dtypes = dtypes
+        self._columns = columns
+
+    def attach(self) -> list[pd.DataFrame]:
+        """
+        Attach to the shared memory blocks and return read-only dfs
+            that are backed by them, i.e. no data is copied. The blocks
+            are not registered with the resource tracker of this process,
+            they stay owned by the SharedDatasets that created them.
+        """
+        dfs = []
+        for name, shape, dtype, columns in zip(self._block_names, self._shapes,
+                                               self._dtypes, self._columns):
+            if name not in _ATTACHED_BLOCKS:
+                _ATTACHED_BLOCKS[name] = _attach_untracked(name)
+            values = np.ndarray(shape, dtype=np.dtype(dtype), buffer=_ATTACHED_BLOCKS[name].buf)
+            values.flags.writeable = False
+            dfs.append(pd.DataFrame(values, columns=columns, copy=False))
+        return dfs
+
+    def __len__(self):
+        """Number of described dfs."""
+        return len(self._block_names)
+
+
+class SharedDatasets:
+    """
+    Copies the values of the passed dfs into shared memory blocks.
+    The creating process owns the blocks and must release them via
+        'release' (or by using the instance as a context manager).
+    """
+    def __init__(self, datasets: Iterable[pd.DataFrame]):
+        """
+        Args:
+            datasets (Iterable[pd.DataFrame]): Numeric dfs to publish.
+
+        Raises:
+            ValueError: If a df contains non-numeric values.
+        """
+        self._blocks = []
+        block_names, shapes, dtypes, columns = [], [], [], []
+        try:
+            for df in datasets:
+                values = np.ascontiguousarray(df.to_numpy())
+                if values.dtype.kind not in "biuf":
+                    raise ValueError("Only numeric data can be shared.")
+                block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+                self._blocks.append(block)
+                np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+                block_names.append(block.name)
+                shapes.append(values.shape)
+                dtypes.append(values.dtype.str)
+                columns.append(df.columns.to_list())
+        except Exception:
+            self.release()
+            raise
+        self._handle = SharedDatasetsHandle(block_names, shapes, dtypes, columns)
+
+    def get_handle(self) -> SharedDatasetsHandle:
+        """Get the handle that is passed to worker processes."""
+        return self._handle
+
+    def release(self):
+        """Close and remove all shared memory blocks."""
+        for block in self._blocks:
+            _ATTACHED_BLOCKS.pop(block.name, None)
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,149 @@
+"""
+Class 'SuffStats' holding the sufficient statistics of Gaussian algorithms,
+    i.e. sample size, mean and scatter matrix per environment. They are
+    computed from the resampling counts of a bootstrap sample with one
+    weighted matrix product per environment, without gathering its rows,
+    or for many bootstrap samples at once.
+"""
+
+# Standard
+from typing import Iterable
+import numpy as np
+import pandas as pd
+
+# Own
+from ..util import batched_covariances, batched_correlations
+
+
+class SuffStats:
+    """
+    Per-environment sample sizes, means and scatter matrices (sums of
+        outer products of the centered observations) of a list of datasets
+        with the same variables. These determine all (pooled or per
+        environment) sample covariance matrices.
+    """
+    def __init__(self, variables: list[str], n_obs: np.ndarray, means: np.ndarray, scatters: np.ndarray):
+        """
+        Args:
+            variables (list[str]): Names of the p variables.
+            n_obs (np.ndarray): Number of observations per environment (k).
+            means (np.ndarray): Sample means, one row per environment (k x p).
+            scatters (np.ndarray): Scatter matrices, one per environment (k x p x p).
+        """
+        if not len(n_obs) == len(means) == len(scatters):
+            raise ValueError("One sample size, mean and scatter matrix per environment is required.")
+        if np.any(np.asarray(n_obs) < 1):
+            raise ValueError("Every environment needs at least one observation.")
+        self._variables = list(variables)
+        self._n_obs = np.asarray(n_obs, dtype=np.int64)
+        self._means = np.asarray(means, dtype=np.float64)
+        self._scatters = np.asarray(scatters, dtype=np.float64)
+
+    @classmethod
+    def from_counts(cls, datasets: Iterable[pd.DataFrame], counts: Iterable[np.ndarray]) -> "SuffStats":
+        """
+        Compute the sufficient statistics of a weighted sample of the datasets.
+
+        Args:
+            datasets (Iterable[pd.DataFrame]): Data with the same columns.
+            counts (Iterable[np.ndarray]): How often each row is contained in
+                the sample, one array of length len(df) per df.
+        """
+        assert len(datasets) == len(counts)
+        n_obs, means, scatters = [], [], []
+        for dataset, count in zip(datasets, counts):
+            X = dataset.to_numpy(dtype=np.float64)
+            count = np.asarray(count, dtype=np.float64)
+            n = count.sum()
+            mean = count @ X / n
+            X = X - mean # Centered first, avoids cancellation in the scatter matrix
+            scatter = (X.T * count) @ X
+            n_obs.append(n)
+            means.append(mean)
+            scatters.append((scatter + scatter.T) / 2) # Symmetric up to rounding
+        return cls(datasets[0].columns, np.array(n_obs), np.array(means), np.array(scatters))
+
+    @classmethod
+    def from_indices(cls, datasets: Iterable[pd.DataFrame], indices: Iterable[np.ndarray]) -> "SuffStats":
+        """
+        Compute the sufficient statistics of the bootstrap sample drawn by
+            bootstrap_indices, see from_counts.
+        """
+        assert len(datasets) == len(indices)
+        counts = [np.bincount(idx, minlength=len(dataset)) for dataset, idx in zip(datasets, indices)]
+        return cls.from_counts(datasets, counts)
+
+    @classmethod
+    def batch_from_counts(cls, datasets: Iterable[pd.DataFrame], counts: Iterable[np.ndarray]) -> list["SuffStats"]:
+        """
+        Compute the sufficient statistics of many weighted samples of the 
+            datasets in one pass over each df, see batched_covariances.
+
+        Args:
+            datasets (Iterable[pd.DataFrame]): Data with the same columns.
+            counts (Iterable[np.ndarray]): One (B x len(df)) count matrix per
+                df, e.g. from bootstrap_counts.
+
+        Returns:
+            list[SuffStats]: The sufficient statistics of each of the B samples.
+        """
+        assert len(datasets) == len(counts)
+        batches = [batched_covariances(dataset.to_numpy(dtype=np.float64), count)
+                   for dataset, count in zip(datasets, counts)]
+        return [cls(datasets[0].columns, 
+                    np.array([n_obs[b] for n_obs, _, _ in batches]),
+                    np.array([means[b] for _, means, _ in batches]),
+                    np.array([n_obs[b] * covariances[b] for n_obs, _, covariances in batches]))
+                for b in range(len(counts[0]))]
+
+    def get_variables(self) -> list[str]:
+        return self._variables
+
+    def get_nr_environments(self) -> int:
+        return len(self._n_obs)
+
+    def get_n_obs(self) -> np.ndarray:
+        """Number of observations per environment."""
+        return self._n_obs
+
+    def get_means(self) -> np.ndarray:
+        """Sample means, one row per environment."""
+        return self._means
+
+    def get_covariances(self) -> np.ndarray:
+        """Maximum likelihood (ddof=0) covariance matrices, one per environment."""
+        return self._scatters / self._n_obs[:, None, None]
+
+    def pool(self) -> "SuffStats":
+        """Sufficient statistics of all environments concatenated into one."""
+        n = self._n_obs.sum()
+        mean = self._n_obs @ self._means / n
+        # Between-environment part of the scatter matrix
+        deviations = self._means - mean
+        scatter = self._scatters.sum(axis=0) + (deviations.T * self._n_obs) @ deviations
+        return SuffStats(self._variables, np.array([n]), mean[None, :], scatter[None, :, :])
+
+    def pooled_covariance(self) -> np.ndarray:
+        """Maximum likelihood (ddof=0) covariance matrix of the pooled environments."""
+        return self.pool().get_covariances()[0]
+
+    def pooled_correlation(self) -> np.ndarray:
+        """Correlation matrix of the pooled environments, as np.corrcoef."""
+        return batched_correlations(self.pooled_covariance())
+
+    def pooled_r2(self) -> np.ndarray:
+        """
+        Coefficient of determination of regressing each variable on all others
+            in the pooled environments, as CausalDisco's r2coeff.
+        """
+        try:
+            return 1 - np.diag(1 / np.linalg.inv(self.pooled_correlation()))
+        except np.linalg.LinAlgError:
+            # Singular correlation matrix, regress on the covariance directly
+            covariance = self.pooled_covariance()
+            r2 = np.zeros(len(covariance))
+            for k in range(len(covariance)):
+                others = np.arange(len(covariance)) != k
+                coefs = np.linalg.lstsq(covariance[np.ix_(others, others)], covariance[others, k], rcond=None)[0]
+                r2[k] = coefs @ covariance[others, k] / covariance[k, k]
+            return r2
@@ -0,0 +1,110 @@
+"""
+Functionality to avoid oversubscribing the machine when many worker
+    processes run in parallel:
+    - ThreadPolicy decides how the available cores are split between worker
+        processes and the threads within each worker.
+    - limit_threads pins the BLAS/OpenMP backends and TensorFlow of the
+        calling process to a number of threads.
+    - get_thread_budget returns this number, e.g. for algorithms that run
+        their own thread pool within a fit.
+"""
+
+# Standard
+import os
+import sys
+import logging
+
+# Third party
+from threadpoolctl import threadpool_limits
+
+
+# Environment variables read by BLAS/OpenMP backends and numexpr when they are loaded
+_THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                    "VECLIB_MAXIMUM_THREADS", "BLIS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+# Environment variables read by TensorFlow when it is loaded
+_TF_ENV_VARS = ("TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS")
+# Threads the calling process was limited to by limit_threads
+_thread_budget = None
+
+
+def limit_threads(threads: int):
+    """
+    Limit the threads used by the calling process for linear algebra and
+        TensorFlow. Libraries that are already loaded are limited at runtime
+        (threadpoolctl, tf.config), libraries loaded later on pick up the
+        set environment variables.
+
+    Args:
+        threads (int): Maximum number of threads per library.
+    """
+    global _thread_budget
+    _thread_budget = threads
+    for var in _THREAD_ENV_VARS + _TF_ENV_VARS:
+        os.environ[var] = str(threads)
+    threadpool_limits(limits=threads)
+    if "tensorflow" in sys.modules:
+        tf = sys.modules["tensorflow"]
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(threads)
+        except (RuntimeError, AttributeError) as e: # TF runtime was already initialized
+            logging.info(f"Could not limit TensorFlow threads: {e}")
+
+
+def get_thread_budget() -> int:
+    """
+    Number of threads the calling process was limited to by limit_threads,
+        i.e. its share of the cores if it is a worker started under a 
+        ThreadPolicy. None if it was not limited.
+    """
+    return _thread_budget
+
+
+class ThreadPolicy:
+    """
+    Splits the available cores between worker processes and the threads
+        within each worker, such that workers * threads does not exceed
+        the number of cores.
+    By default, the cores are split evenly between the workers that are
+        actually needed: Many parallel tasks lead to many single-threaded
+        workers, few tasks to few multi-threaded workers.
+    """
+    def __init__(self, threads_per_worker: int = None, total_cores: int = None):
+        """
+        Args:
+            threads_per_worker (int, optional): Fixed number of threads per
+                worker. The number of workers is then reduced to fit the cores.
+                Defaults to None, i.e. split the cores evenly.
+            total_cores (int, optional): Cores to use in total. Defaults to None,
+                i.e. all cores available to this process.
+        """
+        if threads_per_worker is not None and threads_per_worker < 1:
+            raise ValueError("threads_per_worker must be at least 1.")
+        if total_cores is None:
+            total_cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        if total_cores < 1:
+            raise ValueError("total_cores must be at least 1.")
+        self._threads_per_worker = threads_per_worker
+        self._total_cores = total_cores
+
+    def get_total_cores(self) -> int:
+        return self._total_cores
+
+    def plan(self, processes: int, nr_tasks: int) -> tuple[int, int]:
+        """
+        Decide the number of worker processes and threads per worker.
+
+        Args:
+            processes (int): Requested number of worker processes.
+            nr_tasks (int): Number of tasks to run.
+
+        Returns:
+            tuple[int, int]: Number of worker processes and threads per worker.
+        """
+        workers = max(1, min(processes, nr_tasks, self._total_cores))
+        if self._threads_per_worker is not None:
+            threads = min(self._threads_per_worker, self._total_cores)
+            workers = max(1, min(workers, self._total_cores // threads))
+        else:
+            threads = max(1, self._total_cores // workers)
+        return workers, threads
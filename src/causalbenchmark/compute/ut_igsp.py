@@ -48,11 +48,21 @@ from causaldag import unknown_target_igsp
 import gnies.utils as utils
 import gies.utils
 
+from .kernel_tests import (
+    KernelCache,
+    DEFAULT_KERNEL_CACHE_BYTES,
+    weighted_hsic_test, 
+    weighted_hsic_invariance_test, 
+    approx_hsic_test, 
+    approx_hsic_invariance_test
+)
+
 # --------------------------------------------------------------------
 # TODO: icpdag=True here conflicts with the call from run_ut_igsp, refactor
 
 
-def fit(data, alpha_ci, alpha_inv, debug=0, completion="gnies", test="hsic", obs_idx=0):
+def fit(data, alpha_ci, alpha_inv, debug=0, completion="gnies", test="hsic", obs_idx=0, compress_duplicates=True,
+        kernel_rank=100, kernel_cache_bytes=DEFAULT_KERNEL_CACHE_BYTES):
     observational_sample = data[obs_idx]
     interventional_samples = [sample for i, sample in enumerate(data) if i != obs_idx]
     assert len(interventional_samples) + 1 == len(data)
@@ -67,10 +77,25 @@ def fit(data, alpha_ci, alpha_inv, debug=0, completion="gnies", test="hsic", obs
         ci_tester = MemoizedCI_Tester(gauss_ci_test, ci_suffstat, alpha=alpha_ci)
         invariance_tester = MemoizedInvarianceTester(gauss_invariance_test, invariance_suffstat, alpha=alpha_inv)
     elif test == "hsic":
-        ci_tester = MemoizedCI_Tester(hsic_test, observational_sample, alpha=alpha_ci)
         suffstat = dict((i, sample) for i, sample in enumerate(interventional_samples))
         suffstat["obs_samples"] = observational_sample
-        invariance_tester = MemoizedInvarianceTester(hsic_invariance_test, suffstat, alpha=alpha_inv)
+        if compress_duplicates:
+            # Tests on the unique rows weighted by their multiplicities give the same results,
+            # kernels and residuals are shared across the tests through the cache
+            cache = KernelCache(kernel_cache_bytes)
+            ci_tester = MemoizedCI_Tester(weighted_hsic_test, observational_sample, alpha=alpha_ci, cache=cache)
+            invariance_tester = MemoizedInvarianceTester(weighted_hsic_invariance_test, suffstat, alpha=alpha_inv,
+                                                         cache=cache)
+        else:
+            ci_tester = MemoizedCI_Tester(hsic_test, observational_sample, alpha=alpha_ci)
+            invariance_tester = MemoizedInvarianceTester(hsic_invariance_test, suffstat, alpha=alpha_inv)
+    elif test == "hsic_rff":
+        # HSIC tests approximated by kernel_rank random Fourier features
+        ci_tester = MemoizedCI_Tester(approx_hsic_test, observational_sample, alpha=alpha_ci, rank=kernel_rank)
+        suffstat = dict((i, sample) for i, sample in enumerate(interventional_samples))
+        suffstat["obs_samples"] = observational_sample
+        invariance_tester = MemoizedInvarianceTester(approx_hsic_invariance_test, suffstat, alpha=alpha_inv,
+                                                     rank=kernel_rank)
     else:
         raise ValueError('Invalid value "%s" for field "test"' % test)
     # Run UT-IGSP
@@ -4,6 +4,7 @@ Util functions for the causalbenchmark package.
 
 
 # Standard 
+import numpy as np
 import pandas as pd 
 from typing import Iterable, Union
 import time
@@ -190,6 +191,209 @@ def bootstrap_sample(datasets: Iterable[pd.DataFrame], sample_sizes: Iterable[Un
 
     return bstr_spl
 
+def absolute_sample_size(sample_size: Union[int, float], n: int) -> int:
+    """
+    Turns a sample size as accepted by bootstrap_sample into a number of rows.
+
+    Args:
+        sample_size (Union[int, float]): Either a percentage (float) or
+            number of samples (int).
+        n (int): Number of rows of the dataset that is sampled from.
+
+    Raises:
+        ValueError: If the sample size has an incorrect format.
+
+    Returns:
+        int: Number of rows to draw, rounded like DataFrame.sample does.
+    """
+    if 0 < sample_size <= 1.0:
+        return round(sample_size * n)
+    elif sample_size > 1:
+        return int(sample_size)
+    else:
+        raise ValueError("The sample sizes have the wrong format.")
+
+def bootstrap_indices(datasets: Iterable[pd.DataFrame], sample_sizes: Iterable[Union[int, float]], 
+                      seed: int) -> list[np.ndarray]:
+    """
+    Draws the row indices of a single bootstrap sample from the passed list 
+        of dataframes, without copying any data.
+
+    Args:
+        datasets (Iterable[pd.DataFrame]): Data to bootstrap from.
+        sample_sizes (Iterable[Union[int, float]]): A sample size for each df.
+            Either a percentage (float) or number of samples (int).
+        seed (int): Random seed. Note that different seeds will be used for the
+            sampling of each passed df.
+
+    Raises:
+        ValueError: If the sample sizes have an incorrect format.
+
+    Returns:
+        list[np.ndarray]: One array of positional row indices per df, stored in
+            the smallest unsigned integer type that can index the df.
+    """
+
+    assert len(datasets) == len(sample_sizes)
+
+    bstr_idx = []
+    counter = 0
+    for dataset, sample_size in zip(datasets, sample_sizes):
+        n = len(dataset)
+        size = absolute_sample_size(sample_size, n)
+        rng = np.random.default_rng(seed+counter)
+        bstr_idx.append(rng.integers(0, n, size=size, dtype=np.min_scalar_type(max(n-1, 1))))
+        counter += 1
+
+    return bstr_idx
+
+def gather_sample(datasets: Iterable[pd.DataFrame], indices: Iterable[np.ndarray]) -> list[pd.DataFrame]:
+    """
+    Materializes a bootstrap sample from the row indices drawn by bootstrap_indices.
+
+    Args:
+        datasets (Iterable[pd.DataFrame]): Data that was bootstrapped from.
+        indices (Iterable[np.ndarray]): Positional row indices, one array per df.
+
+    Returns:
+        list[pd.DataFrame]: Bootstrap sample.
+    """
+    assert len(datasets) == len(indices)
+    return [dataset.iloc[idx] for dataset, idx in zip(datasets, indices)]
+
+def bootstrap_weights(datasets: Iterable[pd.DataFrame], sample_sizes: Iterable[Union[int, float]],
+                      seed: int, method: str = "multinomial") -> list[np.ndarray]:
+    """
+    Draws a single bootstrap sample from the passed list of dataframes as 
+        multiplicity vectors, i.e. how often each row is contained in it.
+
+    Args:
+        datasets (Iterable[pd.DataFrame]): Data to bootstrap from.
+        sample_sizes (Iterable[Union[int, float]]): A sample size for each df.
+            Either a percentage (float) or number of samples (int).
+        seed (int): Random seed. Note that different seeds will be used for the
+            sampling of each passed df.
+        method (str, optional): How the multiplicities are drawn. Options are:
+            - "multinomial": Sample size draws with replacement, the identical
+                sample as drawn by bootstrap_indices with the same seed.
+            - "poisson": Each row independently Poisson distributed with mean
+                sample size / len(df), i.e. the sample size is only met in
+                expectation. Rows can be weighted one at a time, e.g. while 
+                streaming through the data. A df whose rows all got weight
+                zero is redrawn, every df keeps at least one observation.
+            Defaults to "multinomial".
+
+    Raises:
+        ValueError: If the sample sizes or the method have an incorrect format.
+
+    Returns:
+        list[np.ndarray]: One multiplicity vector of length len(df) per df, 
+            stored in the smallest unsigned integer type that holds it.
+    """
+    assert len(datasets) == len(sample_sizes)
+    if method == "multinomial":
+        bstr_weights = [np.bincount(idx, minlength=len(dataset)) 
+                        for dataset, idx in zip(datasets, bootstrap_indices(datasets, sample_sizes, seed))]
+    elif method == "poisson":
+        bstr_weights = []
+        counter = 0
+        for dataset, sample_size in zip(datasets, sample_sizes):
+            n = len(dataset)
+            size = absolute_sample_size(sample_size, n)
+            rng = np.random.default_rng(seed+counter)
+            weights = rng.poisson(size / n, size=n)
+            while weights.sum() == 0: # Empty environments cannot be fitted
+                weights = rng.poisson(size / n, size=n)
+            bstr_weights.append(weights)
+            counter += 1
+    else:
+        raise ValueError("method must be 'multinomial' or 'poisson'.")
+
+    return [weights.astype(np.min_scalar_type(max(weights.max(initial=0), 1))) for weights in bstr_weights]
+
+def gather_weighted_sample(datasets: Iterable[pd.DataFrame], weights: Iterable[np.ndarray]) -> list[pd.DataFrame]:
+    """
+    Materializes a bootstrap sample from the multiplicity vectors drawn by 
+        bootstrap_weights, each row repeated as often as its multiplicity.
+
+    Args:
+        datasets (Iterable[pd.DataFrame]): Data that was bootstrapped from.
+        weights (Iterable[np.ndarray]): Multiplicity of each row, one vector per df.
+
+    Returns:
+        list[pd.DataFrame]: Bootstrap sample.
+    """
+    assert len(datasets) == len(weights)
+    return [dataset.iloc[np.repeat(np.arange(len(dataset)), weight)] for dataset, weight in zip(datasets, weights)]
+
+def bootstrap_counts(datasets: Iterable[pd.DataFrame], sample_sizes: Iterable[Union[int, float]],
+                     seeds: Iterable[int], method: str = "multinomial") -> list[np.ndarray]:
+    """
+    Draws the bootstrap samples of several seeds at once as count matrices.
+
+    Args:
+        datasets (Iterable[pd.DataFrame]): Data to bootstrap from.
+        sample_sizes (Iterable[Union[int, float]]): A sample size for each df.
+            Either a percentage (float) or number of samples (int).
+        seeds (Iterable[int]): One seed per bootstrap sample, see bootstrap_weights.
+        method (str, optional): "multinomial" or "poisson", see bootstrap_weights.
+            Defaults to "multinomial".
+
+    Returns:
+        list[np.ndarray]: One (len(seeds) x len(df)) matrix per df, whose row b
+            is the multiplicity vector drawn with seeds[b] by bootstrap_weights.
+    """
+    assert len(datasets) == len(sample_sizes)
+    seeds = list(seeds)
+    counts = [np.zeros((len(seeds), len(dataset)), dtype=np.int64) for dataset in datasets]
+    for b, seed in enumerate(seeds):
+        for count, weights in zip(counts, bootstrap_weights(datasets, sample_sizes, seed, method)):
+            count[b] = weights
+    return counts
+
+def batched_covariances(data: np.ndarray, counts: np.ndarray,
+                        chunk_bytes: int = 2**26) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Computes the sample sizes, means and covariance matrices (ddof=0) of many
+        weighted samples of the same data in a single pass over its rows.
+        The products of each row with itself are multiplied with all count
+        vectors in one matrix product, in chunks of rows of at most
+        chunk_bytes (plus the counts of the chunk).
+
+    Args:
+        data (np.ndarray): Data with observations as rows (n x p).
+        counts (np.ndarray): How often each row is contained in each sample,
+            one row per sample (B x n), e.g. from bootstrap_counts.
+        chunk_bytes (int, optional): Bytes of the row products held at once.
+            Defaults to 2**26.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Sample sizes (B), means
+            (B x p) and covariance matrices (B x p x p).
+    """
+    data = np.asarray(data, dtype=np.float64)
+    counts = np.atleast_2d(counts)
+    assert counts.shape[1] == len(data)
+    n, p = data.shape
+    shift = data.mean(axis=0) # Shifted first, avoids cancellation in the covariances
+    n_obs = counts.sum(axis=1, dtype=np.float64)
+    sums = np.zeros((len(counts), p))
+    moments = np.zeros((len(counts), p * p))
+    rows_per_chunk = max(1, chunk_bytes // (8 * p * p))
+    for start in range(0, n, rows_per_chunk):
+        chunk = data[start:start+rows_per_chunk] - shift
+        weights = counts[:, start:start+rows_per_chunk].astype(np.float64)
+        sums += weights @ chunk
+        moments += weights @ (chunk[:, :, None] * chunk[:, None, :]).reshape(len(chunk), p * p)
+    deviations = sums / n_obs[:, None]
+    covariances = moments.reshape(-1, p, p) / n_obs[:, None, None] - deviations[:, :, None] * deviations[:, None, :]
+    return n_obs, deviations + shift, covariances
+
+def batched_correlations(covariances: np.ndarray) -> np.ndarray:
+    """Turns a stack of covariance matrices (... x p x p) into correlation matrices."""
+    sd = np.sqrt(np.diagonal(covariances, axis1=-2, axis2=-1))
+    return np.clip(covariances / (sd[..., :, None] * sd[..., None, :]), -1, 1)
+
 
 #------------------------------------------------------
 # Adjacency matrix dataframe operations
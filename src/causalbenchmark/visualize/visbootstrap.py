@@ -138,6 +138,8 @@ class VisBootstrapComparison:
             runtimes = [round(bstrp.get_avg_runtime()) for bstrp in bstrps]
             no_cons_extensions = [round(bstrp.get_avg_no_cons_extension(),2) for bstrp in bstrps]
             alg_crashed = [round(bstrp.get_avg_alg_crashed(),2) for bstrp in bstrps]
+            timed_out = [round(bstrp.get_avg_timed_out(),2) for bstrp in bstrps]
+            memory_exceeded = [round(bstrp.get_avg_memory_exceeded(),2) for bstrp in bstrps]
             true_graph = bstrp_comp.get_all_var_true_DAG()
             nr_bstrps = len(bstrp_comp)
         else:
@@ -151,6 +153,8 @@ class VisBootstrapComparison:
         self._runtimes = runtimes
         self._no_cons_extensions = no_cons_extensions
         self._alg_crashed = alg_crashed
+        self._timed_out = timed_out
+        self._memory_exceeded = memory_exceeded
         self._true_graph = true_graph
         self._nr_bstrps = nr_bstrps
         self._pos = kwargs.get("pos")
@@ -272,7 +276,9 @@ class VisBootstrapComparison:
                 f"R2 Sort: {self._r2_sortabilities[row]}",
                 f"Runtime: {str(timedelta(seconds=self._runtimes[row]))}",
                 f"Invalid: {self._no_cons_extensions[row]}",
-                f"Crashed: {self._alg_crashed[row]}"
+                f"Crashed: {self._alg_crashed[row]}",
+                f"Timed out: {self._timed_out[row]}",
+                f"Memory exceeded: {self._memory_exceeded[row]}"
             ]
             _text_top_left(
                 axes=ax,
@@ -398,7 +404,9 @@ class VisBootstrapComparison:
                 f"R2 Sort: {self._r2_sortabilities[index]}",
                 f"Runtime: {str(timedelta(seconds=self._runtimes[index]))}",
                 f"Invalid: {self._no_cons_extensions[index]}",
-                f"Crashed: {self._alg_crashed[index]}"
+                f"Crashed: {self._alg_crashed[index]}",
+                f"Timed out: {self._timed_out[index]}",
+                f"Memory exceeded: {self._memory_exceeded[index]}"
             ]
             _text_top_left(
                 axes=ax,
@@ -6,8 +6,16 @@ from functools import wraps
 import numpy as np
 import pandas as pd
 import string
+import random
+import inspect
 
 from causalbenchmark.compute.algorithms import Algorithm, PC, UT_IGSP, GES, GIES, GNIES, NoTears, Golem, VarSortRegress, R2SortRegress, ICP
+from causalbenchmark.compute import ut_igsp
+from causalbenchmark.compute.suffstats import SuffStats
+from scipy import stats
+from causallearn.utils.cit import KCI
+from causaldag.utils.ci_tests import hsic_test
+from causalbenchmark.compute.kernel_tests import KernelCache, ApproxKCI, approx_hsic_test, approx_hsic_invariance_test
 
 
 class TestPDAGTransform(unittest.TestCase):
@@ -210,11 +218,16 @@ class TestFullRun(unittest.TestCase):
         self.check_output_format(*PC(alpha=0.05).fit(self.data))
         self.check_output_format(*PC(alpha=0.50).fit(self.data))
 
+    def test_PC_algorithm_approx_kci(self):
+        self.check_output_format(*PC(alpha=0.05, indep_test="rff_kci").fit(self.data))
+        self.check_output_format(*PC(alpha=0.05, indep_test="nystroem_kci", kernel_rank=50).fit(self.data))
+
 
     def test_UT_IGSP_algorithm(self):
         self.check_output_format(*UT_IGSP(alpha_ci=0.05, alpha_inv=0.05).fit(self.data))
         self.check_output_format(*UT_IGSP(alpha_ci=0.10, alpha_inv=0.10).fit(self.data))
         self.check_output_format(*UT_IGSP(alpha_ci=0.20, alpha_inv=0.20).fit(self.data))
+        self.check_output_format(*UT_IGSP(alpha_ci=0.05, alpha_inv=0.05, test="hsic_rff").fit(self.data))
 
     def test_GES_algorithm(self):
         self.check_output_format(*GES().fit(self.data))
@@ -243,5 +256,201 @@ class TestFullRun(unittest.TestCase):
         self.check_output_format(*R2SortRegress().fit(self.data))
 
 
+class TestSuffStatsFit(unittest.TestCase):
+    """
+    Test whether fitting to the sufficient statistics of a bootstrap sample
+        gives the same result as fitting to the gathered sample.
+    """
+    setUp = TestFullRun.setUp
+
+    def run_test(self, alg: Algorithm):
+        rng = np.random.default_rng(0)
+        indices = [rng.integers(0, len(df), size=len(df)) for df in self.data]
+        sample = [df.iloc[idx] for df, idx in zip(self.data, indices)]
+        self.assertTrue(alg.supports_suffstats())
+        result, runtime = alg.fit_suffstats(SuffStats.from_indices(self.data, indices))
+        self.assertIsInstance(runtime, float)
+        pd.testing.assert_frame_equal(result, alg.fit(sample)[0], check_dtype=False)
+
+    def test_PC_algorithm(self):
+        self.run_test(PC(alpha=0.05))
+        self.run_test(PC(alpha=0.05, native=True))
+        self.assertFalse(PC(alpha=0.05, indep_test="kci").supports_suffstats())
+
+    def test_GES_algorithm(self):
+        self.run_test(GES())
+
+    def test_GIES_algorithm(self):
+        self.run_test(GIES(interventions=[['A'], ['B']]))
+
+    def test_unsupported_algorithm(self):
+        self.assertFalse(UT_IGSP(alpha_ci=0.05, alpha_inv=0.05, test="gauss").supports_suffstats())
+        with self.assertRaises(NotImplementedError):
+            VarSortRegress().fit_suffstats(None)
+
+
+class TestNativePC(unittest.TestCase):
+    """
+    Test whether the native PC-stable gives the same result as causal-learn's pc.
+    """
+    def test_PC_algorithm(self):
+        rng = np.random.default_rng(0)
+        for nr_var in (3, 6, 10):
+            # Random linear SEM, upper triangular weights
+            weights = np.triu(rng.normal(size=(nr_var, nr_var)) * (rng.random((nr_var, nr_var)) < 0.4), k=1)
+            noise = rng.normal(size=(300, nr_var))
+            X = noise @ np.linalg.inv(np.eye(nr_var) - weights)
+            data = [pd.DataFrame(X, columns=[f"X{i}" for i in range(nr_var)])]
+            for alpha in (0.01, 0.05, 0.3):
+                pd.testing.assert_frame_equal(PC(alpha=alpha, native=True).fit(data)[0],
+                                              PC(alpha=alpha).fit(data)[0])
+
+    def test_parallel_skeleton(self):
+        rng = np.random.default_rng(0)
+        weights = np.diag(rng.normal(size=4), 1)
+        X = rng.uniform(size=(300, 5)) @ np.linalg.inv(np.eye(5) - weights)
+        data = [pd.DataFrame(X, columns=list(string.ascii_uppercase[:5]))]
+        for indep_test in ("fisherz", "rff_kci", "kci"):
+            pd.testing.assert_frame_equal(PC(alpha=0.05, indep_test=indep_test, n_jobs=3).fit(data)[0],
+                                          PC(alpha=0.05, indep_test=indep_test, n_jobs=1).fit(data)[0])
+
+    def test_sequential_by_default(self):
+        X = np.random.default_rng(0).standard_normal((100, 3))
+        data = [pd.DataFrame(X, columns=list(string.ascii_uppercase[:3]))]
+        # Also inside a worker process granted several threads
+        with patch("causalbenchmark.compute.thread_limits._thread_budget", 4), \
+                patch("causalbenchmark.compute.algorithms.parallel_pc_stable") as mock_parallel:
+            for indep_test in ("fisherz", "rff_kci"):
+                PC(alpha=0.05, indep_test=indep_test).fit(data)
+        mock_parallel.assert_not_called()
+        with self.assertRaises(ValueError):
+            PC(alpha=0.05, n_jobs=0)
+
+
+class TestDuplicateCompression(unittest.TestCase):
+    """
+    Test whether kernel-based tests on the unique rows of a bootstrap sample
+        give the same result as on the sample itself.
+    """
+    setUp = TestFullRun.setUp
+
+    def run_test(self, alg: Algorithm, compressed_alg: Algorithm):
+        rng = np.random.default_rng(0)
+        # Small sample, the uncompressed kernel tests are slow
+        sample = [df.iloc[rng.integers(0, 200, size=200), :4] for df in self.data]
+        results = []
+        for a in (alg, compressed_alg):
+            # UT-IGSP draws its initial permutations at random
+            random.seed(0)
+            np.random.seed(0)
+            results.append(a.fit(sample)[0])
+        pd.testing.assert_frame_equal(*results)
+
+    def test_PC_algorithm(self):
+        self.run_test(PC(alpha=0.05, indep_test="kci", compress_duplicates=False),
+                      PC(alpha=0.05, indep_test="kci"))
+
+    def test_UT_IGSP_algorithm(self):
+        self.run_test(UT_IGSP(alpha_ci=0.05, alpha_inv=0.05, compress_duplicates=False),
+                      UT_IGSP(alpha_ci=0.05, alpha_inv=0.05))
+
+    def test_same_defaults(self):
+        wrapper = inspect.signature(UT_IGSP).parameters["compress_duplicates"].default
+        self.assertEqual(inspect.signature(ut_igsp.fit).parameters["compress_duplicates"].default, wrapper)
+
+    def test_kernel_cache(self):
+        cache = KernelCache(max_bytes=2 * 800)
+        cache.get("a", lambda: np.zeros(100))
+        cache.get("b", lambda: np.zeros(100))
+        cache.get("a", lambda: self.fail("'a' is cached"))
+        cache.get("c", lambda: np.zeros(100)) # Evicts 'b', the least recently used
+        self.assertEqual(cache.get_nbytes(), 2 * 800)
+        self.assertEqual(cache.get("b", lambda: 1), 1)
+        self.assertEqual(cache.get_hit_rate(), 1 / 5)
+
+
+class TestApproxKCI(unittest.TestCase):
+    """
+    Test whether ApproxKCI keeps the level of the KCI test under independence,
+        rejects under clear dependence and approaches KCI as the rank grows.
+    """
+    def test_null_distribution(self):
+        rng = np.random.default_rng(0)
+        for approximation in ("rff", "nystroem"):
+            p_values, p_values_cond = [], []
+            for seed in range(100):
+                p_values.append(ApproxKCI(rng.standard_normal((200, 2)), approximation, rank=50, seed=seed)(0, 1))
+                # X and Y depend on Z only
+                z = rng.standard_normal(200)
+                data = np.column_stack((z + rng.standard_normal(200), z**2 + rng.standard_normal(200), z))
+                p_values_cond.append(ApproxKCI(data, approximation, rank=50, seed=seed)(0, 1, [2]))
+            for p in (p_values, p_values_cond):
+                self.assertGreater(stats.kstest(p, "uniform").pvalue, 0.01)
+                self.assertLess(np.mean(np.array(p) < 0.05), 0.12)
+
+    def test_dependence(self):
+        rng = np.random.default_rng(0)
+        z = rng.standard_normal(200)
+        x = z + rng.standard_normal(200)
+        data = np.column_stack((x, x + 0.5 * rng.standard_normal(200), z))
+        for approximation in ("rff", "nystroem"):
+            test = ApproxKCI(data, approximation, rank=50)
+            self.assertLess(test(0, 1), 1e-3)
+            self.assertLess(test(0, 1, [2]), 1e-3)
+
+    def test_convergence(self):
+        rng = np.random.default_rng(0)
+        data = rng.standard_normal((300, 2))
+        data[:, 1] += 0.15 * data[:, 0] # Weak dependence, p-value in the interesting range
+        exact = KCI(data)(0, 1)
+        for approximation in ("rff", "nystroem"):
+            errors = [np.mean([abs(ApproxKCI(data, approximation, rank=rank, seed=seed)(0, 1) - exact)
+                               for seed in range(10)]) for rank in (5, 20, 100, 400)]
+            self.assertTrue(np.all(np.diff(errors) < 0), errors)
+            self.assertLess(errors[-1], min(errors[0] / 3, 0.1))
+
+
+class TestApproxHSIC(unittest.TestCase):
+    """
+    Test whether the random feature HSIC tests keep the level of causaldag's 
+        HSIC tests under independence, reject under clear dependence and 
+        approach them as the rank grows.
+    """
+    def test_null_distribution(self):
+        rng = np.random.default_rng(0)
+        p_values, p_values_cond, p_values_inv = [], [], []
+        for seed in range(100):
+            p_values.append(approx_hsic_test(rng.standard_normal((200, 2)), 0, 1, rank=50, seed=seed)["p_value"])
+            z = rng.standard_normal(200)
+            data = np.column_stack((z + rng.standard_normal(200), z**2 + rng.standard_normal(200), z))
+            p_values_cond.append(approx_hsic_test(data, 0, 1, [2], rank=50, seed=seed)["p_value"])
+            suffstat = {"obs_samples": rng.standard_normal((200, 2)), 0: rng.standard_normal((100, 2))}
+            p_values_inv.append(approx_hsic_invariance_test(suffstat, 0, 1, [0], rank=50, seed=seed)["p_value"])
+        for p in (p_values, p_values_cond, p_values_inv):
+            self.assertGreater(stats.kstest(p, "uniform").pvalue, 0.01)
+            self.assertLess(np.mean(np.array(p) < 0.05), 0.12)
+
+    def test_dependence(self):
+        rng = np.random.default_rng(0)
+        z = rng.standard_normal(200)
+        x = z + rng.standard_normal(200)
+        data = np.column_stack((x, x + 0.5 * rng.standard_normal(200), z))
+        self.assertTrue(approx_hsic_test(data, 0, 1, rank=50)["reject"])
+        self.assertTrue(approx_hsic_test(data, 0, 1, [2], rank=50)["reject"])
+        # Shifted mean in the context
+        suffstat = {"obs_samples": rng.standard_normal((200, 2)), 0: rng.standard_normal((100, 2)) + [1.5, 0]}
+        self.assertTrue(approx_hsic_invariance_test(suffstat, 0, 0, rank=50)["reject"])
+
+    def test_convergence(self):
+        rng = np.random.default_rng(0)
+        data = rng.standard_normal((300, 2))
+        data[:, 1] += 0.15 * data[:, 0]
+        exact = hsic_test(data, 0, 1)["p_value"]
+        errors = [np.mean([abs(approx_hsic_test(data, 0, 1, rank=rank, seed=seed)["p_value"] - exact)
+                           for seed in range(10)]) for rank in (5, 20, 100, 400)]
+        self.assertTrue(np.all(np.diff(errors) < 0), errors)
+        self.assertLess(errors[-1], min(errors[0] / 3, 0.1))
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
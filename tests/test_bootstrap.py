@@ -0,0 +1,427 @@
+import sys
+sys.path.append("../src/") # Path to causalbenchmark package
+import unittest
+import os
+import pickle
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+import string
+from fractions import Fraction
+from unittest.mock import patch
+
+from causalbenchmark.compute import Bootstrap, BootstrapComparison
+from causalbenchmark.compute.bootstrap import _RunningAverages
+from causalbenchmark.compute.causal_inference_task import TaskResult
+from causalbenchmark.compute.shared_data import SharedDatasets, SharedDatasetsHandle
+from causalbenchmark.compute.algorithms import GES, PC, UT_IGSP, VarSortRegress
+from causalbenchmark.compute.scheduling import CostModel, lpt_order, prior_cost
+from causalbenchmark.compute.thread_limits import ThreadPolicy, get_thread_budget
+from causalbenchmark.compute.dispatch import init_worker
+from causalbenchmark.compute.executor import TaskExecutor
+
+
+def thread_limits(item) -> tuple:
+    """Thread limits seen by a worker process."""
+    return get_thread_budget(), os.environ["OMP_NUM_THREADS"]
+
+
+class TestWeightedResampling(unittest.TestCase):
+    """
+    Test whether weighted bootstraps give statistically equivalent edge
+        probability matrices (EPMs) as resampling the rows, both for algorithms
+        fitted to the weights natively (GES) and to materialized rows (VarSortRegress).
+    """
+
+    def setUp(self):
+        self.d = 4
+        self.n = 400
+        rng = np.random.default_rng(0)
+        W = np.diag(np.ones(self.d-1), 1)
+        X = np.linalg.solve(np.eye(self.d) - W.T, rng.standard_normal((self.d, self.n))).T
+        self.var = list(string.ascii_uppercase[:self.d])
+        self.true_dag = pd.DataFrame(W.astype(int), index=self.var, columns=self.var)
+        self.data = [pd.DataFrame(X, columns=self.var)]
+
+    def run_bootstrap(self, algorithm, resampling: str, nr_bootstraps: int = 60) -> np.ndarray:
+        """EPM of each replicate (nr_bootstraps x d x d)."""
+        bootstrap = Bootstrap(name=resampling, true_dag=self.true_dag, algorithm=algorithm,
+                              data_to_bootstrap_from=self.data, sample_sizes=[1.0],
+                              nr_bootstraps=nr_bootstraps, resampling=resampling)
+        bootstrap.run_bootstrap()
+        return np.array([result.average_cons_extension for result in bootstrap.get_task_results()])
+
+    def assert_equivalent(self, epms: np.ndarray, other_epms: np.ndarray):
+        """Each entry of the mean EPMs differs by less than 4 standard errors."""
+        difference = np.abs(epms.mean(axis=0) - other_epms.mean(axis=0))
+        standard_error = np.sqrt(epms.var(axis=0, ddof=1) / len(epms) + other_epms.var(axis=0, ddof=1) / len(other_epms))
+        self.assertTrue((difference <= 4 * standard_error + 1e-9).all())
+
+    def run_test(self, algorithm):
+        index_epms = self.run_bootstrap(algorithm, "index")
+        # Multinomial weights represent the identical samples
+        np.testing.assert_allclose(self.run_bootstrap(algorithm, "weights"), index_epms, atol=1e-12)
+        self.assert_equivalent(self.run_bootstrap(algorithm, "poisson"), index_epms)
+
+    def test_native_weights(self):
+        self.assertTrue(GES().supports_suffstats())
+        self.run_test(GES())
+
+    def test_materialized_weights(self):
+        self.assertFalse(VarSortRegress().supports_suffstats())
+        self.run_test(VarSortRegress())
+
+    def test_extension_cache_hit_rate(self):
+        bootstrap = Bootstrap(name="hit_rate", true_dag=self.true_dag, algorithm=GES(), 
+                              data_to_bootstrap_from=self.data, sample_sizes=[1.0], nr_bootstraps=10)
+        self.assertEqual(bootstrap.get_extension_cache_hit_rate(), 0.0) # Before the run
+        bootstrap.run_bootstrap()
+        hits = [result.extension_cache_hit for result in bootstrap.get_task_results()]
+        self.assertAlmostEqual(bootstrap.get_extension_cache_hit_rate(), np.mean(hits))
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            Bootstrap(name="invalid", true_dag=self.true_dag, algorithm=GES(), data_to_bootstrap_from=self.data,
+                      sample_sizes=[1.0], resampling="bootstrap")
+
+
+def sum_shared_datasets(handle: SharedDatasetsHandle) -> float:
+    """Attach to the shared datasets in a worker process and sum their values."""
+    return float(sum(df.values.sum() for df in handle.attach()))
+
+
+class TestSharedDatasets(unittest.TestCase):
+    """
+    Test the lifecycle of datasets published in shared memory: created by one
+        process, attached by workers without taking ownership, removed on release.
+    """
+
+    def test_lifecycle(self):
+        data = [pd.DataFrame(np.arange(12.).reshape(4, 3), columns=list("ABC")), 
+                pd.DataFrame({"A": [1, 2], "B": [3, 4], "C": [5, 6]})]
+        with SharedDatasets(data) as shared:
+            handle = shared.get_handle()
+            # Attaching does not register the block with the resource tracker
+            with patch("multiprocessing.resource_tracker.register") as register:
+                attached = handle.attach()
+            register.assert_not_called()
+            for df, attached_df in zip(data, attached):
+                pd.testing.assert_frame_equal(df, attached_df)
+            self.assertFalse(attached[0].values.flags.writeable)
+            # Workers attach and exit, the blocks stay available
+            ctx = multiprocessing.get_context("spawn")
+            for _ in range(2):
+                with ctx.Pool(1) as pool:
+                    self.assertEqual(pool.apply(sum_shared_datasets, (handle,)), 66 + 21)
+        with self.assertRaises(FileNotFoundError): # Removed on release
+            SharedDatasetsHandle(handle._block_names, handle._shapes, handle._dtypes, handle._columns).attach()
+
+
+class TestDispatch(unittest.TestCase):
+    """
+    Test whether all dispatch modes give identical TaskResults for the same seeds.
+    """
+    setUp = TestWeightedResampling.setUp
+
+    def run_bootstrap(self, dispatch: str, resampling: str, PROCESSES) -> Bootstrap:
+        bootstrap = Bootstrap(name=dispatch, true_dag=self.true_dag, algorithm=GES(),
+                              data_to_bootstrap_from=self.data, sample_sizes=[0.8], nr_bootstraps=6,
+                              resampling=resampling, dispatch=dispatch, PROCESSES=PROCESSES)
+        bootstrap.run_bootstrap()
+        return bootstrap
+
+    def test_identical_results(self):
+        for resampling in ("index", "weights"):
+            sequential = self.run_bootstrap("task", resampling, PROCESSES=False)
+            for dispatch in ("task", "shared_memory", "seed"):
+                bootstrap = self.run_bootstrap(dispatch, resampling, PROCESSES=2)
+                for result, other in zip(sequential.get_task_results(), bootstrap.get_task_results(), strict=True):
+                    self.assertEqual((result.replicate, result.seed), (other.replicate, other.seed))
+                    np.testing.assert_array_equal(result.estimated_graph, other.estimated_graph)
+                    np.testing.assert_array_equal(result.average_cons_extension, other.average_cons_extension)
+                    self.assertEqual((result.var_sort, result.r2_sort), (other.var_sort, other.r2_sort))
+                pd.testing.assert_frame_equal(sequential.get_avg_avg_cons_extension(), 
+                                              bootstrap.get_avg_avg_cons_extension(), check_exact=True)
+
+
+class TestSharedPool(unittest.TestCase):
+    """
+    Test whether running a BootstrapComparison through one shared pool gives 
+        the same results per Bootstrap as running them one after another, up
+        to rounding if they are fitted to sufficient statistics.
+    """
+    setUp = TestWeightedResampling.setUp
+
+    def run_comparison(self, PROCESSES, **kwargs) -> BootstrapComparison:
+        comparison = BootstrapComparison(name="shared")
+        for name, algorithm, sample_size, nr_bootstraps in (("ges", GES(), 0.8, 5), ("var", VarSortRegress(), 0.5, 3),
+                                                            ("pc", PC(alpha=0.05), 1.0, 4)):
+            comparison.add_bootstrap(Bootstrap(name=name, true_dag=self.true_dag, 
+                                               algorithm=algorithm, data_to_bootstrap_from=self.data,
+                                               sample_sizes=[sample_size], nr_bootstraps=nr_bootstraps, 
+                                               PROCESSES=False, **kwargs))
+        comparison.run_comparison(PROCESSES=PROCESSES)
+        return comparison
+
+    def test_identical_results(self):
+        sequential = self.run_comparison(PROCESSES=None)
+        shared = self.run_comparison(PROCESSES=2)
+        for bootstrap, other in zip(sequential.get_bootstraps(), shared.get_bootstraps(), strict=True):
+            results, other_results = bootstrap.get_task_results(), other.get_task_results()
+            self.assertEqual(len(results), bootstrap._nr_bootstraps)
+            for result, other_result in zip(results, other_results, strict=True):
+                self.assertEqual((result.replicate, result.seed), (other_result.replicate, other_result.seed))
+                np.testing.assert_array_equal(result.estimated_graph, other_result.estimated_graph)
+                np.testing.assert_array_equal(result.average_cons_extension, other_result.average_cons_extension)
+            pd.testing.assert_frame_equal(bootstrap.get_avg_avg_cons_extension(), other.get_avg_avg_cons_extension(),
+                                          check_exact=True)
+            self.assertEqual(bootstrap.get_avg_var_sort(), other.get_avg_var_sort())
+        with self.assertRaises(TypeError):
+            self.run_comparison(PROCESSES=2.0)
+
+    def test_sufficient_statistics(self):
+        # Batched in the sequential run, computed per task in the shared pool
+        sequential = self.run_comparison(PROCESSES=None, resampling="index", sufficient_statistics=True)
+        shared = self.run_comparison(PROCESSES=2, resampling="index", sufficient_statistics=True)
+        for bootstrap, other in zip(sequential.get_bootstraps(), shared.get_bootstraps(), strict=True):
+            for result, other_result in zip(bootstrap.get_task_results(), other.get_task_results(), strict=True):
+                np.testing.assert_array_equal(result.estimated_graph, other_result.estimated_graph)
+                np.testing.assert_allclose(result.var_sort, other_result.var_sort, rtol=1e-9)
+                np.testing.assert_allclose(result.r2_sort, other_result.r2_sort, rtol=1e-9)
+            pd.testing.assert_frame_equal(bootstrap.get_avg_avg_cons_extension(), other.get_avg_avg_cons_extension(),
+                                          rtol=1e-9)
+
+
+class TestRunningAverages(unittest.TestCase):
+    """
+    Test whether results are folded as they arrive, independent of their order.
+    """
+
+    def test_arrival_order(self):
+        rng = np.random.default_rng(0)
+        results = [TaskResult(replicate=r, average_cons_extension=rng.random((3, 3)), runtime=rng.random(),
+                              var_sort=rng.random(), r2_sort=rng.random(), algorithm_crashed=r % 3 == 0)
+                   for r in range(20)]
+        in_order, reversed_order, shuffled_order = _RunningAverages(), _RunningAverages(), _RunningAverages()
+        for result in results:
+            in_order.add(result)
+        for count, result in enumerate(reversed(results), start=1):
+            reversed_order.add(result)
+            self.assertEqual(reversed_order.get_count(), count) # A late first replicate blocks nothing
+        for r in rng.permutation(len(results)):
+            shuffled_order.add(results[r])
+        # Exactly equal, whatever the order
+        for other in (reversed_order, shuffled_order):
+            np.testing.assert_array_equal(in_order.get_avg_cons_extension(), other.get_avg_cons_extension())
+            for getter in ("get_avg_runtime", "get_avg_alg_crashed", "get_avg_var_sort", "get_avg_r2_sort"):
+                self.assertEqual(getattr(in_order, getter)(), getattr(other, getter)())
+        # The correctly rounded mean
+        exact_mean = np.vectorize(lambda *entries: float(sum(map(Fraction, entries)) / len(entries)))(
+            *[result.average_cons_extension for result in results])
+        np.testing.assert_array_equal(in_order.get_avg_cons_extension(), exact_mean)
+        self.assertEqual(in_order.get_avg_runtime(), float(sum(Fraction(result.runtime) for result in results) / 20))
+        self.assertEqual(in_order.get_avg_alg_crashed(), 7 / 20)
+
+    def test_nonfinite(self):
+        averages = _RunningAverages()
+        for runtime in (1.0, np.inf, 2.0):
+            averages.add(TaskResult(runtime=runtime, average_cons_extension=np.array([[runtime, 0.5]]),
+                                    var_sort=None, r2_sort=None))
+        self.assertEqual(averages.get_avg_runtime(), np.inf)
+        np.testing.assert_array_equal(averages.get_avg_cons_extension(), [[np.inf, 0.5]])
+        with self.assertRaises(ZeroDivisionError): # No sortabilities, handled by Bootstrap
+            averages.get_avg_var_sort()
+
+class TestTaskResult(unittest.TestCase):
+    """
+    Test whether TaskResults survive pickling, also if pickled before slots were added.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.result = TaskResult(replicate=3, seed=42, estimated_graph=np.triu(np.ones((4, 4), dtype=np.uint8), k=1),
+                                 average_cons_extension=rng.random((4, 4)), runtime=0.5, var_sort=0.25, r2_sort=0.75,
+                                 cons_extension_mc_error=0.01, extension_cache_hit=True,
+                                 packed_cons_extensions=np.packbits(np.ones((2, 16), dtype=np.uint8), axis=1))
+
+    def test_round_trip(self):
+        result = pickle.loads(pickle.dumps(self.result))
+        for slot in TaskResult.__slots__:
+            np.testing.assert_array_equal(getattr(result, slot), getattr(self.result, slot), err_msg=slot)
+        self.assertEqual(result.estimated_graph.dtype, np.uint8)
+
+    def test_missing_slots(self):
+        state = self.result.__getstate__()
+        missing = ("memory_exceeded", "cons_extension_mc_error", "extension_cache_hit", "packed_cons_extensions")
+        for slot in missing:
+            del state[slot]
+        result = TaskResult.__new__(TaskResult)
+        result.__setstate__(state)
+        for slot in TaskResult.__slots__:
+            expected = TaskResult._DEFAULTS[slot] if slot in missing else getattr(self.result, slot)
+            np.testing.assert_array_equal(getattr(result, slot), expected, err_msg=slot)
+        self.assertIsNone(result.get_all_cons_extensions())
+        # Defaults of fields that are not passed
+        self.assertEqual(TaskResult(replicate=1).__getstate__(), dict(TaskResult._DEFAULTS, replicate=1))
+
+
+class TestPickledBootstrap(unittest.TestCase):
+    """
+    Test whether Bootstraps pickled before this version's fields existed still answer their getters.
+    """
+    setUp = TestWeightedResampling.setUp
+
+    def test_missing_fields(self):
+        bootstrap = Bootstrap(name="old", true_dag=self.true_dag, algorithm=VarSortRegress(),
+                              data_to_bootstrap_from=self.data, sample_sizes=[0.5], nr_bootstraps=2)
+        bootstrap.run_bootstrap()
+        for field in ("_task_results", "_avg_timed_out", "_avg_memory_exceeded"):
+            delattr(bootstrap, field)
+        old = pickle.loads(pickle.dumps(bootstrap))
+        self.assertEqual(old.get_task_results(), [])
+        self.assertEqual(old.get_extension_cache_hit_rate(), 0.0)
+        self.assertEqual((old.get_avg_timed_out(), old.get_avg_memory_exceeded()), (0.0, 0.0))
+        self.assertEqual(old.get_avg_runtime(), bootstrap.get_avg_runtime())
+
+
+class TestThreadPolicy(unittest.TestCase):
+    """
+    Test whether ThreadPolicy splits the cores without oversubscribing them
+        and whether workers are limited to their share.
+    """
+
+    def test_even_split(self):
+        for total_cores in (1, 2, 7, 16):
+            policy = ThreadPolicy(total_cores=total_cores)
+            for processes in (1, 2, 5, 32):
+                for nr_tasks in (1, 3, 100):
+                    workers, threads = policy.plan(processes, nr_tasks)
+                    self.assertLessEqual(workers * threads, total_cores)
+                    self.assertEqual(workers, min(processes, nr_tasks, total_cores))
+                    self.assertEqual(threads, total_cores // workers)
+        self.assertEqual(ThreadPolicy(total_cores=16).plan(32, 3), (3, 5)) # Few tasks, multi-threaded workers
+        self.assertEqual(ThreadPolicy(total_cores=16).plan(32, 100), (16, 1))
+
+    def test_fixed_threads(self):
+        self.assertEqual(ThreadPolicy(threads_per_worker=4, total_cores=16).plan(8, 100), (4, 4))
+        self.assertEqual(ThreadPolicy(threads_per_worker=4, total_cores=16).plan(2, 100), (2, 4))
+        self.assertEqual(ThreadPolicy(threads_per_worker=4, total_cores=3).plan(8, 100), (1, 3))
+        self.assertEqual(ThreadPolicy(threads_per_worker=3, total_cores=8).plan(8, 100), (2, 3))
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            ThreadPolicy(threads_per_worker=0)
+        with self.assertRaises(ValueError):
+            ThreadPolicy(total_cores=0)
+        self.assertGreaterEqual(ThreadPolicy().get_total_cores(), 1)
+
+    def test_worker_limits(self):
+        executor = TaskExecutor(processes=2, fn=thread_limits, initializer=init_worker, initargs=({}, 3))
+        for _, _, limits in executor.imap_unordered(range(2)):
+            self.assertEqual(limits, (3, "3"))
+
+
+class TestScheduling(unittest.TestCase):
+    """
+    Test the cost estimates of CostModel and the order lpt_order dispatches tasks in.
+    """
+
+    def test_prior_cost(self):
+        ratio = lambda alg: prior_cost(alg, 2000, 10) / prior_cost(alg, 1000, 10)
+        self.assertEqual(ratio(PC(alpha=0.05)), 2)
+        self.assertEqual(ratio(PC(alpha=0.05, indep_test="kci")), 8)
+        self.assertEqual(ratio(PC(alpha=0.05, indep_test="rff_kci")), 2)
+        self.assertEqual(ratio(PC(alpha=0.05, indep_test="nystroem_kci")), 2)
+        self.assertEqual(ratio(UT_IGSP(alpha_ci=0.05, alpha_inv=0.05)), 4)
+        self.assertEqual(ratio(UT_IGSP(alpha_ci=0.05, alpha_inv=0.05, test="hsic_rff")), 2)
+
+    def test_cost_model(self):
+        model = CostModel()
+        model.add_group("small", GES(), 100, 5)
+        model.add_group("large", GES(), 300, 5)
+        model.add_group("other", VarSortRegress(), 10**6, 50)
+        # Priors normalized by the mean of their class
+        self.assertAlmostEqual(model.estimate("small"), 0.5)
+        self.assertAlmostEqual(model.estimate("large"), 1.5)
+        self.assertAlmostEqual(model.estimate("other"), 1.0)
+        model.observe("small", 2.0)
+        model.observe("small", 4.0)
+        self.assertAlmostEqual(model.estimate("small"), 3.0) # Observed mean
+        self.assertAlmostEqual(model.estimate("large"), 9.0) # Scaled by the same class
+        self.assertAlmostEqual(model.estimate("other"), 6.0) # Scaled by all observed groups
+
+    def test_lpt_order(self):
+        model = CostModel()
+        specs = {}
+        # GES priors are far larger than those of VarSortRegress, they are only comparable within a class
+        for key, algorithm, n in (("ges_small", GES(), 10**5), ("ges_large", GES(), 10**6),
+                                  ("var_small", VarSortRegress(), 10), ("var_large", VarSortRegress(), 100)):
+            model.add_group(key, algorithm, n, 10)
+            specs[key] = iter([f"{key}_{i}" for i in range(2)])
+        order = list(lpt_order(specs, model))
+        self.assertEqual(len(order), 8)
+        self.assertEqual({spec[:-2] for spec in order[:4]}, {"ges_large", "var_large"})
+        # Observed runtimes take over
+        model.observe("var_large", 1.0)
+        model.observe("ges_small", 100.0)
+        specs = {key: iter([key]) for key in ("ges_small", "ges_large", "var_small", "var_large")}
+        self.assertEqual(list(lpt_order(specs, model)), ["ges_large", "ges_small", "var_large", "var_small"])
+
+
+class TestCheckpoint(unittest.TestCase):
+    """
+    Test whether an interrupted Bootstrap resumes from its checkpoint to the
+        same result as an uninterrupted run, and refuses a changed configuration.
+    """
+    setUp = TestWeightedResampling.setUp
+
+    def create_bootstrap(self, checkpoint_dir: str, algorithm=None, **kwargs) -> Bootstrap:
+        return Bootstrap(name="checkpointed", true_dag=self.true_dag, algorithm=algorithm or GES(),
+                         data_to_bootstrap_from=self.data, sample_sizes=[1.0], nr_bootstraps=8,
+                         resampling="index", checkpoint_dir=checkpoint_dir, **kwargs)
+
+    def record_ends(self, path: str) -> list[int]:
+        """Offset after each pickled record (header first) of a checkpoint file."""
+        ends = []
+        with open(path, "rb") as file:
+            while file.peek(1):
+                pickle.load(file)
+                ends.append(file.tell())
+        return ends
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            uninterrupted = self.create_bootstrap(checkpoint_dir)
+            uninterrupted.run_bootstrap()
+            path = os.path.join(checkpoint_dir, "checkpointed.ckpt")
+            ends = self.record_ends(path)
+            self.assertEqual(len(ends), 1 + 8)
+            # Interrupted after three replicates, while writing the fourth
+            with open(path, "r+b") as file:
+                file.truncate(ends[3] + (ends[4] - ends[3]) // 2)
+            resumed = self.create_bootstrap(checkpoint_dir)
+            resumed.run_bootstrap()
+            self.assertEqual(len(self.record_ends(path)), 1 + 8)
+        for result, other in zip(uninterrupted.get_task_results(), resumed.get_task_results(), strict=True):
+            self.assertEqual((result.replicate, result.seed), (other.replicate, other.seed))
+            np.testing.assert_array_equal(result.average_cons_extension, other.average_cons_extension)
+            if result.replicate < 3: # Taken from the checkpoint, not refitted
+                self.assertEqual(result.runtime, other.runtime)
+        pd.testing.assert_frame_equal(uninterrupted.get_avg_avg_cons_extension(), 
+                                      resumed.get_avg_avg_cons_extension(), check_exact=True)
+        self.assertEqual(uninterrupted.get_avg_var_sort(), resumed.get_avg_var_sort())
+
+    def test_changed_config(self):
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            self.create_bootstrap(checkpoint_dir).run_bootstrap()
+            self.create_bootstrap(checkpoint_dir).run_bootstrap() # Unchanged: Resumes
+            for changed in (self.create_bootstrap(checkpoint_dir, algorithm=GES(phases=["forward"])),
+                            self.create_bootstrap(checkpoint_dir, sufficient_statistics=True),
+                            self.create_bootstrap(checkpoint_dir, keep_cons_extensions=True)):
+                with self.assertRaises(ValueError):
+                    changed.run_bootstrap()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,258 @@
+import sys
+sys.path.append("../src/") # Path to causalbenchmark package
+import unittest
+import tempfile
+import pickle
+import numpy as np
+import pandas as pd
+from unittest.mock import patch, Mock
+
+from sempler.utils import all_dags, dag_to_cpdag
+from causalbenchmark.compute.consistent_extensions import *
+from causalbenchmark.compute.consistent_extensions import _split_edges, _connected_components, _factorizes
+from causalbenchmark.compute.causal_inference_task import CausalInferenceTask
+from causalbenchmark.compute.extension_cache import ExtensionCache
+
+
+def random_dag(d: int, density: float, rng: np.random.Generator) -> np.ndarray:
+    """Random binary DAG with a random topological order."""
+    dag = np.triu(rng.random((d, d)) < density, k=1).astype(int)
+    order = rng.permutation(d)
+    return dag[np.ix_(order, order)]
+
+
+def random_pdag(d: int, density: float, rng: np.random.Generator) -> np.ndarray:
+    """Random DAG in which a random half of the edges is made undirected."""
+    pdag = random_dag(d, density, rng)
+    undirected = (pdag != 0) & (rng.random((d, d)) < 0.5)
+    pdag[undirected.T] = 1
+    return pdag
+
+
+def factorizes(pdag: np.ndarray) -> bool:
+    directed, undirected = _split_edges(pdag)
+    return _factorizes(directed, undirected, _connected_components(undirected))
+
+
+class TestAverageConsistentExtension(unittest.TestCase):
+    """
+    Test whether counting the AMOs of the chain components gives the same
+        number and average of the consistent extensions as enumerating them
+        with sempler's all_dags.
+    """
+
+    def assert_same_as_enumeration(self, pdag: np.ndarray):
+        dags = all_dags(pdag)
+        average, nr_extensions = average_consistent_extension(pdag)
+        self.assertEqual(nr_extensions, len(dags))
+        if len(dags) == 0:
+            self.assertIsNone(average)
+        else:
+            np.testing.assert_allclose(average, np.average(dags, axis=0), atol=1e-12)
+
+    def test_cpdags(self):
+        rng = np.random.default_rng(0)
+        for _ in range(100):
+            cpdag = dag_to_cpdag(random_dag(int(rng.integers(2, 9)), rng.uniform(0.2, 0.8), rng))
+            self.assertTrue(factorizes(cpdag))
+            self.assert_same_as_enumeration(cpdag)
+
+    def test_non_factorizing_pdags(self):
+        rng = np.random.default_rng(1)
+        nr_non_factorizing = 0
+        for _ in range(100):
+            pdag = random_pdag(int(rng.integers(3, 8)), rng.uniform(0.3, 0.8), rng)
+            nr_non_factorizing += not factorizes(pdag)
+            self.assert_same_as_enumeration(pdag)
+        self.assertGreater(nr_non_factorizing, 10)
+
+    def test_no_extension(self):
+        # Undirected 4-cycle: Not chordal, every orientation adds a v-structure
+        cycle = np.array([[0, 1, 0, 1], [1, 0, 1, 0], [0, 1, 0, 1], [1, 0, 1, 0]])
+        self.assertEqual(average_consistent_extension(cycle), (None, 0))
+        # Directed cycle 0 -> 1 -> 2 -> 0, with and without an undirected edge 3 - 4
+        pdag = np.zeros((5, 5), dtype=int)
+        pdag[[0, 1, 2], [1, 2, 0]] = 1
+        self.assertEqual(average_consistent_extension(pdag), (None, 0))
+        pdag[3, 4] = pdag[4, 3] = 1
+        self.assertEqual(average_consistent_extension(pdag), (None, 0))
+        self.assert_same_as_enumeration(pdag)
+
+    def test_dag(self):
+        dag = random_dag(5, 0.6, np.random.default_rng(2))
+        average, nr_extensions = average_consistent_extension(dag)
+        np.testing.assert_array_equal(average, dag)
+        self.assertEqual(nr_extensions, 1)
+        self.assertEqual(exact_cost(dag), 0)
+
+    def test_large_component(self):
+        # Complete graph: Every order is an AMO, each edge is oriented either way in half of them
+        complete = 1 - np.eye(7)
+        average, nr_extensions = average_consistent_extension(complete)
+        self.assertEqual(nr_extensions, 5040)
+        np.testing.assert_allclose(average, complete / 2)
+
+
+class TestSampledConsistentExtensions(unittest.TestCase):
+    """
+    Test whether the sampled average consistent extension converges to the
+        exact one within its Monte Carlo error, and when it is used.
+    """
+
+    def assert_converges(self, pdag: np.ndarray):
+        exact, nr_extensions = average_consistent_extension(pdag)
+        errors = []
+        for nr_samples in (100, 2000):
+            estimate, nr_sampled_extensions, mc_error = sample_consistent_extensions(
+                pdag, nr_samples, np.random.default_rng(0))
+            self.assertIn(nr_sampled_extensions, (nr_extensions, None))
+            self.assertGreater(mc_error, 0)
+            self.assertTrue((np.abs(estimate - exact) <= 5 * mc_error + 1e-12).all())
+            errors.append(mc_error)
+        self.assertLess(errors[1], errors[0] / 3)
+
+    def test_factorizing_pdag(self):
+        pdag = dag_to_cpdag(np.triu(np.ones((6, 6), dtype=int), k=1))
+        pdag[0, 5] = pdag[5, 0] = 0 # Chordal but not complete
+        self.assertTrue(factorizes(pdag))
+        self.assert_converges(pdag)
+
+    def test_non_factorizing_pdag(self):
+        rng = np.random.default_rng(3)
+        pdag = random_pdag(6, 0.7, rng)
+        while factorizes(pdag) or average_consistent_extension(pdag)[1] < 3:
+            pdag = random_pdag(6, 0.7, rng)
+        self.assert_converges(pdag)
+
+    def test_all_rejected(self):
+        pdag = np.array([[0, 1, 0], [0, 0, 1], [0, 1, 0]]) # 0 -> 1 - 2, does not factorize
+        self.assertFalse(factorizes(pdag))
+        with patch("causalbenchmark.compute.consistent_extensions._draw_by_rejection", return_value=iter(())), \
+                patch("causalbenchmark.compute.consistent_extensions.all_dags") as mock_all_dags:
+            estimate, nr_extensions, mc_error = sample_consistent_extensions(pdag, 10, np.random.default_rng(0))
+        mock_all_dags.assert_not_called() # Never enumerates
+        self.assertIsNone(estimate)
+        self.assertIsNone(nr_extensions)
+        self.assertTrue(np.isnan(mc_error))
+        # The task has no estimate, but its graph does have consistent extensions
+        var = ["A", "B", "C"]
+        algorithm = Mock()
+        algorithm.supports_suffstats.return_value = False
+        algorithm.fit.return_value = (pd.DataFrame(pdag, index=var, columns=var), 0.1)
+        task = CausalInferenceTask(algorithm, [pd.DataFrame(np.random.randn(50, 3), columns=var)],
+                                   true_dag=pd.DataFrame(pdag * 0, index=var, columns=var), extensions="sampled")
+        with patch("causalbenchmark.compute.consistent_extensions._draw_by_rejection", return_value=iter(())):
+            task.run_task()
+        self.assertIsNone(task.get_average_cons_extension())
+        self.assertFalse(task.get_no_consistent_extensions_flag())
+        self.assertTrue(np.isnan(task.get_cons_extension_mc_error()))
+
+    def test_auto_switch(self):
+        var = ["A", "B", "C"]
+        pdag = pd.DataFrame(np.array([[0, 1, 1], [1, 0, 1], [1, 1, 0]]), index=var, columns=var)
+        algorithm = Mock()
+        algorithm.supports_suffstats.return_value = False
+        algorithm.fit.return_value = (pdag, 0.1)
+        for cost, sampled in ((1.0, False), (1e9, True)):
+            task = CausalInferenceTask(algorithm, [pd.DataFrame(np.random.randn(50, 3), columns=var)],
+                                       true_dag=pdag * 0, max_exact_cost=1e6, seed=0)
+            with patch("causalbenchmark.compute.causal_inference_task.exact_cost", return_value=cost) as mock_cost:
+                task.run_task()
+            mock_cost.assert_called_once()
+            self.assertEqual(task.get_cons_extension_mc_error() > 0, sampled)
+            np.testing.assert_allclose(task.get_average_cons_extension().values, pdag.values / 2, atol=0.1)
+
+
+class TestPackedExtensions(unittest.TestCase):
+    """
+    Test whether consistent extensions are kept bit-packed only if requested
+        and unpacked into the enumerated ones.
+    """
+
+    def test_round_trip(self):
+        rng = np.random.default_rng(4)
+        for _ in range(20):
+            d = int(rng.integers(2, 8)) # Not always a multiple of 8 entries
+            cpdag = dag_to_cpdag(random_dag(d, rng.uniform(0.3, 0.8), rng))
+            dags = np.array(all_dags(cpdag))
+            packed = pack_extensions(dags)
+            self.assertEqual((packed.dtype, packed.shape), (np.uint8, (len(dags), -(-d*d // 8))))
+            np.testing.assert_array_equal(unpack_extensions(packed, cpdag), dags)
+            # Edge weights are taken from the PDAG
+            weights = rng.uniform(1, 2, (d, d))
+            np.testing.assert_array_equal(unpack_extensions(packed, cpdag * weights), dags * weights)
+        self.assertEqual(unpack_extensions(pack_extensions([]), cpdag).shape, (0, d, d))
+
+    def run_task(self, keep_cons_extensions: bool) -> CausalInferenceTask:
+        var = ["A", "B", "C", "D"]
+        pdag = pd.DataFrame(dag_to_cpdag(np.triu(np.ones((4, 4), dtype=int), k=1)), index=var, columns=var)
+        pdag.iloc[0, 3] = pdag.iloc[3, 0] = 0
+        algorithm = Mock()
+        algorithm.supports_suffstats.return_value = False
+        algorithm.fit.return_value = (pdag, 0.1)
+        task = CausalInferenceTask(algorithm, [pd.DataFrame(np.random.randn(50, 4), columns=var)],
+                                   true_dag=pdag * 0, extensions="exact", keep_cons_extensions=keep_cons_extensions)
+        task.run_task()
+        return task
+
+    def test_kept(self):
+        task = self.run_task(keep_cons_extensions=True)
+        dags = np.array(all_dags(task.get_estimated_graph().values))
+        np.testing.assert_array_equal(task.get_all_cons_extensions(), dags)
+        result = pickle.loads(pickle.dumps(task.to_result()))
+        self.assertEqual(len(result.packed_cons_extensions), task.get_nr_cons_extensions())
+        np.testing.assert_array_equal(result.get_all_cons_extensions(), dags)
+
+    def test_not_kept(self):
+        task = self.run_task(keep_cons_extensions=False)
+        result = task.to_result()
+        self.assertIsNone(result.packed_cons_extensions)
+        self.assertIsNone(result.get_all_cons_extensions())
+        # The task enumerates them instead
+        np.testing.assert_array_equal(task.get_all_cons_extensions(), all_dags(task.get_estimated_graph().values))
+
+
+class TestExtensionCache(unittest.TestCase):
+    """
+    Test the LRU limit, the disk persistence and the hit counting of ExtensionCache.
+    """
+
+    def setUp(self):
+        self.pdags = [dag_to_cpdag(random_dag(4, 0.7, np.random.default_rng(seed))) for seed in range(3)]
+        self.computed = []
+
+    def compute(self, pdag: np.ndarray) -> tuple:
+        self.computed.append(pdag)
+        return average_consistent_extension(pdag)
+
+    def test_hits_and_lru(self):
+        cache = ExtensionCache(max_entries=2)
+        self.assertEqual(cache.get_stats()["hit_rate"], 0.0)
+        first, hit = cache.get_or_compute(self.pdags[0], self.compute)
+        self.assertFalse(hit)
+        np.testing.assert_array_equal(first[0], average_consistent_extension(self.pdags[0])[0])
+        self.assertTrue(cache.get_or_compute(self.pdags[0].copy(), self.compute)[1])
+        cache.get_or_compute(self.pdags[1], self.compute)
+        cache.get_or_compute(self.pdags[0], self.compute) # 1 is now least recently used
+        cache.get_or_compute(self.pdags[2], self.compute) # Evicts 1
+        self.assertEqual(cache.get_stats(), {"hits": 2, "disk_hits": 0, "misses": 3, "hit_rate": 0.4, "entries": 2})
+        self.assertTrue(cache.get_or_compute(self.pdags[0], self.compute)[1])
+        self.assertFalse(cache.get_or_compute(self.pdags[1], self.compute)[1])
+        self.assertEqual(len(self.computed), 4)
+        with self.assertRaises(ValueError):
+            ExtensionCache(max_entries=0)
+
+    def test_disk_persistence(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            ExtensionCache(cache_dir=cache_dir).get_or_compute(self.pdags[0], self.compute)
+            other_process = ExtensionCache(cache_dir=cache_dir)
+            result, hit = other_process.get_or_compute(self.pdags[0], self.compute)
+            self.assertTrue(hit)
+            self.assertEqual(len(self.computed), 1)
+            self.assertEqual(result[1], average_consistent_extension(self.pdags[0])[1])
+            self.assertEqual(other_process.get_stats()["disk_hits"], 1)
+            self.assertFalse(other_process.get_or_compute(self.pdags[1], self.compute)[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
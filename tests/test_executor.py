@@ -0,0 +1,138 @@
+import sys
+sys.path.append("../src/") # Path to causalbenchmark package
+import unittest
+import os
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+import string
+import psutil
+
+from causalbenchmark.compute import Bootstrap
+from causalbenchmark.compute.algorithms import Algorithm
+from causalbenchmark.compute.executor import TaskExecutor, TASK_DONE, TASK_TIMED_OUT, TASK_CRASHED, \
+    TASK_MEMORY_EXCEEDED
+
+
+def misbehave(item: tuple):
+    """Task run by the workers, item is (behavior, argument)."""
+    behavior, argument = item
+    if behavior == "sleep":
+        time.sleep(argument)
+    elif behavior == "exit":
+        os._exit(1)
+    elif behavior == "exit_once": # Dies on the first attempt, argument is a marker file
+        if not os.path.exists(argument):
+            open(argument, "w").close()
+            os._exit(1)
+    elif behavior == "raise":
+        raise RuntimeError(argument)
+    elif behavior == "allocate": # Holds argument bytes until stopped
+        memory = np.ones(argument // 8)
+        time.sleep(30)
+    elif behavior == "pid":
+        return os.getpid()
+    return argument
+
+
+class MisbehavingAlgorithm(Algorithm):
+    """Algorithm whose fit misbehaves like the task misbehave."""
+    def __init__(self, behavior: str, argument):
+        super().__init__(alg_name=self.__class__.__name__)
+        self._behavior = behavior
+        self._argument = argument
+
+    def fit(self, data):
+        misbehave((self._behavior, self._argument))
+
+
+class TestTaskExecutor(unittest.TestCase):
+    """
+    Test whether the TaskExecutor stops, retries and replaces misbehaving
+        worker processes and reports the outcome of each task.
+    """
+
+    def run_executor(self, items: list, **kwargs) -> dict:
+        """Outcome and value per item."""
+        executor = TaskExecutor(fn=misbehave, **kwargs)
+        return {item: (outcome, value) for item, outcome, value in executor.imap_unordered(items)}
+
+    def test_timeout(self):
+        start = time.monotonic()
+        outcomes = self.run_executor([("sleep", 30), ("sleep", 0.1), ("echo", 1)], processes=2, timeout=1)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(outcomes, {("sleep", 30): (TASK_TIMED_OUT, None),
+                                    ("sleep", 0.1): (TASK_DONE, 0.1),
+                                    ("echo", 1): (TASK_DONE, 1)})
+
+    def test_retry(self):
+        with tempfile.TemporaryDirectory() as directory:
+            items = [("exit", 1), ("exit_once", os.path.join(directory, "a")), ("echo", 2)]
+            self.assertEqual(self.run_executor(items, processes=2, max_retries=1),
+                             {items[0]: (TASK_CRASHED, None), items[1]: (TASK_DONE, items[1][1]),
+                              items[2]: (TASK_DONE, 2)})
+            # Not retried without retries
+            items = [("exit_once", os.path.join(directory, "b"))]
+            self.assertEqual(self.run_executor(items, processes=1), {items[0]: (TASK_CRASHED, None)})
+
+    def test_memory_limit(self):
+        # Limit relative to the memory of the forked workers, which start as a copy of this process
+        memory_limit = psutil.Process().memory_info().rss + 100 * 2**20
+        start = time.monotonic()
+        outcomes = self.run_executor([("allocate", 300 * 2**20), ("echo", 1)], processes=2, memory_limit=memory_limit)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(outcomes, {("allocate", 300 * 2**20): (TASK_MEMORY_EXCEEDED, None), ("echo", 1): (TASK_DONE, 1)})
+
+    def test_max_tasks_per_child(self):
+        pids = [pid for _, _, pid in TaskExecutor(fn=misbehave, processes=1, max_tasks_per_child=2).imap_unordered(
+            [("pid", i) for i in range(6)])]
+        self.assertEqual(len(pids), 6)
+        self.assertEqual(len(set(pids)), 3)
+        self.assertEqual(sorted(pids.count(pid) for pid in set(pids)), [2, 2, 2])
+
+    def test_exception(self):
+        with self.assertRaises(RuntimeError):
+            self.run_executor([("raise", "fails")], processes=1)
+
+
+class TestFailedTaskResults(unittest.TestCase):
+    """
+    Test how the outcomes of stopped or dead workers are recorded in the TaskResults of a Bootstrap.
+    """
+
+    def run_bootstrap(self, algorithm: Algorithm, **kwargs) -> Bootstrap:
+        var = list(string.ascii_uppercase[:3])
+        true_dag = pd.DataFrame(np.zeros((3, 3), dtype=int), index=var, columns=var)
+        data = [pd.DataFrame(np.random.default_rng(0).standard_normal((50, 3)), columns=var)]
+        bootstrap = Bootstrap(name="failing", true_dag=true_dag, algorithm=algorithm, data_to_bootstrap_from=data,
+                              sample_sizes=[1.0], nr_bootstraps=2, resampling="index", PROCESSES=2, **kwargs)
+        bootstrap.run_bootstrap()
+        return bootstrap
+
+    def assert_failed(self, bootstrap: Bootstrap, flag: str):
+        for result in bootstrap.get_task_results():
+            flags = {name: getattr(result, name) for name in ("algorithm_crashed", "timed_out", "memory_exceeded")}
+            self.assertEqual(flags, {name: name == flag for name in flags})
+            self.assertEqual(result.estimated_graph.sum(), 0)
+            self.assertIsNone(result.var_sort)
+
+    def test_timed_out(self):
+        bootstrap = self.run_bootstrap(MisbehavingAlgorithm("sleep", 30), timeout=1)
+        self.assert_failed(bootstrap, "timed_out")
+        self.assertEqual(bootstrap.get_avg_timed_out(), 1)
+
+    def test_crashed(self):
+        bootstrap = self.run_bootstrap(MisbehavingAlgorithm("exit", None), max_retries=1)
+        self.assert_failed(bootstrap, "algorithm_crashed")
+        self.assertEqual(bootstrap.get_avg_alg_crashed(), 1)
+
+    def test_memory_exceeded(self):
+        memory_limit = psutil.Process().memory_info().rss + 100 * 2**20
+        bootstrap = self.run_bootstrap(MisbehavingAlgorithm("allocate", 300 * 2**20), memory_limit=memory_limit)
+        self.assert_failed(bootstrap, "memory_exceeded")
+        self.assertEqual(bootstrap.get_avg_memory_exceeded(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
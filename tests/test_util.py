@@ -2,6 +2,7 @@ import sys
 sys.path.append("../src/") # Path to causalbenchmark package
 import unittest
 import time
+import numpy as np
 import pandas as pd
 from unittest.mock import patch
 
@@ -151,6 +152,106 @@ class TestDataFrameOperations(unittest.TestCase):
         with self.assertRaises(AssertionError):
             bootstrap_sample([self.df1, self.df2], [0.5, 0.5, 0.5], seed=1)
 
+    def test_absolute_sample_size(self):
+        self.assertEqual(absolute_sample_size(0.25, 4), 1)
+        self.assertEqual(absolute_sample_size(1, 3), 3)
+        self.assertEqual(absolute_sample_size(1/3, 3), 1)
+        self.assertEqual(absolute_sample_size(7, 3), 7)
+        with self.assertRaises(ValueError):
+            absolute_sample_size(-1, 3)
+
+    def test_bootstrap_indices(self):
+        dfs = [self.df1, self.df2, self.df3]
+        sample_sizes = [0.25, 5, 1]
+        indices = bootstrap_indices(dfs, sample_sizes, seed=1)
+        self.assertEqual(len(indices), len(dfs))
+        for idx, df, size in zip(indices, dfs, [1, 5, 2]):
+            self.assertEqual(len(idx), size)
+            self.assertTrue(((0 <= idx) & (idx < len(df))).all())
+            self.assertEqual(idx.dtype, np.uint8) # Smallest type that can index the df
+
+        # Same seed -> same sample, different seed -> (very likely) different sample
+        indices_again = bootstrap_indices(dfs, sample_sizes, seed=1)
+        for idx, idx_again in zip(indices, indices_again):
+            np.testing.assert_array_equal(idx, idx_again)
+        large_df = pd.DataFrame({'X': np.arange(1000)})
+        self.assertFalse(np.array_equal(bootstrap_indices([large_df], [1000], seed=1)[0],
+                                        bootstrap_indices([large_df], [1000], seed=2)[0]))
+
+        with self.assertRaises(ValueError):
+            bootstrap_indices(dfs, [-1, 0.5, 2], seed=1)
+        with self.assertRaises(AssertionError):
+            bootstrap_indices([self.df1, self.df2], [0.5, 0.5, 0.5], seed=1)
+
+    def test_gather_sample(self):
+        dfs = [self.df1, self.df4]
+        indices = [np.array([3, 3, 0], dtype=np.uint8), np.array([1], dtype=np.uint8)]
+        sample = gather_sample(dfs, indices)
+        self.assertEqual(len(sample), 2)
+        self.assertEqual(sample[0]['X'].tolist(), [4, 4, 1])
+        self.assertEqual(sample[1]['Y'].tolist(), [0.4])
+        self.assertTrue(same_columns([sample[0], self.df1]))
+        with self.assertRaises(AssertionError):
+            gather_sample(dfs, indices[:1])
+
+    def test_bootstrap_weights(self):
+        dfs = [self.df1, self.df2, self.df3]
+        sample_sizes = [0.25, 5, 1]
+        # Multinomial weights count the rows bootstrap_indices draws
+        weights = bootstrap_weights(dfs, sample_sizes, seed=1)
+        for weight, idx, df in zip(weights, bootstrap_indices(dfs, sample_sizes, seed=1), dfs):
+            np.testing.assert_array_equal(weight, np.bincount(idx, minlength=len(df)))
+            self.assertEqual(weight.dtype, np.uint8)
+        # Poisson weights meet the sample size in expectation
+        large_df = pd.DataFrame({'X': np.arange(10000)})
+        poisson_weights = bootstrap_weights([large_df], [5000], seed=1, method="poisson")[0]
+        self.assertEqual(len(poisson_weights), 10000)
+        self.assertAlmostEqual(poisson_weights.sum() / 5000, 1, delta=0.05)
+        np.testing.assert_array_equal(poisson_weights,
+                                      bootstrap_weights([large_df], [5000], seed=1, method="poisson")[0])
+        # Small environments would often get no observation at all, they are redrawn
+        small_df = pd.DataFrame({'X': np.arange(3)})
+        for seed in range(50):
+            self.assertGreater(bootstrap_weights([small_df], [1], seed=seed, method="poisson")[0].sum(), 0)
+        with self.assertRaises(ValueError):
+            bootstrap_weights(dfs, sample_sizes, seed=1, method="bayesian")
+
+    def test_gather_weighted_sample(self):
+        dfs = [self.df1, self.df4]
+        weights = [np.array([2, 0, 0, 1]), np.array([0, 1, 0])]
+        sample = gather_weighted_sample(dfs, weights)
+        self.assertEqual(sample[0]['X'].tolist(), [1, 1, 4])
+        self.assertEqual(sample[1]['Y'].tolist(), [0.4])
+        self.assertTrue(same_columns([sample[0], self.df1]))
+        with self.assertRaises(AssertionError):
+            gather_weighted_sample(dfs, weights[:1])
+
+    def test_bootstrap_counts(self):
+        dfs = [self.df1, self.df2, self.df3]
+        sample_sizes = [0.25, 5, 1]
+        counts = bootstrap_counts(dfs, sample_sizes, seeds=[1, 4])
+        self.assertEqual([count.shape for count in counts], [(2, 4), (2, 3), (2, 2)])
+        # Row b counts the rows of the sample bootstrap_indices draws with seed b
+        for b, seed in enumerate([1, 4]):
+            for count, idx, df in zip(counts, bootstrap_indices(dfs, sample_sizes, seed=seed), dfs):
+                np.testing.assert_array_equal(count[b], np.bincount(idx, minlength=len(df)))
+        with self.assertRaises(AssertionError):
+            bootstrap_counts([self.df1, self.df2], [0.5, 0.5, 0.5], seeds=[1])
+
+    def test_batched_covariances(self):
+        data = self.df4.values
+        counts = np.array([[1, 1, 1], [3, 0, 1], [0, 2, 0]])
+        for chunk_bytes in (2**26, 1): # One chunk, one row per chunk
+            n_obs, means, covariances = batched_covariances(data, counts, chunk_bytes=chunk_bytes)
+            np.testing.assert_array_equal(n_obs, [3, 4, 2])
+            for b, count in enumerate(counts):
+                sample = np.repeat(data, count, axis=0)
+                np.testing.assert_allclose(means[b], sample.mean(axis=0))
+                np.testing.assert_allclose(covariances[b], np.cov(sample, rowvar=False, ddof=0), atol=1e-12)
+        correlations = batched_correlations(covariances)
+        np.testing.assert_allclose(correlations[0], np.corrcoef(data, rowvar=False))
+        np.testing.assert_allclose(np.diagonal(correlations, axis1=1, axis2=2)[:2], 1)
+
     def test_standardize_dfs(self):
         original_dfs = [self.df1, self.df2, self.df3, self.df4]
         stand_dfs = standardize_dfs(original_dfs)